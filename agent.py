@@ -1,27 +1,152 @@
 import os
 import json
 import re
-import openai
+import time
+import asyncio
+import logging
 import numpy as np
-from utils import load_faiss_index, fetch_product_by_id, get_embeddings, topk_products_from_index, GoogleReviewService
+import metrics
+import resilience
+from resilience import get_breaker, Unavailable
+from recommendations import CompleteTheLookTable
+from lexical import BM25Index, KeywordIndex, reciprocal_rank_fusion
+from context_vectors import FacetVectorCache, DEFAULT_FACET_WEIGHTS, facet_texts, compose_query_vector
+from utils import load_faiss_index, fetch_product_by_id, get_embeddings, topk_products_from_index, GoogleReviewService, \
+    MaterialAnalyzer, topk_batch_from_index, load_full_precision_vectors, load_id_map, file_sha256
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+
+logger = logging.getLogger(__name__)
+
+OPENAI_EMBEDDING_DIM = 1536
+# Seconds per lookbook completion request (further limited by the request budget)
+LLM_TIMEOUT = 30
+
+
+def _openai():
+    """Imports the OpenAI client on first LLM call, keeping `import agent` cheap."""
+    import openai
+    if OPENAI_API_KEY:
+        openai.api_key = OPENAI_API_KEY
+    return openai
+
+# Keyword sets for sentiment and slot detection, matched on tokens (plurals
+# folded) rather than raw substrings, so "top" no longer fires on "stop".
+NEGATIVE_WORDS = KeywordIndex(["angry", "bad", "hate", "hated", "wrong", "broken", "broke", "terrible", "return",
+                               "returned", "returning", "stupid"])
+ITEM_WORDS = KeywordIndex(["dress", "shoe", "shirt", "pant", "jacket", "bracelet", "necklace", "heel", "accessory",
+                           "bag", "watch", "suit", "top", "jeans", "leather belt"])
+BUDGET_WORDS = KeywordIndex(["dollar", "budget", "under", "price"])
+OCCASION_WORDS = KeywordIndex(["formal", "casual", "wedding", "party", "office"])
 
 class ShoppingAgent:
+    # Per-stage timeouts (seconds) for the async pipeline. A stage that runs
+    # past its budget resolves to its fallback instead of blocking the turn.
+    STAGE_TIMEOUTS = {
+        "skin": 20.0,
+        "embed": 10.0,
+        "search": 2.0,
+        "fetch": 5.0,
+        "enrich": 3.0,
+        "llm": 30.0,
+        "resolve": 3.0
+    }
+
+    # End-to-end budget (seconds) for one chat turn. Each stage on the
+    # critical path may use its share of whatever is left of it, relative to
+    # the stages still ahead, so time a fast stage saves goes to later ones.
+    # Skin analysis overlaps retrieval and gets the retrieval stages' share.
+    REQUEST_BUDGET = 15.0
+    CRITICAL_PATH = ("embed", "search", "fetch", "enrich", "llm", "resolve")
+    STAGE_SHARES = {
+        "embed": 1.0,
+        "search": 0.5,
+        "fetch": 0.5,
+        "enrich": 1.0,
+        "llm": 6.0,
+        "resolve": 0.5
+    }
+
+    # Hybrid retrieval: dense candidates per requested result, and the weight
+    # of the BM25 ranking relative to the dense one in rank fusion.
+    HYBRID_CANDIDATES = 3
+    LEXICAL_WEIGHT = 0.8
+
     def __init__(self, index_path_openai="product_index_openai.faiss",
                  index_path_local="product_index_local.faiss",
-                 emb_method="openai"):
+                 emb_method="openai", stage_timeouts=None, recs_path=None,
+                 lexical_path="product_index.bm25.npz", facet_weights=None, id_map_path=None,
+                 catalog_path="sample_data/products.csv", request_budget=None):
         self.emb_method = emb_method
+        self.catalog_path = catalog_path
+        # Row -> product id from the build; without one, rows follow catalog order (row i = id i + 1).
+        self.row_ids = load_id_map(id_map_path)
+        self._row_of = {pid: row for row, pid in enumerate(self.row_ids)} if self.row_ids else None
         self.index_openai = load_faiss_index(index_path_openai)
         self.index_local = load_faiss_index(index_path_local)
         self.index = self.index_openai if emb_method == "openai" else self.index_local
+        # Exact vectors for re-ranking a compressed index's shortlist (None for flat indices)
+        self.rerank_vectors = load_full_precision_vectors(
+            index_path_openai if emb_method == "openai" else index_path_local)
         self.name = "Kai"
+        self.stage_timeouts = dict(self.STAGE_TIMEOUTS, **(stage_timeouts or {}))
+        self.request_budget = request_budget if request_budget is not None else self.REQUEST_BUDGET
+        self.recs_table = self._load_recs_table(
+            recs_path if recs_path is not None else f"complete_the_look_{emb_method}.npz")
+        self.lexical = BM25Index.load(lexical_path) if lexical_path and os.path.exists(lexical_path) else None
+        self.facet_weights = dict(DEFAULT_FACET_WEIGHTS, **(facet_weights or {}))
+        self.facet_cache = FacetVectorCache(
+            lambda texts: get_embeddings(texts, model=self.emb_method, dimensions=self.query_dimensions,
+                                         with_fallback=True))
+
+    @classmethod
+    def from_manifest(cls, manifest_path="manifest.json", emb_method="openai", verify=False, **kwargs):
+        """
+        Loads the artefact set written by build_index.py: indices, id map,
+        catalog snapshot, BM25 index and recommendation table, with paths
+        relative to the manifest. `verify` re-hashes every file first.
+        """
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        base = os.path.dirname(os.path.abspath(manifest_path))
+
+        def path_of(entry):
+            return os.path.join(base, entry["path"]) if entry else None
+
+        if emb_method not in manifest["indices"]:
+            raise ValueError(f"{manifest_path} has no '{emb_method}' index (built: {', '.join(manifest['indices'])})")
+        entries = [manifest["catalog"], manifest["id_map"], manifest["lexical"]]
+        for entry in list(manifest["indices"].values()) + list(manifest.get("recommendations", {}).values()):
+            entries += [entry, entry.get("full_precision")]
+        if verify:
+            for entry in filter(None, entries):
+                if file_sha256(path_of(entry)) != entry["sha256"]:
+                    raise ValueError(f"{entry['path']} does not match the hash in {manifest_path}")
+
+        indices = manifest["indices"]
+        return cls(index_path_openai=path_of(indices.get("openai")),
+                   index_path_local=path_of(indices.get("local")),
+                   emb_method=emb_method,
+                   # "" = no table in this build, rather than the default path in the working directory
+                   recs_path=path_of(manifest.get("recommendations", {}).get(emb_method)) or "",
+                   lexical_path=path_of(manifest["lexical"]),
+                   id_map_path=path_of(manifest["id_map"]),
+                   catalog_path=path_of(manifest["catalog"]),
+                   **kwargs)
+
+    @staticmethod
+    def _load_recs_table(path):
+        """Precomputed complete-the-look table from build_recommendations.py, if present."""
+        if not os.path.exists(path):
+            return None
+        try:
+            return CompleteTheLookTable.load(path)
+        except Exception as e:
+            logger.warning("Could not load recommendation table %s: %s", path, e)
+            return None
 
     def _detect_sentiment(self, text):
-        negatives = ["angry", "bad", "hate", "wrong", "broken", "terrible", "return", "stupid"]
-        if any(w in text.lower() for w in negatives):
+        if NEGATIVE_WORDS.matches(text):
             return "negative"
         return "neutral"
 
@@ -33,65 +158,126 @@ class ShoppingAgent:
             return None
 
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Analyze the skin tone in this image. 1. Identify the skin tone (e.g., Fair, Olive, Deep) and Undertone (Cool, Warm). 2. Suggest 3 specific color palettes that suit this person best for clothing. Output a short, concise summary string."},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                        ]
-                    }
-                ],
-                max_tokens=150
-            )
+            with get_breaker("openai").call(timeout=self.stage_timeouts["skin"]) as call, metrics.timed("llm.vision"):
+                response = _openai().ChatCompletion.create(
+                    model="gpt-4o",
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": "Analyze the skin tone in this image. 1. Identify the skin tone (e.g., Fair, Olive, Deep) and Undertone (Cool, Warm). 2. Suggest 3 specific color palettes that suit this person best for clothing. Output a short, concise summary string."},
+                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+                            ]
+                        }
+                    ],
+                    max_tokens=150,
+                    request_timeout=call.timeout
+                )
             analysis = response.choices[0].message.content
             return analysis
+        except Unavailable as e:
+            metrics.record_fallback("llm.vision", e.reason)
+            return None
         except Exception as e:
-            print(f"Vision API Error: {e}")
+            logger.warning("Vision API Error: %s", e)
+            metrics.record_fallback("llm.vision", "error")
             return None
 
-    def retrieve(self, text, k=8):
-        if not self.index:
-            return [], []
+    # -------------------------------------------------
+    # Retrieval stages
+    # -------------------------------------------------
+    @property
+    def query_dimensions(self):
+        """
+        Output size to request from the OpenAI embedding API: an OpenAI index
+        narrower than the full model was built from shortened embeddings.
+        PCA-reduced indices keep the full input width and project internally.
+        """
+        if self.emb_method == "openai" and self.index is not None and self.index.d != OPENAI_EMBEDDING_DIM:
+            return self.index.d
+        return None
 
-        emb = get_embeddings([text], model=self.emb_method)[0]
-        emb = np.ascontiguousarray(emb, dtype=np.float32)
+    def _embed_query(self, text, context=None):
+        """
+        Embeds `text` alone, or, with a `context` dict (see
+        context_vectors.facet_texts), composes the query from the text
+        embedding and cached facet embeddings using `facet_weights`.
+        """
+        if not context:
+            emb = get_embeddings([text], model=self.emb_method, dimensions=self.query_dimensions)[0]
+            return np.ascontiguousarray(emb, dtype=np.float32)
+
+        facets = facet_texts(context)
+        names = ["query"] + list(facets)
+        vectors = self.facet_cache.get_many(list(facets.values()), transient=[text])
+        return compose_query_vector(dict(zip(names, vectors)), self.facet_weights)
+
+    def _search(self, emb, k, text=None):
+        """
+        Dense top-k; when `text` is given and a BM25 index is loaded, dense
+        and lexical candidates are fused by reciprocal rank (the returned
+        scores are then fusion scores, not cosine similarities).
+        """
+        if text is None or self.lexical is None:
+            return topk_products_from_index(self.index, emb, k=k, rerank_vectors=self.rerank_vectors)
+        dense_ids, _ = topk_products_from_index(self.index, emb, k=k * self.HYBRID_CANDIDATES,
+                                                rerank_vectors=self.rerank_vectors)
+        with metrics.timed("lexical.search"):
+            lexical_ids, _ = self.lexical.search(text, k=k * self.HYBRID_CANDIDATES)
+        return reciprocal_rank_fusion([dense_ids, lexical_ids], [1.0, self.LEXICAL_WEIGHT], limit=k)
+
+    def _product_id_for_row(self, row):
+        return self.row_ids[row] if self.row_ids else str(row + 1)
 
-        ids, sims = topk_products_from_index(self.index, emb, k=k)
+    def _row_for_product_id(self, product_id):
+        if self._row_of is not None:
+            return self._row_of.get(str(product_id), -1)
+        return int(product_id) - 1
 
+    def _fetch_product(self, product_id):
+        return fetch_product_by_id(product_id, self.catalog_path)
+
+    def _fetch_products(self, ids):
         products = []
         for pid in ids:
-            p = fetch_product_by_id(str(pid + 1))
+            if pid < 0: continue
+            p = self._fetch_product(self._product_id_for_row(pid))
             if p: products.append(p)
+        return products
 
-        return products, sims
+    def retrieve(self, text, k=8, context=None):
+        if not self.index:
+            return [], []
 
-    def generate_lookbook(self, user_request, retrieved_products, chat_history=[], raw_input="", skin_analysis_result=None):
-        """
-        Generates lookbook. Now includes External Review Scanning and Skin Tone Analysis.
-        """
-        sentiment = self._detect_sentiment(user_request)
+        emb = self._embed_query(text, context)
+        ids, sims = self._search(emb, k, text)
+        return self._fetch_products(ids), sims
 
-        # Budget Logic
-        budget_limit = None
+    # -------------------------------------------------
+    # Lookbook stages
+    # -------------------------------------------------
+    @staticmethod
+    def _apply_budget(retrieved_products, raw_input):
         numbers = re.findall(r'\d+', raw_input)
         if numbers:
             potential_budgets = [int(n) for n in numbers if int(n) > 20]
             if potential_budgets:
                 budget_limit = max(potential_budgets)
-                retrieved_products = [p for p in retrieved_products if p['price'] <= budget_limit]
+                return [p for p in retrieved_products if p['price'] <= budget_limit]
+        return retrieved_products
 
-        # ---------------------------------------------------------
-        # NEW LOGIC: Augment products with External Google Reviews
-        # ---------------------------------------------------------
+    @staticmethod
+    def _attach_rating(product, review_data):
+        product['ext_rating'] = review_data['rating']
+        product['ext_source'] = review_data['source']
+
+    def _enrich_reviews(self, products):
         # We only check the top 5 filtered products to save API calls/latency
-        for p in retrieved_products[:5]:
-            review_data = GoogleReviewService.fetch_rating(p['title'])
-            p['ext_rating'] = review_data['rating']
-            p['ext_source'] = review_data['source']
+        top = products[:5]
+        for p, review_data in zip(top, GoogleReviewService.fetch_ratings([p['title'] for p in top])):
+            self._attach_rating(p, review_data)
 
+    def _build_prompts(self, user_request, retrieved_products, chat_history, skin_analysis_result):
         # Serialize product context with RATINGS
         ctx_items = []
         for p in retrieved_products:
@@ -133,33 +319,46 @@ class ShoppingAgent:
             "Task: Determine if you have enough info. If yes, return lookbook with top rated items prioritized."
             "Return JSON format: { 'chat_response': 'string', 'lookbook': [ {'product_id': id, 'reason': 'short reason'} ] }"
         )
+        return system_prompt, user_prompt, history_context
 
-        if OPENAI_API_KEY:
-            try:
-                resp = openai.ChatCompletion.create(
+    @staticmethod
+    def _call_llm(system_prompt, user_prompt):
+        if not OPENAI_API_KEY:
+            metrics.record_fallback("llm.lookbook", "no_api_key")
+            return None
+        try:
+            with get_breaker("openai").call(timeout=LLM_TIMEOUT) as call, metrics.timed("llm.lookbook"):
+                resp = _openai().ChatCompletion.create(
                     model="gpt-4o-mini",
                     messages=[
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": user_prompt}
                     ],
                     temperature=0.3,
-                    max_tokens=600
+                    max_tokens=600,
+                    request_timeout=call.timeout
                 )
-                content = resp["choices"][0]["message"]["content"]
-                if content.startswith("```json"):
-                    content = content.replace("```json", "").replace("```", "")
-                return json.loads(content)
-            except Exception as e:
-                print(f"LLM Error: {e}")
+            content = resp["choices"][0]["message"]["content"]
+            if content.startswith("```json"):
+                content = content.replace("```json", "").replace("```", "")
+            return json.loads(content)
+        except Unavailable as e:
+            metrics.record_fallback("llm.lookbook", e.reason)
+            return None
+        except Exception as e:
+            logger.warning("LLM Error: %s", e)
+            metrics.record_fallback("llm.lookbook", "error")
+            return None
 
+    def _fallback_lookbook(self, sentiment, history_context, raw_input, retrieved_products):
         # Fallback Logic (Autonomous)
         fallback_msg = f"I've found some great items for you! Plus, your price is locked the moment you decide."
         items = []
-        full_context = (history_context + " " + raw_input).lower()
+        full_context = history_context + " " + raw_input
 
-        has_item = any(w in full_context for w in ["dress", "shoe", "shirt", "pant", "jacket","bracelet", "necklace", "heel", "accessory", "bag", "watch", "suit", "top", "jeans","leather belt"])
-        has_budget = any(c in full_context for c in ["$", "dollar", "budget", "under", "price"])
-        has_style_occ = any(w in full_context for w in ["formal", "casual", "wedding", "party", "office"])
+        has_item = ITEM_WORDS.matches(full_context)
+        has_budget = "$" in full_context or BUDGET_WORDS.matches(full_context)
+        has_style_occ = OCCASION_WORDS.matches(full_context)
 
         if sentiment == "negative":
             fallback_msg = f"I'm sorry. I can process a return immediately."
@@ -187,11 +386,262 @@ class ShoppingAgent:
             "lookbook": items
         }
 
+    def generate_lookbook(self, user_request, retrieved_products, chat_history=[], raw_input="", skin_analysis_result=None):
+        """
+        Generates lookbook. Now includes External Review Scanning and Skin Tone Analysis.
+        """
+        sentiment = self._detect_sentiment(user_request)
+        retrieved_products = self._apply_budget(retrieved_products, raw_input)
+        self._enrich_reviews(retrieved_products)
+
+        system_prompt, user_prompt, history_context = self._build_prompts(
+            user_request, retrieved_products, chat_history, skin_analysis_result)
+        parsed = self._call_llm(system_prompt, user_prompt)
+        if parsed is not None:
+            return parsed
+        return self._fallback_lookbook(sentiment, history_context, raw_input, retrieved_products)
+
+    # -------------------------------------------------
+    # Item-to-item similarity
+    # -------------------------------------------------
+    def anchor_vectors(self, rows):
+        """
+        L2-normalised stored vectors for `rows` only: exact rows from the
+        re-rank sidecar when there is one, else decoded from the index.
+        Nothing catalog-sized is materialised, so compressed and
+        memory-mapped storage keep their footprint.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.rerank_vectors is not None:
+            vectors = np.asarray(self.rerank_vectors[rows], dtype=np.float32)
+        else:
+            vectors = self.index.reconstruct_batch(rows)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def _anchor_rows(self, product_ids):
+        ntotal = self.index.ntotal if self.index else 0
+        rows = []
+        for pid in product_ids:
+            try:
+                row = self._row_for_product_id(pid)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= row < ntotal:
+                rows.append(row)
+        return rows
+
+    @metrics.timed("similar_items")
+    def similar_items(self, product_ids, k=6):
+        """
+        "More like this" for one or many products: searches around the
+        centroid of their stored vectors, so no embedding call is made.
+        The anchor products themselves are excluded.
+        """
+        rows = self._anchor_rows(product_ids)
+        if not rows:
+            return [], []
+        query = self.anchor_vectors(rows).mean(axis=0)
+        ids, sims = self._search(query, k + len(rows))
+        anchors = set(rows)
+        hits = [(i, s) for i, s in zip(ids, sims) if i not in anchors][:k]
+        return self._fetch_products([i for i, _ in hits]), [s for _, s in hits]
+
+    @metrics.timed("similar_items_batch")
+    def similar_items_batch(self, product_ids, k=6):
+        """Per-product neighbours for many anchors in one batched search: {product_id: [products]}."""
+        rows = self._anchor_rows(product_ids)
+        if not rows:
+            return {}
+        neighbours, _ = topk_batch_from_index(self.index, self.anchor_vectors(rows), k=k + 1,
+                                              rerank_vectors=self.rerank_vectors)
+        return {
+            self._product_id_for_row(row): self._fetch_products([i for i in hits if i != row][:k])
+            for row, hits in zip(rows, neighbours)
+        }
+
+    def resolve_lookbook(self, parsed, weather_condition, candidates=()):
+        """
+        Turns the LLM/fallback lookbook (product ids + reasons) into fully
+        resolved cards under parsed['items'], so the product grid renders
+        without any lookups. Ratings missing from the enrichment step are
+        fetched in one batched call; fabric analysis is done here too.
+        """
+        by_id = {str(p['id']): p for p in candidates}
+        cards = []
+        for entry in parsed.get("lookbook", []):
+            pid = entry.get("product_id") or entry.get("id")
+            product = by_id.get(str(pid)) or self._fetch_product(pid)
+            if product:
+                cards.append({"product": dict(product), "reason": entry.get("reason", "AI Match")})
+
+        unrated = [c["product"] for c in cards if "ext_rating" not in c["product"]]
+        for p, review_data in zip(unrated, GoogleReviewService.fetch_ratings([p['title'] for p in unrated])):
+            self._attach_rating(p, review_data)
+
+        for card in cards:
+            card["material"] = MaterialAnalyzer.analyze(card["product"].get('description', ''), weather_condition)
+
+        parsed["items"] = cards
+        return parsed
+
     def post_purchase_recommendations(self, purchased_items, top_n=3):
         if not purchased_items: return []
+        if self.recs_table is not None:
+            with metrics.timed("recs.lookup"):
+                rec_ids = self.recs_table.recommend([i['id'] for i in purchased_items], top_n=top_n)
+            final = [p for p in (self._fetch_product(pid) for pid in rec_ids) if p]
+            if final:
+                return final
+
+        # No table (or no known anchors): fall back to a live text query
         cats = " ".join([i['category'] for i in purchased_items])
         query = f"Accessories matching {cats}"
         recs, _ = self.retrieve(query, k=top_n + 2)
         purchased_ids = [str(i['id']) for i in purchased_items]
         final = [r for r in recs if str(r['id']) not in purchased_ids][:top_n]
-        return final
\ No newline at end of file
+        return final
+
+    # -------------------------------------------------
+    # Async pipeline
+    # -------------------------------------------------
+    def _stage_timeout(self, name):
+        """The stage's own timeout, cut to its share of the remaining request budget (if any)."""
+        limit = self.stage_timeouts[name]
+        left = resilience.remaining()
+        if left is None:
+            return limit
+        path = self.CRITICAL_PATH
+        if name in path:
+            share = self.STAGE_SHARES[name]
+            ahead = path[path.index(name):]
+        else:
+            share = sum(self.STAGE_SHARES[s] for s in path[:path.index("llm")])
+            ahead = path
+        return min(limit, left * share / sum(self.STAGE_SHARES[s] for s in ahead))
+
+    async def _stage(self, name, awaitable, timings, fallback=None):
+        """
+        Awaits one pipeline stage under its timeout and records its wall time.
+        Blocking work keeps running in its worker thread after a timeout; the
+        pipeline simply stops waiting for it and continues with the fallback.
+        """
+        start = time.perf_counter()
+        timed_out = False
+        timeout = self._stage_timeout(name)
+        try:
+            return await asyncio.wait_for(awaitable, timeout=timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            reason = "timeout" if timeout >= self.stage_timeouts[name] else "budget"
+            logger.warning("Stage '%s' timed out after %.2fs (%s), using fallback.", name, timeout, reason)
+            metrics.record_fallback(f"stage.{name}", reason)
+            return fallback
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            timings[name] = round(elapsed_ms, 2)
+            metrics.observe(f"stage.{name}", elapsed_ms, error=timed_out)
+
+    async def aretrieve(self, text, k=8, timings=None, context=None):
+        timings = {} if timings is None else timings
+        if not self.index:
+            return [], []
+
+        emb = await self._stage("embed", asyncio.to_thread(self._embed_query, text, context), timings)
+        if emb is None:
+            return [], []
+        hits = await self._stage("search", asyncio.to_thread(self._search, emb, k, text), timings, fallback=([], []))
+        ids, sims = hits
+        products = await self._stage("fetch", asyncio.to_thread(self._fetch_products, ids), timings, fallback=[])
+        return products, sims
+
+    async def _aenrich_reviews(self, products, timings):
+        top = products[:5]
+        ratings = await self._stage(
+            "enrich", asyncio.to_thread(GoogleReviewService.fetch_ratings, [p['title'] for p in top]), timings)
+        if ratings is None:
+            ratings = [GoogleReviewService._simulate_rating(p['title']) for p in top]
+        for p, review_data in zip(top, ratings):
+            self._attach_rating(p, review_data)
+
+    async def agenerate_lookbook(self, user_request, retrieved_products, chat_history=[], raw_input="",
+                                 skin_analysis_result=None, timings=None):
+        timings = {} if timings is None else timings
+        sentiment = self._detect_sentiment(user_request)
+        retrieved_products = self._apply_budget(retrieved_products, raw_input)
+        await self._aenrich_reviews(retrieved_products, timings)
+
+        system_prompt, user_prompt, history_context = self._build_prompts(
+            user_request, retrieved_products, chat_history, skin_analysis_result)
+        parsed = await self._stage("llm", asyncio.to_thread(self._call_llm, system_prompt, user_prompt), timings)
+        if parsed is not None:
+            return parsed
+        return self._fallback_lookbook(sentiment, history_context, raw_input, retrieved_products)
+
+    async def arun_chat(self, context_query, message, chat_history=(), image_base64=None, skin_profile=None, k=15,
+                        weather_condition="Sunny", context=None, budget_s=None):
+        """
+        Runs one chat turn as a dependency graph of stages:
+
+            skin ─────────────────────────────┐
+            embed → search → fetch → enrich → llm
+
+        Skin analysis overlaps with retrieval, so the embedded `context_query`
+        carries the skin profile known before this turn; a freshly analysed
+        profile is applied to the LLM prompt. The lookbook comes back
+        resolved (see `resolve_lookbook`). With a `context` dict, retrieval
+        composes the query vector from `message` and cached facet vectors
+        instead of embedding `context_query`, which still feeds the LLM.
+        Returns the parsed lookbook,
+        the user message as it should be stored in history, the new skin
+        profile (if any) and per-stage timings in milliseconds.
+
+        The turn runs under an end-to-end latency budget of `budget_s`
+        seconds (default: the agent's `request_budget`) that is divided
+        among the stages and caps every upstream call made on its behalf.
+        """
+        with resilience.deadline(budget_s if budget_s is not None else self.request_budget):
+            return await self._arun_chat(context_query, message, chat_history, image_base64, skin_profile, k,
+                                         weather_condition, context)
+
+    async def _arun_chat(self, context_query, message, chat_history, image_base64, skin_profile, k,
+                         weather_condition, context):
+        timings = {}
+        skin_task = None
+        if image_base64:
+            skin_task = asyncio.create_task(
+                self._stage("skin", asyncio.to_thread(self.analyze_skin_tone, image_base64), timings))
+
+        sentiment = self._detect_sentiment(context_query)
+        if context:
+            retrieved, _ = await self.aretrieve(message, k=k, timings=timings, context=context)
+        else:
+            retrieved, _ = await self.aretrieve(context_query, k=k, timings=timings)
+        retrieved = self._apply_budget(retrieved, message)
+        enrich_task = asyncio.create_task(self._aenrich_reviews(retrieved, timings))
+
+        new_skin = await skin_task if skin_task else None
+        user_message = f"{message} [Analyzed: {new_skin}]" if new_skin else message
+        history = list(chat_history) + [("user", user_message)]
+        await enrich_task
+
+        system_prompt, user_prompt, history_context = self._build_prompts(
+            context_query, retrieved, history, new_skin or skin_profile)
+        parsed = await self._stage("llm", asyncio.to_thread(self._call_llm, system_prompt, user_prompt), timings)
+        if parsed is None:
+            parsed = self._fallback_lookbook(sentiment, history_context, user_message, retrieved)
+        parsed = await self._stage(
+            "resolve", asyncio.to_thread(self.resolve_lookbook, parsed, weather_condition, retrieved), timings,
+            fallback=dict(parsed, items=[]))
+
+        return {
+            "lookbook": parsed,
+            "user_message": user_message,
+            "skin_profile": new_skin,
+            "timings": timings
+        }
+
+    def run_chat(self, context_query, message, chat_history=(), image_base64=None, skin_profile=None, k=15,
+                 weather_condition="Sunny", context=None, budget_s=None):
+        """Synchronous wrapper around `arun_chat` for callers without an event loop (Streamlit)."""
+        return asyncio.run(self.arun_chat(context_query, message, chat_history, image_base64, skin_profile, k,
+                                          weather_condition, context, budget_s))
@@ -1,13 +1,14 @@
-import os
 from datetime import datetime
 
+import time
+import uuid
+
 import streamlit as st
 # from streamlit import rerun
 
-from agent import ShoppingAgent
-from utils import fetch_product_by_id, SizeConverter, RewardSystem, PolicyManager, WeatherService, \
-    GoogleReviewService, encode_image, TrendService, MaterialAnalyzer, CartOptimizer, ReplenishmentService, \
-    PriceLockService
+import resources
+from services import SizeConverter, RewardSystem, PolicyManager, WeatherService, encode_image, TrendService, \
+    CartOptimizer, ReplenishmentService, PriceLockService
 if "chat_input_key" not in st.session_state:
     st.session_state.chat_input_key = 0
 
@@ -178,14 +179,39 @@ if "weather_context" not in st.session_state:
                 f"Detected: {st.session_state.weather_context['city']}, {st.session_state.weather_context['condition']}")
         else:
             st.toast("Using default location settings.")
+        resources.get_recovery_monitor().publish_weather(st.session_state.weather_context)
+
+# The agent, indices, catalog and embedder are shared by every session in
+# this process; session_state only holds per-user history, cart and orders.
+@st.cache_resource(show_spinner="Loading catalog and indices...")
+def get_shared_agent(emb_method):
+    return resources.warm_up(emb_method)
+
+
+def secure_holds(cart, stock_ledger, owner, margin_s=30):
+    """
+    Makes sure every stock-tracked cart item holds a reservation that is
+    good for at least `margin_s` more seconds. Returns the titles of items
+    that could not be held.
+    """
+    unavailable = []
+    for item in cart:
+        if item.get("reservation_id") and item.get("reserved_until", 0) > time.time() + margin_s:
+            continue
+        if stock_ledger.available(item['id']) is None:
+            continue  # not stock-tracked
+        if item.get("reservation_id"):
+            stock_ledger.release(item.pop("reservation_id"))  # lapsing hold; no-op if already expired
+        held = stock_ledger.reserve(item['id'], owner)
+        if held:
+            item["stock_reserved"] = True
+            item["reservation_id"], item["reserved_until"] = held
+        else:
+            unavailable.append(item['title'])
+    return unavailable
+
 
-if "agent" not in st.session_state:
-    emb_method = "openai" if os.getenv("OPENAI_API_KEY") else "local"
-    st.session_state.agent = ShoppingAgent(
-        index_path_openai="product_index_openai.faiss",
-        index_path_local="product_index_local.faiss",
-        emb_method=emb_method
-    )
+agent = get_shared_agent(resources.default_emb_method())
 
 st.session_state.setdefault("history", [("assistant",
                                          "Hi! I'm Kai. Upload a selfie for skin tone matching or just tell me what you need! Your prices will be Intent-Locked.")])
@@ -195,6 +221,16 @@ st.session_state.setdefault("last_lookbook", {})
 st.session_state.setdefault("reward_points", 200)
 st.session_state.setdefault("location", "US")
 st.session_state.setdefault("skin_profile", None)  # Store skin analysis result
+st.session_state.setdefault("session_id", uuid.uuid4().hex)  # Owner of stock reservations
+
+# Silent Recovery checks copies of this session's cart and orders in the
+# background; apply whatever it fixed since the last rerun (stock holds,
+# shipping upgrades) here, on the script thread that owns them.
+recovery_monitor = resources.get_recovery_monitor()
+recovery_alerts = recovery_monitor.pop_alerts(st.session_state.session_id)
+recovery_monitor.apply_updates(recovery_alerts, st.session_state.cart, st.session_state.orders)
+for recovery_alert in recovery_alerts:
+    st.toast(recovery_alert["message"])
 
 # ---------------------------------------------------------
 # Sidebar
@@ -222,7 +258,11 @@ with st.sidebar:
     # --- INTENT-LOCKED PRICING: AUTO-REFUND SCAN ---
     if st.button("🛡️ Scan for Price Drops", help="Intent-Locked Pricing: Check if prices fell after you bought."):
         with st.spinner("Checking global market prices..."):
-            refund_amt, details = PriceLockService.calculate_protection_refund(st.session_state.orders)
+            price_store = resources.get_price_store()
+            ordered = [item for order in st.session_state.orders for item in order["items"]]
+            # No live price feed yet: record a simulated market move before checking history.
+            PriceLockService.record_market_tick(price_store, ordered)
+            refund_amt, details = PriceLockService.calculate_protection_refund(st.session_state.orders, price_store)
             if refund_amt > 0:
                 # Refund via XP
                 xp_refund = int(refund_amt * 10)  # 1 USD = 10 XP
@@ -270,16 +310,25 @@ with st.sidebar:
         else:
             st.success("Free Shipping Unlocked!")
 
+        # Silent Recovery: the background monitor holds low-stock cart items against the shared ledger
+        stock_ledger = resources.get_stock_ledger()
+        recovery_monitor.upsert_cart(st.session_state.session_id, st.session_state.cart)
+
         if st.button("💳 Checkout Now", type="primary", use_container_width=True):
             st.session_state.show_checkout = True
         for i, item in enumerate(st.session_state.cart):
             # Display Lock Status in Cart
             lock_msg = f"🔒 Locked @ ${item['price']}"
+            if item.get("stock_reserved"):
+                lock_msg += " · Reserved"
             st.markdown(f"**{item['title'][:15]}..** ({lock_msg})")
             if st.button(f"Remove {item['title'][:5]}..", key=f"rm_{i}"):
-                st.session_state.cart.pop(i)
+                removed = st.session_state.cart.pop(i)
+                if removed.get("reservation_id"):
+                    stock_ledger.release(removed["reservation_id"])
                 st.rerun()
     else:
+        recovery_monitor.remove_cart(st.session_state.session_id)
         st.caption("Cart is empty")
 
     st.markdown("---")
@@ -303,13 +352,15 @@ if st.session_state.get("refresh_lookbook", False) and st.session_state.history:
     trend_txt = f" Current Trends in {st.session_state.location}: {', '.join(active_trends)}."
 
     full_context = f"{last_query}. Context: {occasion}, {weather} weather, {st.session_state.location} region.{skin_txt}{trend_txt}"
+    # Retrieval embeds only the query text; context facets come from the agent's vector cache
+    search_context = {"occasion": occasion, "weather": weather, "region": st.session_state.location,
+                      "season": season, "trends": active_trends, "skin_profile": st.session_state.skin_profile}
 
-    agent = st.session_state.agent
-    retrieved, _ = agent.retrieve(full_context, k=8)
+    retrieved, _ = agent.retrieve(last_query, k=8, context=search_context)
     filtered = [p for p in retrieved if p and budget_min <= p.get("price", 0) <= budget_max]
     parsed = agent.generate_lookbook(full_context, filtered, st.session_state.history, raw_input=last_query,
                                      skin_analysis_result=st.session_state.skin_profile)
-    st.session_state.last_lookbook = parsed
+    st.session_state.last_lookbook = agent.resolve_lookbook(parsed, weather, filtered)
     st.session_state.refresh_lookbook = False
     st.rerun()
 
@@ -346,21 +397,12 @@ with col_trigger:
 
         if st.button("Send", use_container_width=True):
             if user_input or uploaded_chat_file:
-                agent = st.session_state.agent
                 msg_content = user_input if user_input else "Uploaded an image."
 
-                # Handle Image Analysis
+                img_b64 = None
                 if uploaded_chat_file:
                     st.toast("Analyzing skin tone via AI Vision...")
                     img_b64 = encode_image(uploaded_chat_file)
-                    skin_analysis = agent.analyze_skin_tone(img_b64)
-                    if skin_analysis:
-                        st.session_state.skin_profile = skin_analysis
-                        msg_content += f" [Analyzed: {skin_analysis}]"
-                        st.toast("Skin profile updated!")
-
-                # Save user message
-                st.session_state.history.append(("user", msg_content))
 
                 skin_txt = (
                     f" Recommended colors based on skin tone: {st.session_state.skin_profile}"
@@ -377,14 +419,28 @@ with col_trigger:
                     f"{skin_txt}{trend_txt}"
                 )
 
-                retrieved, _ = agent.retrieve(context_query, k=15)
-                parsed = agent.generate_lookbook(
+                # Skin analysis, retrieval, review enrichment and the LLM call
+                # run as one async stage graph; see ShoppingAgent.arun_chat.
+                turn = agent.run_chat(
                     context_query,
-                    retrieved,
+                    msg_content,
                     st.session_state.history,
-                    raw_input=msg_content,
-                    skin_analysis_result=st.session_state.skin_profile
+                    image_base64=img_b64,
+                    skin_profile=st.session_state.skin_profile,
+                    k=15,
+                    weather_condition=weather,
+                    context={"occasion": occasion, "weather": weather, "region": st.session_state.location,
+                             "season": season, "trends": active_trends,
+                             "skin_profile": st.session_state.skin_profile}
                 )
+                parsed = turn["lookbook"]
+
+                if turn["skin_profile"]:
+                    st.session_state.skin_profile = turn["skin_profile"]
+                    st.toast("Skin profile updated!")
+
+                # Save user message
+                st.session_state.history.append(("user", turn["user_message"]))
 
                 st.session_state.last_lookbook = parsed
                 st.session_state.history.append(
@@ -400,57 +456,62 @@ with col_trigger:
 st.markdown("### 👗 Curated Selection")
 lookbook = st.session_state.get("last_lookbook", {})
 
-if lookbook and "lookbook" in lookbook and len(lookbook["lookbook"]) > 0:
-    grid_cols = st.columns(3)
-    for idx, item in enumerate(lookbook["lookbook"]):
-        pid = item.get("product_id") or item.get("id")
-        product = fetch_product_by_id(pid)
-        if product:
-            with grid_cols[idx % 3]:
-                st.markdown(f'<div class="product-card">', unsafe_allow_html=True)
-                img_url = product['image_url'] if product[
-                    'image_url'] else "[https://via.placeholder.com/300x300?text=Vestra](https://via.placeholder.com/300x300?text=Vestra)"
-                st.image(img_url, use_container_width=True)
-                st.markdown(f"<div style='font-weight:600; margin-bottom:5px;'>{product['title']}</div>",
-                            unsafe_allow_html=True)
+if lookbook and "lookbook" in lookbook and "items" not in lookbook:
+    # Lookbooks are resolved when generated; this only upgrades an older session's entry once.
+    st.session_state.last_lookbook = lookbook = agent.resolve_lookbook(lookbook, weather)
 
-                # --- NEW: DISPLAY EXTERNAL RATING ---
-                # Check if rating exists in item (from agent) or fetch on fly (if not in item)
-                # We check the loopbook item first because agent already fetched it
-                rating = product.get(
-                    'ext_rating')  # Agent might not have saved it to product dict in CSV, so we use session state or fetch
-
-                # Fetch fresh if needed (mostly for display purposes if not in agent response)
-                if 'ext_rating' not in product:
-                    rev_data = GoogleReviewService.fetch_rating(product['title'])
-                    rating = rev_data['rating']
-                    source = rev_data['source']
-                else:
-                    source = product.get('ext_source', 'Web')
-
-                st.markdown(f'<div class="rating-badge">⭐ {rating}/5 ({source})</div>', unsafe_allow_html=True)
-
-                # --- NEW: FABRIC ANALYSIS ---
-                mat_analysis = MaterialAnalyzer.analyze(product.get('description', ''), weather)
-                for endo in mat_analysis['endorsements']:
-                    st.caption(f"{endo}")
-                for warn in mat_analysis['warnings']:
-                    st.caption(f"{warn}")
-
-                st.caption(f"✨ {item.get('reason', 'AI Match')}")
-
-                # PRICE DISPLAY WITH LOCK ICON
-                st.markdown(f"**${product['price']}** <span class='lock-badge'>Intent-Locked</span>",
-                            unsafe_allow_html=True)
-
-                if st.button("➕ Add & Lock Price", key=f"add_{pid}"):
-                    # INTENT LOCK: Record the locked price
-                    product['locked_price'] = product['price']
-                    product['locked_date'] = datetime.now()
-                    st.session_state.cart.append(product)
-                    st.session_state.reward_points += 5
-                    st.toast(f"Price locked at ${product['price']}!")
-                st.markdown('</div>', unsafe_allow_html=True)
+if lookbook and lookbook.get("items"):
+    # Sized local thumbnails instead of full-resolution originals; first view fetches them in parallel
+    thumbs = resources.get_thumbnail_cache()
+    thumbs.prefetch([card["product"]["image_url"] for card in lookbook["items"]])
+    grid_cols = st.columns(3)
+    for idx, card in enumerate(lookbook["items"]):
+        product = card["product"]
+        pid = product["id"]
+        with grid_cols[idx % 3]:
+            st.markdown(f'<div class="product-card">', unsafe_allow_html=True)
+            img_url = product['image_url'] if product[
+                'image_url'] else "https://via.placeholder.com/300x300?text=Vestra"
+            st.image(thumbs.get(product['image_url']) or img_url, use_container_width=True)
+            st.markdown(f"<div style='font-weight:600; margin-bottom:5px;'>{product['title']}</div>",
+                        unsafe_allow_html=True)
+
+            # --- EXTERNAL RATING (resolved with the lookbook) ---
+            rating = product.get('ext_rating', 'N/A')
+            source = product.get('ext_source', 'Web')
+            st.markdown(f'<div class="rating-badge">⭐ {rating}/5 ({source})</div>', unsafe_allow_html=True)
+
+            # --- FABRIC ANALYSIS (resolved with the lookbook) ---
+            mat_analysis = card["material"]
+            for endo in mat_analysis['endorsements']:
+                st.caption(f"{endo}")
+            for warn in mat_analysis['warnings']:
+                st.caption(f"{warn}")
+
+            st.caption(f"✨ {card.get('reason', 'AI Match')}")
+
+            # PRICE DISPLAY WITH LOCK ICON
+            st.markdown(f"**${product['price']}** <span class='lock-badge'>Intent-Locked</span>",
+                        unsafe_allow_html=True)
+
+            if st.button("➕ Add & Lock Price", key=f"add_{pid}"):
+                # INTENT LOCK: Record the locked price on a copy; the card stays as resolved
+                locked = dict(product)
+                locked['locked_price'] = locked['price']
+                locked['locked_date'] = datetime.now()
+                resources.get_price_store().append(pid, locked['price'], locked['locked_date'])
+                st.session_state.cart.append(locked)
+                st.session_state.reward_points += 5
+                st.toast(f"Price locked at ${product['price']}!")
+            if st.button("🔁 More like this", key=f"similar_{pid}"):
+                # Product-anchored: neighbours come from stored vectors, no embedding call
+                similar, _ = agent.similar_items([pid], k=6)
+                st.session_state.last_lookbook = agent.resolve_lookbook({
+                    "chat_response": f"More like {product['title']}",
+                    "lookbook": [{"product_id": p["id"], "reason": f"Similar to {product['title']}"} for p in similar]
+                }, weather, similar)
+                st.rerun()
+            st.markdown('</div>', unsafe_allow_html=True)
 else:
     st.info("Kai is analyzing current trends for you. Open the Chat to begin.")
 
@@ -461,7 +522,7 @@ if st.session_state.get("run_prediction"):
     st.toast("Running AI Prediction Model...")
     # 1. Post Purchase Recommendations
     if st.session_state.orders:
-        recs = st.session_state.agent.post_purchase_recommendations(st.session_state.orders[-1]["items"], top_n=3)
+        recs = agent.post_purchase_recommendations(st.session_state.orders[-1]["items"], top_n=3)
         st.markdown("### 🔮 Complete The Look")
         p_cols = st.columns(3)
         for i, r in enumerate(recs):
@@ -541,24 +602,52 @@ if st.session_state.get("show_checkout"):
         addr = st.text_area("Shipping Address")
         submitted = st.form_submit_button("Confirm Order")
         if submitted:
-            order_id = len(st.session_state.orders) + 1
-            pts = RewardSystem.calculate_points("purchase", amount=final_total)
-
-            st.session_state.reward_points += pts
-            st.session_state.orders.append({
-                "order_id": order_id,
-                "items": st.session_state.cart.copy(),
-                "total": final_total,
-                "name": name,
-                "email": email,
-                "address": addr,
-                "date": datetime.now().date()
-            })
-
-            st.session_state.cart = []
-            st.session_state.show_checkout = False
-
-            # ✅ store message
-            st.session_state.order_success = f"Order #{order_id} confirmed! You earned {pts} XP."
-
-            st.rerun()
+            # Every stock-tracked item needs a live hold, then all holds become sales in one
+            # transaction; a hold that lapses in between gets one more try before we give up.
+            stock_ledger = resources.get_stock_ledger()
+            for _ in range(2):
+                unavailable = secure_holds(st.session_state.cart, stock_ledger, st.session_state.session_id)
+                if unavailable:
+                    break
+                lapsed = set(stock_ledger.commit_many(
+                    [item["reservation_id"] for item in st.session_state.cart if item.get("reservation_id")]))
+                if not lapsed:
+                    break
+                lapsed_items = [item for item in st.session_state.cart if item.get("reservation_id") in lapsed]
+                for item in lapsed_items:
+                    item.pop("reservation_id")
+                    item.pop("reserved_until", None)
+                unavailable = [item['title'] for item in lapsed_items]
+
+            if unavailable:
+                st.error(f"Sorry, {', '.join(unavailable)} just sold out. Remove it from your cart to place the order.")
+            else:
+                for item in st.session_state.cart:
+                    item.pop("reservation_id", None)
+                    item.pop("stock_reserved", None)
+                    item.pop("reserved_until", None)
+
+                order_id = len(st.session_state.orders) + 1
+                pts = RewardSystem.calculate_points("purchase", amount=final_total)
+
+                st.session_state.reward_points += pts
+                st.session_state.orders.append({
+                    "order_id": order_id,
+                    "items": st.session_state.cart.copy(),
+                    "total": final_total,
+                    "name": name,
+                    "email": email,
+                    "address": addr,
+                    "date": datetime.now().date(),
+                    "shipping_method": shipping_method
+                })
+                recovery_monitor.upsert_order(f"{st.session_state.session_id}:{order_id}", st.session_state.orders[-1])
+                recovery_monitor.remove_cart(st.session_state.session_id)
+
+                st.session_state.cart = []
+                st.session_state.show_checkout = False
+
+                # ✅ store message
+                st.session_state.order_success = f"Order #{order_id} confirmed! You earned {pts} XP."
+
+                st.rerun()
@@ -0,0 +1,74 @@
+# bench_embeddings.py
+"""
+Micro-benchmark for the local embedding backends.
+
+For each backend: single-query latency (p50/p95 over --queries encodes),
+batch throughput (texts/s at --batch-size over the catalog texts) and a
+parity check against the fp32 torch reference (mean / min cosine between
+the two embeddings of every text).
+
+    python bench_embeddings.py --backends torch int8 onnx --threads 4
+"""
+import os
+import time
+import argparse
+
+import numpy as np
+
+from utils import load_products, get_local_embedder, LOCAL_BACKENDS
+
+
+def encode(embedder, texts, batch_size):
+    return embedder.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True,
+                           normalize_embeddings=True)
+
+
+def bench(embedder, texts, queries, batch_size):
+    encode(embedder, texts[:batch_size], batch_size)  # warm-up
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        encode(embedder, [q], 1)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    embs = encode(embedder, texts, batch_size)
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "texts_per_s": len(texts) / elapsed
+    }, embs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default="sample_data/products.csv")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", choices=LOCAL_BACKENDS, default=["torch", "int8", "onnx"])
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads (sets VESTRA_LOCAL_THREADS)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.threads:
+        os.environ["VESTRA_LOCAL_THREADS"] = str(args.threads)
+
+    products = load_products(args.csv)
+    texts = (products["title"].fillna("") + ". " + products["description"].fillna("")).tolist()
+    queries = [f"{t} for a wedding" for t in products["title"].sample(
+        n=min(args.queries, len(products)), replace=len(products) < args.queries, random_state=0)]
+
+    reference = None
+    print(f"{'backend':<10}{'p50 ms':>10}{'p95 ms':>10}{'texts/s':>12}{'cos mean':>10}{'cos min':>10}")
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        stats, embs = bench(get_local_embedder(args.model, backend), texts, queries, args.batch_size)
+        if reference is None:
+            reference = embs
+        cos = np.sum(embs * reference, axis=1)
+        print(f"{backend:<10}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['texts_per_s']:>12.1f}"
+              f"{cos.mean():>10.4f}{cos.min():>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
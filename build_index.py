@@ -1,30 +1,208 @@
 # build_index.py
+"""
+One-step build of every search artefact from a single read of the catalog.
+
+    python build_index.py
+    python build_index.py --backends local --storage sq8 --rerank --recs
+    python build_index.py --csv catalog.csv --out-dir build/2026-10-19 --chunk-size 100000
+
+The catalog is streamed in validated chunks (utils.iter_products). Each
+chunk is embedded by the OpenAI and local backends in parallel (one
+thread each; the OpenAI one is network-bound, the local one runs in
+torch outside the GIL) and added straight to the indices, while the next
+chunk is read; it is also appended to the BM25 postings, the row ->
+product id map, a snapshot of the rows that were indexed and the
+products(id, json) metadata DB. Memory is bounded by the chunk size
+(plus the BM25 postings and id map), not the catalog size. Both
+embedders see the same "title. description" texts.
+
+manifest.json ties the set together with content hashes, model names,
+dimensions, row counts and build timings; ShoppingAgent.from_manifest
+loads it. Every build goes to its own directory (build/<timestamp> by
+default) and is only served once VESTRA_MANIFEST points at its manifest.
+"""
 import os
-import pickle
+import json
+import time
 import argparse
-import openai
-import pandas as pd
-from utils import load_products, get_embeddings, build_faiss_index, create_metadata_db
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--csv", default="sample_data/products.csv")
-parser.add_argument("--index", default="product_index.faiss")
-parser.add_argument("--meta", default="products_meta.db")
-parser.add_argument("--emb-method", choices=["openai","local"], default="openai")
-args = parser.parse_args()
-
-products = load_products(args.csv)
-texts = (products["title"].fillna("") + ". " + products["description"].fillna("")).tolist()
-
-if args.emb_method == "openai":
-    if os.getenv("OPENAI_API_KEY") is None:
-        raise RuntimeError("OPENAI_API_KEY must be set for openai embeddings or use --emb-method local")
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    embs = get_embeddings(texts, model="openai", openai_client=openai)
-else:
-    embs = get_embeddings(texts, model="local", openai_client=None)
-
-print("Embeddings shape:", embs.shape)
-build_faiss_index(embs, index_path=args.index)
-create_metadata_db(products, db_path=args.meta)
-print("Index and metadata created.")
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import iter_products, FaissIndexBuilder, create_metadata_db, save_id_map, file_sha256, \
+    full_precision_path, INDEX_STORAGE_OPTIONS, OPENAI_EMBEDDING_MODEL, LOCAL_EMBEDDING_MODEL
+from lexical import BM25Builder, product_text
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+EMBEDDING_MODELS = {"openai": OPENAI_EMBEDDING_MODEL, "local": LOCAL_EMBEDDING_MODEL}
+
+# Artefact file names inside --out-dir (the defaults the agent already uses)
+INDEX_FILES = {"openai": "product_index_openai.faiss", "local": "product_index_local.faiss"}
+LEXICAL_FILE = "product_index.bm25.npz"
+ID_MAP_FILE = "product_ids.npy"
+SNAPSHOT_FILE = "catalog_snapshot.csv"
+METADATA_FILE = "products_meta.db"
+MANIFEST_FILE = "manifest.json"
+
+
+def catalog_texts(products):
+    return (products["title"].fillna("") + ". " + products["description"].fillna("")).tolist()
+
+
+def _artefact(out_dir, name, **extra):
+    path = os.path.join(out_dir, name)
+    return dict({"path": name, "sha256": file_sha256(path), "bytes": os.path.getsize(path)}, **extra)
+
+
+class _StepTimer:
+    """Accumulates wall time per build step across chunks."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def run(self, step, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.seconds[step] = self.seconds.get(step, 0.0) + time.perf_counter() - start
+
+    def rounded(self):
+        return {step: round(s, 3) for step, s in self.seconds.items()}
+
+
+def _build_recs(backend, out_dir, snapshot_path, top_n):
+    from recommendations import build_table
+    name = f"complete_the_look_{backend}.npz"
+    build_table(os.path.join(out_dir, INDEX_FILES[backend]), snapshot_path, top_n=top_n).save(
+        os.path.join(out_dir, name))
+    return name
+
+
+def build(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    timer = _StepTimer()
+    start = time.perf_counter()
+
+    builders = {
+        b: FaissIndexBuilder(model=b, save_path=os.path.join(args.out_dir, INDEX_FILES[b]), storage=args.storage,
+                             keep_full_precision=args.rerank, pq_m=args.pq_m, pca_dim=args.pca_dim,
+                             dimensions=args.openai_dimensions if b == "openai" else None,
+                             embed_batch_size=args.embed_batch_size)
+        for b in args.backends
+    }
+    lexical = BM25Builder()
+    snapshot_path = os.path.join(args.out_dir, SNAPSHOT_FILE)
+    meta_path = os.path.join(args.out_dir, METADATA_FILE)
+    ids, rejected, rows = [], {}, 0
+
+    chunks = iter_products(args.csv, chunk_size=args.chunk_size, rejected=rejected)
+    with ThreadPoolExecutor(max_workers=len(builders)) as pool:
+        chunk = timer.run("read", next, chunks, None)
+        while chunk is not None:
+            texts = catalog_texts(chunk)
+            pending = {b: pool.submit(timer.run, f"index_{b}", builder.add, texts) for b, builder in builders.items()}
+
+            # Bookkeeping for this chunk and reading the next one overlap the embedding calls.
+            first = rows == 0
+            timer.run("snapshot", chunk.to_csv, snapshot_path, mode="w" if first else "a", header=first, index=False)
+            timer.run("metadata_db", create_metadata_db, chunk, meta_path, append=not first)
+            timer.run("lexical", lexical.add, (product_text(r) for r in chunk.to_dict("records")))
+            ids.append(chunk["id"].to_numpy(dtype=str))
+            rows += len(chunk)
+            next_chunk = timer.run("read", next, chunks, None)
+
+            for future in pending.values():
+                future.result()
+            logger.info("Indexed %d products", rows)
+            chunk = next_chunk
+
+    if not rows:
+        raise ValueError(f"No valid products in {args.csv} (rejected: {rejected})")
+    if rejected:
+        logger.warning("Skipped invalid catalog rows: %s", rejected)
+
+    indices = {}
+    for backend, builder in builders.items():
+        index = timer.run(f"index_{backend}", builder.finish)
+        name = INDEX_FILES[backend]
+        full_precision = full_precision_path(name) if args.rerank else None
+        indices[backend] = _artefact(
+            args.out_dir, name, model=EMBEDDING_MODELS[backend], dim=index.d, ntotal=int(index.ntotal),
+            storage=args.storage, pca_dim=args.pca_dim,
+            openai_dimensions=args.openai_dimensions if backend == "openai" else None, report=builder.report,
+            full_precision=_artefact(args.out_dir, full_precision) if full_precision else None)
+    timer.run("lexical", lambda: lexical.build().save(os.path.join(args.out_dir, LEXICAL_FILE)))
+    timer.run("id_map", save_id_map, np.concatenate(ids), os.path.join(args.out_dir, ID_MAP_FILE))
+
+    recs = {}
+    if args.recs:
+        # The complete-the-look table is built from the whole catalog and all vectors in memory.
+        for backend in args.backends:
+            name = timer.run(f"recs_{backend}", _build_recs, backend, args.out_dir, snapshot_path, args.recs_top_n)
+            recs[backend] = _artefact(args.out_dir, name, top_n=args.recs_top_n)
+    timings = dict(timer.rounded(), total=round(time.perf_counter() - start, 3))
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "catalog": _artefact(args.out_dir, SNAPSHOT_FILE, source=args.csv, rows=rows, rejected=rejected,
+                             text_fields=["title", "description"]),
+        "id_map": _artefact(args.out_dir, ID_MAP_FILE),
+        "metadata_db": _artefact(args.out_dir, METADATA_FILE),
+        "lexical": _artefact(args.out_dir, LEXICAL_FILE),
+        "indices": indices,
+        "recommendations": recs,
+        "timings": timings
+    }
+    with open(os.path.join(args.out_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--csv", default="sample_data/products.csv")
+    parser.add_argument("--out-dir", default=None, help="Artefact directory (default: build/<timestamp>)")
+    parser.add_argument("--backends", nargs="+", choices=list(INDEX_FILES), default=None,
+                        help="Embedding indices to build (default: local, plus openai when OPENAI_API_KEY is set)")
+    parser.add_argument("--storage", choices=INDEX_STORAGE_OPTIONS, default="flat",
+                        help="Vector storage: exact float32, fp16/sq8 scalar quantization or OPQ+PQ")
+    parser.add_argument("--pq-m", type=int, default=None, help="PQ sub-quantizers for --storage opq_pq")
+    parser.add_argument("--rerank", action="store_true",
+                        help="Also keep exact float32 vectors in a memory-mapped sidecar to re-rank the shortlist")
+    parser.add_argument("--openai-dimensions", type=int, default=None,
+                        help="Request shortened OpenAI embeddings of this size (API-side reduction)")
+    parser.add_argument("--pca-dim", type=int, default=None,
+                        help="Project vectors to this many dimensions with a PCA stored in the index")
+    parser.add_argument("--chunk-size", type=int, default=50_000,
+                        help="Catalog rows read, embedded and indexed at a time (bounds memory)")
+    parser.add_argument("--embed-batch-size", type=int, default=2048, help="Texts per embedding call")
+    parser.add_argument("--recs", action="store_true", help="Also build the complete-the-look tables")
+    parser.add_argument("--recs-top-n", type=int, default=10)
+    args = parser.parse_args(argv)
+    if args.out_dir is None:
+        args.out_dir = os.path.join("build", datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+    has_key = bool(os.getenv("OPENAI_API_KEY"))
+    if args.backends is None:
+        args.backends = ["openai", "local"] if has_key else ["local"]
+    elif "openai" in args.backends and not has_key:
+        parser.error("OPENAI_API_KEY must be set for the openai backend (or use --backends local)")
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    args = parse_args(argv)
+    manifest = build(args)
+    print(f"Built {', '.join(manifest['indices'])} indices over {manifest['catalog']['rows']} products "
+          f"in {manifest['timings']['total']}s -> {os.path.join(args.out_dir, MANIFEST_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# build_recommendations.py
+import time
+import argparse
+from recommendations import build_table
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--csv", default="sample_data/products.csv")
+parser.add_argument("--index", default="product_index_local.faiss")
+parser.add_argument("--out", default="complete_the_look_local.npz")
+parser.add_argument("--top-n", type=int, default=10)
+args = parser.parse_args()
+
+start = time.perf_counter()
+table = build_table(args.index, args.csv, top_n=args.top_n)
+table.save(args.out)
+print(f"Complete-the-look table: {table.rows.shape[0]} products x {len(table.categories)} categories "
+      f"x top {args.top_n} ({table.rows.nbytes + table.scores.nbytes} bytes) in {time.perf_counter() - start:.2f}s "
+      f"-> {args.out}")
@@ -0,0 +1,111 @@
+# context_vectors.py
+"""
+Query vectors composed from cached context facets.
+
+Instead of embedding "user text + region + weather + occasion + skin
+profile + trends" as one long string on every turn, each context facet
+is rendered to a short canonical text, embedded once and cached; the
+query vector is the normalised weighted sum of the user-text embedding
+and the facet vectors. Only the user text usually needs a fresh
+embedding, and the weights can be tuned without re-embedding anything.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_FACET_WEIGHTS = {
+    "query": 1.0,
+    "occasion": 0.35,
+    "weather": 0.2,
+    "trends": 0.25,
+    "skin": 0.25
+}
+
+
+def facet_texts(context):
+    """
+    Canonical facet strings for a context dict with any of: occasion,
+    weather, region, season, trends, skin_profile. Trends are sorted so
+    the same set always maps to the same cache entry.
+    """
+    facets = {}
+    if context.get("occasion"):
+        facets["occasion"] = f"Outfit for {context['occasion']}"
+    if context.get("weather"):
+        facets["weather"] = f"Clothing for {context['weather']} weather"
+    if context.get("trends"):
+        facets["trends"] = (f"{context.get('region', '')} {context.get('season', '')} trends: "
+                            f"{', '.join(sorted(context['trends']))}").strip()
+    if context.get("skin_profile"):
+        facets["skin"] = f"Colors that suit: {context['skin_profile']}"
+    return facets
+
+
+class FacetVectorCache:
+    """
+    Thread-safe LRU of facet text -> L2-normalised embedding; misses are
+    embedded in one batch. Only the bounded set of facet strings is
+    cached; free-form user text goes through `transient` and is embedded
+    in the same batch without being stored.
+
+    `embed_fn(texts)` returns `(embeddings, fallback)`; when `fallback` is
+    set (the embedder handed back placeholder vectors) the batch is used
+    for this call only and nothing is cached, so an upstream outage does
+    not outlive itself in the cache.
+    """
+
+    def __init__(self, embed_fn, max_size=2048):
+        self.embed_fn = embed_fn
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._vectors = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, texts, transient=()):
+        """Vectors for `list(transient) + list(texts)`, in that order."""
+        transient = list(transient)
+        found = {}
+        with self._lock:
+            for t in dict.fromkeys(texts):
+                v = self._vectors.get(t)
+                if v is not None:
+                    self._vectors.move_to_end(t)
+                    found[t] = v
+            missing = [t for t in dict.fromkeys(texts) if t not in found]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        fresh = transient + missing
+        if fresh:
+            embs, fallback = self.embed_fn(fresh)
+            embs = np.array(embs, dtype=np.float32)
+            embs /= np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+            transient_vecs = list(embs[:len(transient)])
+            found.update(zip(missing, embs[len(transient):]))
+            if not fallback:
+                with self._lock:
+                    for t in missing:
+                        self._vectors[t] = found[t]
+                    while len(self._vectors) > self.max_size:
+                        self._vectors.popitem(last=False)
+        else:
+            transient_vecs = []
+        # Built from what this call read or embedded: other threads may evict meanwhile.
+        return transient_vecs + [found[t] for t in texts]
+
+    def get(self, text):
+        return self.get_many([text])[0]
+
+
+def compose_query_vector(vectors, weights):
+    """Normalised weighted sum of named unit vectors; names without a weight are ignored."""
+    total = None
+    for name, vec in vectors.items():
+        w = weights.get(name, 0.0)
+        if w:
+            total = vec * w if total is None else total + vec * w
+    if total is None:
+        raise ValueError("No weighted vectors to compose")
+    return np.ascontiguousarray(total / max(np.linalg.norm(total), 1e-12), dtype=np.float32)
@@ -0,0 +1,229 @@
+# inventory.py
+"""
+Stock ledger with reservations for Silent Recovery's "silently reserved"
+promise.
+
+Counters live in SQLite (`stock`: on_hand and reserved per product) and
+every mutation is a single conditional UPDATE inside a BEGIN IMMEDIATE
+transaction, so reserve/release/commit stay atomic across threads and
+processes sharing the database. Reservations expire after a TTL (15 min
+by default); an in-process min-heap of deadlines tells `expire()` when
+anything is due, so the periodic check is O(1) until work exists, and
+the due rows are then released in one transaction.
+"""
+import time
+import heapq
+import random
+import sqlite3
+import threading
+
+from metrics import REGISTRY
+
+RESERVATION_TTL = 15 * 60
+LOW_STOCK_THRESHOLD = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stock (
+    product_id TEXT PRIMARY KEY,
+    on_hand INTEGER NOT NULL CHECK (on_hand >= 0),
+    reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved >= 0)
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_expiry ON reservations (expires_at);
+CREATE INDEX IF NOT EXISTS idx_reservations_owner ON reservations (owner, product_id);
+"""
+
+
+class StockLedger:
+    def __init__(self, db_path="inventory.db", ttl=RESERVATION_TTL, on_change=None):
+        """on_change(product_id) is called after any change to a product's availability."""
+        self.ttl = ttl
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        if db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # Rebuild the expiry heap from persisted reservations.
+        self._deadlines = [row[0] for row in self._conn.execute("SELECT expires_at FROM reservations")]
+        heapq.heapify(self._deadlines)
+        self._expiry_thread = None
+        self._stop = threading.Event()
+
+    def close(self):
+        self.stop_expiry()
+        with self._lock:
+            self._conn.close()
+
+    def _tx(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _changed(self, product_ids):
+        if self.on_change:
+            for pid in set(product_ids):
+                self.on_change(pid)
+
+    # -------------------------------------------------
+    # Stock levels
+    # -------------------------------------------------
+    def set_stock(self, product_id, on_hand):
+        self._tx(lambda c: c.execute(
+            "INSERT INTO stock (product_id, on_hand) VALUES (?, ?) "
+            "ON CONFLICT(product_id) DO UPDATE SET on_hand = excluded.on_hand",
+            (str(product_id), int(on_hand))))
+        self._changed([str(product_id)])
+
+    def seed(self, product_ids, on_hand_fn=None):
+        """Adds stock rows for products not yet tracked (existing rows are left alone)."""
+        on_hand_fn = on_hand_fn or simulated_on_hand
+        rows = [(str(pid), int(on_hand_fn(pid))) for pid in product_ids]
+        self._tx(lambda c: c.executemany("INSERT OR IGNORE INTO stock (product_id, on_hand) VALUES (?, ?)", rows))
+
+    def available(self, product_id):
+        """Units that can still be reserved, or None if the product isn't tracked."""
+        with self._lock:
+            row = self._conn.execute("SELECT on_hand - reserved FROM stock WHERE product_id = ?",
+                                     (str(product_id),)).fetchone()
+        return row[0] if row else None
+
+    # -------------------------------------------------
+    # Reservations
+    # -------------------------------------------------
+    def reserve(self, product_id, owner, qty=1, ttl=None):
+        """
+        Atomically holds `qty` units for `owner`. Returns (reservation_id,
+        expires_at), or None if there isn't enough unreserved stock.
+        """
+        product_id, expires_at = str(product_id), time.time() + (ttl or self.ttl)
+
+        def op(c):
+            cur = c.execute("UPDATE stock SET reserved = reserved + ? "
+                            "WHERE product_id = ? AND on_hand - reserved >= ?", (qty, product_id, qty))
+            if cur.rowcount != 1:
+                return None
+            cur = c.execute("INSERT INTO reservations (product_id, owner, qty, expires_at) VALUES (?, ?, ?, ?)",
+                            (product_id, str(owner), qty, expires_at))
+            return cur.lastrowid
+
+        reservation_id = self._tx(op)
+        if reservation_id is None:
+            REGISTRY.inc("vestra_stock_reservations_total", {"result": "rejected"})
+            return None
+        with self._lock:
+            heapq.heappush(self._deadlines, expires_at)
+        REGISTRY.inc("vestra_stock_reservations_total", {"result": "held"})
+        self._changed([product_id])
+        return reservation_id, expires_at
+
+    def _finish(self, reservation_id, consume):
+        def op(c):
+            row = c.execute("SELECT product_id, qty FROM reservations WHERE id = ?", (reservation_id,)).fetchone()
+            if row is None:
+                return None
+            product_id, qty = row
+            c.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+            if consume:
+                c.execute("UPDATE stock SET reserved = reserved - ?, on_hand = on_hand - ? WHERE product_id = ?",
+                          (qty, qty, product_id))
+            else:
+                c.execute("UPDATE stock SET reserved = reserved - ? WHERE product_id = ?", (qty, product_id))
+            return product_id
+
+        product_id = self._tx(op)
+        if product_id is not None:
+            self._changed([product_id])
+        return product_id is not None
+
+    def release(self, reservation_id):
+        """Returns the held units to available stock. False if already gone (expired/committed)."""
+        return self._finish(reservation_id, consume=False)
+
+    def commit(self, reservation_id):
+        """Converts the hold into a sale. False if the reservation already expired."""
+        return self._finish(reservation_id, consume=True)
+
+    def commit_many(self, reservation_ids):
+        """
+        Converts several holds into sales in one transaction: all of them,
+        or none if any has already expired or been released. Returns the
+        reservation ids that were no longer held (empty on success).
+        """
+        ids = list(dict.fromkeys(reservation_ids))
+        if not ids:
+            return []
+
+        def op(c):
+            rows = c.execute(f"SELECT id, product_id, qty FROM reservations WHERE id IN ({','.join('?' * len(ids))})",
+                             ids).fetchall()
+            held = {rid for rid, _, _ in rows}
+            lapsed = [rid for rid in ids if rid not in held]
+            if lapsed:
+                return lapsed, []
+            for _, product_id, qty in rows:
+                c.execute("UPDATE stock SET reserved = reserved - ?, on_hand = on_hand - ? WHERE product_id = ?",
+                          (qty, qty, product_id))
+            c.executemany("DELETE FROM reservations WHERE id = ?", [(rid,) for rid in ids])
+            return [], [pid for _, pid, _ in rows]
+
+        lapsed, product_ids = self._tx(op)
+        self._changed(product_ids)
+        return lapsed
+
+    def expire(self, now=None):
+        """Releases every reservation past its deadline; returns how many were released."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if not self._deadlines or self._deadlines[0] > now:
+                return 0
+            while self._deadlines and self._deadlines[0] <= now:
+                heapq.heappop(self._deadlines)
+
+        def op(c):
+            due = c.execute("SELECT id, product_id, qty FROM reservations WHERE expires_at <= ?", (now,)).fetchall()
+            for _, product_id, qty in due:
+                c.execute("UPDATE stock SET reserved = reserved - ? WHERE product_id = ?", (qty, product_id))
+            c.executemany("DELETE FROM reservations WHERE id = ?", [(rid,) for rid, _, _ in due])
+            return due
+
+        due = self._tx(op)
+        if due:
+            REGISTRY.inc("vestra_stock_reservations_total", {"result": "expired"}, amount=len(due))
+            self._changed([pid for _, pid, _ in due])
+        return len(due)
+
+    def start_expiry(self, interval=5.0):
+        """Runs `expire()` every `interval` seconds on a daemon thread."""
+        def loop():
+            while not self._stop.wait(interval):
+                self.expire()
+
+        if self._expiry_thread is None:
+            self._stop.clear()
+            self._expiry_thread = threading.Thread(target=loop, name="stock-expiry", daemon=True)
+            self._expiry_thread.start()
+        return self
+
+    def stop_expiry(self):
+        self._stop.set()
+        if self._expiry_thread is not None:
+            self._expiry_thread.join(1.0)
+            self._expiry_thread = None
+
+
+def simulated_on_hand(product_id):
+    """Deterministic demo stock level per product, skewed so some items run low."""
+    return random.Random(str(product_id)).choice([2, 3, 4, 8, 12, 20, 35, 50])
@@ -0,0 +1,177 @@
+# lexical.py
+"""
+Lexical retrieval: one tokenizer, a BM25 inverted index over the catalog
+and a keyword matcher for the agent's slot and sentiment checks.
+
+The BM25 postings are stored CSR-style (sorted vocabulary, offsets, doc
+rows, term frequencies) so the whole index is a handful of NumPy arrays
+that save/load as a single .npz next to the FAISS index. Row i is the
+i-th catalog product, matching the FAISS row order.
+"""
+import re
+from array import array
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _stem(token):
+    """Plural folding only: shoes -> shoe, dresses -> dress, accessories -> accessory."""
+    if len(token) <= 3:
+        return token
+    if token.endswith("ies"):
+        return token[:-3] + "y"
+    if token.endswith("sses"):
+        return token[:-2]
+    if token.endswith(("ches", "shes", "xes")):
+        return token[:-2]
+    if token.endswith("s") and not token.endswith(("ss", "us")):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [_stem(t) for t in _TOKEN_RE.findall(str(text).lower())]
+
+
+def product_text(product):
+    """Fields indexed for lexical search; `product` is a catalog row or record."""
+    return " ".join(str(product.get(f, "") or "") for f in ("title", "category", "description", "attributes"))
+
+
+class KeywordIndex:
+    """
+    Set-based matcher for single words and multi-word phrases. A text is
+    tokenized once and phrases are checked as token n-grams, replacing
+    repeated `any(w in text for w in words)` substring scans.
+    """
+
+    def __init__(self, keywords):
+        self.phrases = {}
+        for kw in keywords:
+            tokens = tuple(tokenize(kw))
+            if tokens:
+                self.phrases.setdefault(len(tokens), {})[tokens] = kw
+        self._max_n = max(self.phrases, default=0)
+
+    def found(self, text):
+        tokens = tokenize(text)
+        hits = set()
+        for n, table in self.phrases.items():
+            for i in range(len(tokens) - n + 1):
+                kw = table.get(tuple(tokens[i:i + n]))
+                if kw:
+                    hits.add(kw)
+        return hits
+
+    def matches(self, text):
+        return bool(self.found(text))
+
+
+class BM25Index:
+    def __init__(self, vocab, offsets, doc_ids, tfs, doc_lens, k1=1.2, b=0.75):
+        self.vocab = {term: i for i, term in enumerate(vocab)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(doc_lens)
+        self.avg_len = float(doc_lens.mean()) if self.n_docs else 0.0
+        df = np.diff(offsets).astype(np.float64)
+        self.idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts, k1=1.2, b=0.75):
+        return BM25Builder().add(texts).build(k1, b)
+
+    def save(self, path):
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        np.savez(path, vocab=np.array(vocab), offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs,
+                 doc_lens=self.doc_lens, params=np.array([self.k1, self.b]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        k1, b = data["params"].tolist()
+        return cls(data["vocab"].tolist(), data["offsets"], data["doc_ids"], data["tfs"], data["doc_lens"], k1, b)
+
+    def search(self, query, k=10):
+        """Top-k (rows, scores) for `query`; only documents sharing a term are scored."""
+        scores = {}
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            rows, tf = self.doc_ids[lo:hi], self.tfs[lo:hi]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lens[rows] / max(self.avg_len, 1e-9))
+            contrib = self.idf[t] * tf * (self.k1 + 1) / (tf + norm)
+            for row, c in zip(rows.tolist(), contrib.tolist()):
+                scores[row] = scores.get(row, 0.0) + c
+        top = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [r for r, _ in top], [s for _, s in top]
+
+
+class BM25Builder:
+    """
+    Accumulates BM25 postings chunk by chunk (rows numbered in add order).
+    Postings are kept as packed int32 arrays per term rather than tuples,
+    so large catalogs can be indexed from a stream.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.counts = {}
+        self.doc_lens = array("i")
+
+    def add(self, texts):
+        for text in texts:
+            row = len(self.doc_lens)
+            tokens = tokenize(text)
+            self.doc_lens.append(len(tokens))
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, c in counts.items():
+                if t not in self.rows:
+                    self.rows[t], self.counts[t] = array("i"), array("i")
+                self.rows[t].append(row)
+                self.counts[t].append(c)
+        return self
+
+    def build(self, k1=1.2, b=0.75):
+        vocab = sorted(self.rows)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for i, term in enumerate(vocab):
+            offsets[i + 1] = offsets[i] + len(self.rows[term])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocab):
+            doc_ids[offsets[i]:offsets[i + 1]] = np.frombuffer(self.rows[term], dtype=np.int32)
+            tfs[offsets[i]:offsets[i + 1]] = np.frombuffer(self.counts[term], dtype=np.int32)
+        return BM25Index(vocab, offsets, doc_ids, tfs, np.frombuffer(self.doc_lens, dtype=np.int32).copy(), k1, b)
+
+
+def reciprocal_rank_fusion(rankings, weights=None, k=60, limit=10):
+    """
+    Fuses ranked row lists (best first) by weighted reciprocal rank, which
+    needs no score calibration between dense and BM25 scores.
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, w in zip(rankings, weights):
+        for rank, row in enumerate(ranking):
+            if row >= 0:
+                fused[row] = fused.get(row, 0.0) + w / (k + rank + 1)
+    top = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return [r for r, _ in top], [s for _, s in top]
+
+
+def build_lexical_index(products, save_path="product_index.bm25.npz"):
+    """Builds and saves the BM25 index for a catalog DataFrame (row order = FAISS row order)."""
+    index = BM25Index.build([product_text(row) for row in products.to_dict("records")])
+    index.save(save_path)
+    return index
@@ -0,0 +1,244 @@
+# loadtest.py
+"""
+Load generator for the shopping agent.
+
+Replays shopping queries against ShoppingAgent in-process, or against the
+HTTP API in server.py, at a fixed concurrency and (optionally) a target
+request rate, then reports throughput, error rate and latency percentiles
+for the whole turn and for each pipeline stage (embed, search, fetch,
+enrich, llm).
+
+Queries come from a JSONL file (one object per line with a `query`,
+`text` or `title` field) or are synthesised from the catalog vocabulary.
+With --offline (the default in-process) the OpenAI and Google calls are
+replaced with local stubs so the tool runs on a plain Linux box.
+
+    python loadtest.py --requests 500 --concurrency 16
+    python loadtest.py --queries requests.jsonl --rate 20
+    python loadtest.py --url http://127.0.0.1:8000 --concurrency 32
+"""
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import urllib.request
+
+ITEMS = ["maxi dress", "cocktail dress", "two-piece suit", "blazer", "tuxedo", "wool coat", "trench coat",
+         "puffer jacket", "clutch", "leather belt", "silk scarf", "statement necklace", "heels", "oxfords",
+         "loafers", "boots"]
+COLORS = ["navy", "black", "ivory", "emerald", "burgundy", "charcoal", "tan", "blush", "pink", "blue"]
+OCCASIONS = ["Wedding", "Office", "Casual", "Gym", "Date Night", "Cyberpunk Party"]
+WEATHERS = ["Sunny", "Rainy", "Cold", "Snow", "Cloudy"]
+REGIONS = ["US", "EU", "UK", "JP"]
+STAGES = ["skin", "embed", "search", "fetch", "enrich", "llm", "resolve"]
+
+
+# -------------------------------------------------
+# Workload
+# -------------------------------------------------
+def load_queries(path):
+    queries = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            text = rec.get("query") or rec.get("text") or rec.get("title")
+            if text:
+                queries.append(text)
+    return queries
+
+
+def synthetic_queries(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        f"I need a {rng.choice(COLORS)} {rng.choice(ITEMS)} for a {rng.choice(OCCASIONS).lower()}, "
+        f"budget under ${rng.randrange(60, 500, 10)}"
+        for _ in range(n)
+    ]
+
+
+def build_turn(query, rng):
+    """Wraps a raw user message in the same context string the Streamlit chat handler builds."""
+    context_query = (
+        f"{query}. User is in {rng.choice(REGIONS)}. "
+        f"Weather: {rng.choice(WEATHERS)}. Occasion: {rng.choice(OCCASIONS)}."
+    )
+    return {"context_query": context_query, "message": query, "history": []}
+
+
+# -------------------------------------------------
+# Offline stubs
+# -------------------------------------------------
+def install_offline_stubs(agent_module, dim, llm_latency_ms=0.0, review_latency_ms=0.0):
+    """
+    Replaces network-bound calls with local stand-ins: deterministic
+    hash-seeded query embeddings, simulated review ratings and the
+    rule-based lookbook. Optional sleeps mimic upstream latency.
+    """
+    import numpy as np
+    from services import GoogleReviewService
+
+    def fake_embeddings(texts, model="openai", **kwargs):
+        out = np.empty((len(texts), dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha1(t.encode("utf-8")).digest()[:4], "little")
+            out[i] = np.random.default_rng(seed).random(dim, dtype=np.float32)
+        return out
+
+    def fake_rating(product_title):
+        if review_latency_ms:
+            time.sleep(review_latency_ms / 1000.0)
+        return GoogleReviewService._simulate_rating(product_title)
+
+    def fake_llm(system_prompt, user_prompt):
+        if llm_latency_ms:
+            time.sleep(llm_latency_ms / 1000.0)
+        return None  # triggers the rule-based fallback lookbook
+
+    agent_module.OPENAI_API_KEY = None
+    agent_module.get_embeddings = fake_embeddings
+    GoogleReviewService.fetch_rating = staticmethod(fake_rating)
+    agent_module.ShoppingAgent._call_llm = staticmethod(fake_llm)
+
+
+# -------------------------------------------------
+# Targets
+# -------------------------------------------------
+class InProcessTarget:
+    def __init__(self, emb_method, offline, llm_latency_ms, review_latency_ms):
+        import agent as agent_module
+        self.agent = agent_module.ShoppingAgent(emb_method=emb_method)
+        if self.agent.index is None:
+            raise SystemExit(f"No FAISS index loaded for emb_method={emb_method}; build one with build_indices.py")
+        if offline:
+            install_offline_stubs(agent_module, self.agent.index.d, llm_latency_ms, review_latency_ms)
+
+    async def run(self, turn):
+        result = await self.agent.arun_chat(turn["context_query"], turn["message"], turn["history"])
+        return result["timings"]
+
+
+class HTTPTarget:
+    def __init__(self, base_url, timeout):
+        self.url = base_url.rstrip("/") + "/chat"
+        self.timeout = timeout
+
+    def _post(self, turn):
+        req = urllib.request.Request(self.url, data=json.dumps(turn).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+    async def run(self, turn):
+        result = await asyncio.to_thread(self._post, turn)
+        return result.get("timings", {})
+
+
+# -------------------------------------------------
+# Driver & report
+# -------------------------------------------------
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+async def drive(target, turns, concurrency, rate):
+    sem = asyncio.Semaphore(concurrency)
+    totals, stages, errors = [], {s: [] for s in STAGES}, []
+    start = time.perf_counter()
+
+    async def one(i, turn):
+        if rate:
+            # Open-loop schedule: request i is due at i / rate seconds.
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                timings = await target.run(turn)
+            except Exception as e:
+                errors.append(repr(e))
+                return
+            totals.append((time.perf_counter() - t0) * 1000)
+            for name, ms in timings.items():
+                stages.setdefault(name, []).append(ms)
+
+    await asyncio.gather(*(one(i, t) for i, t in enumerate(turns)))
+    elapsed = time.perf_counter() - start
+    return totals, stages, errors, elapsed
+
+
+def summarize(totals, stages, errors, elapsed):
+    def dist(values):
+        values = sorted(values)
+        return {"count": len(values), "p50": percentile(values, 50), "p90": percentile(values, 90),
+                "p99": percentile(values, 99), "max": values[-1] if values else float("nan")}
+
+    n = len(totals) + len(errors)
+    return {
+        "requests": n,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(totals) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(len(errors) / n, 4) if n else 0.0,
+        "errors": sorted(set(errors))[:10],
+        "latency_ms": {"total": dist(totals), **{s: dist(v) for s, v in stages.items() if v}}
+    }
+
+
+def print_report(report):
+    print(f"Requests: {report['requests']}  Elapsed: {report['elapsed_s']}s  "
+          f"Throughput: {report['throughput_rps']} req/s  Error rate: {report['error_rate']:.2%}")
+    print(f"{'stage':<8}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}   (ms)")
+    for name, d in report["latency_ms"].items():
+        print(f"{name:<8}{d['count']:>8}{d['p50']:>10.2f}{d['p90']:>10.2f}{d['p99']:>10.2f}{d['max']:>10.2f}")
+    for e in report["errors"]:
+        print(f"  error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", help="JSONL file of recorded queries (default: synthetic)")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests to send")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0.0, help="Target requests/second (0 = as fast as possible)")
+    parser.add_argument("--url", help="Base URL of server.py; omit to drive ShoppingAgent in-process")
+    parser.add_argument("--timeout", type=float, default=60.0, help="HTTP request timeout in seconds")
+    parser.add_argument("--emb-method", choices=["openai", "local"], default="openai")
+    parser.add_argument("--online", action="store_true", help="In-process: call the real OpenAI/Google APIs")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated LLM latency when offline")
+    parser.add_argument("--review-latency-ms", type=float, default=0.0, help="Simulated review API latency when offline")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--metrics", action="store_true", help="In-process: also dump the metrics registry")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = load_queries(args.queries) if args.queries else synthetic_queries(args.requests, args.seed)
+    if not queries:
+        raise SystemExit("No queries to replay.")
+    turns = [build_turn(queries[i % len(queries)], rng) for i in range(args.requests)]
+
+    if args.url:
+        target = HTTPTarget(args.url, args.timeout)
+    else:
+        target = InProcessTarget(args.emb_method, not args.online, args.llm_latency_ms, args.review_latency_ms)
+
+    report = summarize(*asyncio.run(drive(target, turns, args.concurrency, args.rate)))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if args.metrics and not args.url:
+        import metrics
+        print(metrics.REGISTRY.to_prometheus())
+
+
+if __name__ == "__main__":
+    main()
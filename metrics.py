@@ -0,0 +1,189 @@
+# metrics.py
+"""
+Lightweight in-process instrumentation.
+
+    @timed("get_embeddings")             # decorator
+    with timed("WeatherService.get_context"):   # or context manager
+        ...
+    record_fallback("fetch_rating", "no_credentials")
+
+Every timed operation feeds a latency histogram plus call/error counters
+in the process-wide REGISTRY, which renders as Prometheus text or JSON.
+Inside `with trace() as spans:` each timed operation (including ones run
+in worker threads via asyncio.to_thread, which copies the context) is
+also appended to `spans` for a per-request breakdown.
+"""
+import time
+import json
+import bisect
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# Upper bounds in milliseconds; the last bucket is +Inf.
+DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_current_trace = contextvars.ContextVar("vestra_trace", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Bucket-resolution estimate (upper bound of the bucket holding the q-th value)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, amount=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name, "labels": dict(labels), "count": h.count, "sum": round(h.sum, 3),
+                    "p50": h.quantile(0.5), "p90": h.quantile(0.9), "p99": h.quantile(0.99),
+                    "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts))
+                }
+                for (name, labels), h in sorted(self._histograms.items())
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        def fmt_labels(labels, extra=None):
+            items = list(labels) + list((extra or {}).items())
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{fmt_labels(labels)} {value}")
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{fmt_labels(labels, {'le': bound})} {cumulative}")
+                lines.append(f"{name}_sum{fmt_labels(labels)} {h.sum:.3f}")
+                lines.append(f"{name}_count{fmt_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class timed:
+    """
+    Times a block or function under operation name `op`. Usable as a
+    decorator or a context manager; exceptions are counted and re-raised.
+    """
+
+    def __init__(self, op, registry=None):
+        self.op = op
+        self.registry = registry or REGISTRY
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(self.op, self.registry):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.op, (time.perf_counter() - self._start) * 1000, error=exc_type is not None,
+                registry=self.registry)
+        return False
+
+
+def observe(op, elapsed_ms, error=False, registry=None):
+    """Records one completed operation of `op` taking `elapsed_ms`."""
+    registry = registry or REGISTRY
+    labels = {"op": op}
+    registry.observe("vestra_latency_ms", elapsed_ms, labels)
+    registry.inc("vestra_calls_total", labels)
+    if error:
+        registry.inc("vestra_errors_total", labels)
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append({"op": op, "ms": round(elapsed_ms, 3), "error": error})
+
+
+def record_fallback(op, reason, registry=None):
+    """Counts a silent degradation, e.g. a simulated rating or random embedding."""
+    (registry or REGISTRY).inc("vestra_fallbacks_total", {"op": op, "reason": reason})
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append({"op": op, "fallback": reason})
+
+
+@contextmanager
+def trace():
+    """Collects the spans of every timed operation run in this context."""
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
@@ -0,0 +1,117 @@
+# price_history.py
+"""
+Append-only price history for Intent-Locked Pricing.
+
+Every price observation is stored in `price_history`, keyed by
+(product_id, ts). Alongside it the store keeps, per product, a "suffix
+minimum frontier": the observations whose price is strictly lower than
+every later one. Frontier prices therefore increase with time, and the
+minimum price since any instant t is simply the first frontier entry at
+or after t, i.e. one B-tree seek. Appending a price p drops the frontier
+entries priced >= p (a contiguous tail, deleted once each), so appends
+stay amortised O(log n) as well.
+"""
+import sqlite3
+import threading
+from datetime import datetime, date
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_history (
+    product_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (product_id, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS price_frontier (
+    product_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (product_id, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_frontier_price ON price_frontier (product_id, price);
+CREATE TABLE IF NOT EXISTS price_latest (
+    product_id TEXT PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    price REAL NOT NULL
+);
+"""
+
+
+def to_ts(when=None):
+    """Epoch microseconds for a datetime, date, ISO string or None (now)."""
+    if when is None:
+        when = datetime.now()
+    elif isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    elif isinstance(when, date) and not isinstance(when, datetime):
+        when = datetime(when.year, when.month, when.day)
+    return int(when.timestamp() * 1_000_000)
+
+
+class PriceHistoryStore:
+    def __init__(self, db_path="price_history.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        if db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _append(self, product_id, price, ts):
+        cur = self._conn.execute("SELECT ts FROM price_latest WHERE product_id = ?", (product_id,))
+        row = cur.fetchone()
+        if row and ts <= row[0]:
+            ts = row[0] + 1  # keep the timeline strictly append-only
+        self._conn.execute("INSERT INTO price_history VALUES (?, ?, ?)", (product_id, ts, price))
+        self._conn.execute("DELETE FROM price_frontier WHERE product_id = ? AND price >= ?", (product_id, price))
+        self._conn.execute("INSERT INTO price_frontier VALUES (?, ?, ?)", (product_id, ts, price))
+        self._conn.execute("INSERT OR REPLACE INTO price_latest VALUES (?, ?, ?)", (product_id, ts, price))
+
+    def append(self, product_id, price, when=None):
+        self.append_many([(product_id, price, when)])
+
+    def append_many(self, observations):
+        """Appends (product_id, price, when) tuples in one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for product_id, price, when in observations:
+                    self._append(str(product_id), float(price), to_ts(when))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def min_price_since(self, product_id, since):
+        """Lowest observed price at or after `since`, or None if nothing was observed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT price FROM price_frontier WHERE product_id = ? AND ts >= ? ORDER BY ts LIMIT 1",
+                (str(product_id), to_ts(since))
+            ).fetchone()
+        return row[0] if row else None
+
+    def current_price(self, product_id):
+        with self._lock:
+            row = self._conn.execute("SELECT price FROM price_latest WHERE product_id = ?",
+                                     (str(product_id),)).fetchone()
+        return row[0] if row else None
+
+    def current_prices(self):
+        """Current-price table (Series indexed by product id) for PriceLockService.bulk_protection_refunds."""
+        import pandas as pd
+        with self._lock:
+            rows = self._conn.execute("SELECT product_id, price FROM price_latest").fetchall()
+        return pd.Series({pid: price for pid, price in rows}, dtype="float64")
+
+    def history(self, product_id, since=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, price FROM price_history WHERE product_id = ? AND ts >= ? ORDER BY ts",
+                (str(product_id), to_ts(since) if since is not None else 0)
+            ).fetchall()
+        return [(datetime.fromtimestamp(ts / 1_000_000), price) for ts, price in rows]
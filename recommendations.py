@@ -0,0 +1,104 @@
+# recommendations.py
+"""
+Precomputed "Complete the Look" table.
+
+For every product and every catalog category, the top-N most similar
+products *in that category* are found offline with one batched kNN per
+category over the vectors already stored in the FAISS index. The result
+is a compact int32 array `rows[product, category, rank]` (-1 = empty)
+plus float16 scores, saved as .npz. Online recommendation is then a
+lookup in the rows of the purchased items, a merge by score across the
+other categories, and exclusion of what was already bought.
+"""
+import numpy as np
+
+from utils import get_index_vectors, load_products
+
+
+class CompleteTheLookTable:
+    def __init__(self, product_ids, categories, product_category, rows, scores):
+        self.product_ids = np.asarray(product_ids).astype(str)
+        self.categories = list(categories)
+        self.product_category = np.asarray(product_category, dtype=np.int32)
+        self.rows = rows
+        self.scores = scores
+        self._row_of = {pid: i for i, pid in enumerate(self.product_ids)}
+
+    @classmethod
+    def build(cls, index, products, top_n=10, batch_size=4096):
+        """
+        index: FAISS index whose row i holds the vector of products.iloc[i].
+        products: catalog DataFrame in index order (needs id and category).
+        """
+        if index.ntotal != len(products):
+            raise ValueError(f"Index has {index.ntotal} vectors but the catalog has {len(products)} products")
+
+        import faiss
+        vectors = get_index_vectors(index)
+        faiss.normalize_L2(vectors)
+        categories = sorted(products["category"].astype(str).unique())
+        product_category = products["category"].astype(str).map({c: i for i, c in enumerate(categories)}).to_numpy()
+
+        n = len(products)
+        rows = np.full((n, len(categories), top_n), -1, dtype=np.int32)
+        scores = np.zeros((n, len(categories), top_n), dtype=np.float16)
+
+        for ci in range(len(categories)):
+            members = np.flatnonzero(product_category == ci)
+            sub = faiss.IndexFlatIP(vectors.shape[1])
+            sub.add(vectors[members])
+            # One extra neighbour so a product can drop itself from its own category.
+            k = min(top_n + 1, len(members))
+            for start in range(0, n, batch_size):
+                D, I = sub.search(vectors[start:start + batch_size], k)
+                hits = np.where(I >= 0, members[np.maximum(I, 0)], -1)
+                keep = (hits >= 0) & (hits != np.arange(start, start + len(hits))[:, None])
+                # Stable-sort kept neighbours to the front of each row, then truncate.
+                order = np.argsort(~keep, axis=1, kind="stable")[:, :top_n]
+                kept = np.take_along_axis(keep, order, axis=1)
+                width = order.shape[1]
+                rows[start:start + len(hits), ci, :width] = np.where(kept, np.take_along_axis(hits, order, axis=1), -1)
+                scores[start:start + len(hits), ci, :width] = np.where(kept, np.take_along_axis(D, order, axis=1), 0)
+
+        return cls(products["id"].to_numpy(), categories, product_category, rows, scores)
+
+    def save(self, path):
+        np.savez_compressed(path, product_ids=self.product_ids, categories=np.array(self.categories),
+                            product_category=self.product_category, rows=self.rows, scores=self.scores)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        return cls(data["product_ids"], data["categories"].tolist(), data["product_category"],
+                   data["rows"], data["scores"])
+
+    def recommend(self, purchased_ids, top_n=3):
+        """
+        Merges the precomputed neighbours of the purchased products across
+        every category they don't already cover, best score first.
+        Returns product ids; unknown purchased ids are ignored.
+        """
+        anchors = [self._row_of[str(pid)] for pid in purchased_ids if str(pid) in self._row_of]
+        if not anchors:
+            return []
+        owned = set(self.product_category[anchors].tolist())
+        other = [ci for ci in range(len(self.categories)) if ci not in owned]
+
+        best = {}
+        for a in anchors:
+            rows = self.rows[a, other].ravel()
+            scores = self.scores[a, other].ravel()
+            for row, score in zip(rows.tolist(), scores.tolist()):
+                if row >= 0 and score > best.get(row, -np.inf):
+                    best[row] = score
+
+        excluded = {str(pid) for pid in purchased_ids}
+        ranked = sorted(best, key=best.get, reverse=True)
+        return [pid for pid in (self.product_ids[r] for r in ranked) if pid not in excluded][:top_n]
+
+
+def build_table(index_path, csv_path="sample_data/products.csv", top_n=10):
+    import faiss
+    index = faiss.read_index(index_path)
+    # Ids as written, so "007" stays "007" and matches the index's id map.
+    return CompleteTheLookTable.build(index, load_products(csv_path, dtype={"id": str}), top_n=top_n)
@@ -0,0 +1,360 @@
+# recovery_monitor.py
+"""
+Background engine for Silent Recovery Commerce™.
+
+SilentRecoveryService's monitors are one-shot scans over lists. This
+engine keeps a registry of active orders and carts and re-runs those
+same checks only where something changed:
+
+    monitor = RecoveryMonitor(interval=30)
+    monitor.start()
+    monitor.upsert_order("sess-1:7", order)       # change feed
+    monitor.upsert_cart("sess-1", cart)
+    monitor.publish_weather(WeatherService.get_context())
+    monitor.publish_stock_event("42")
+    alerts = monitor.pop_alerts("sess-1")
+
+Change-feed calls mark entities dirty: an upserted order or cart, every
+cart holding a weather-sensitive fabric when the weather changes, and
+every cart holding a product hit by a stock event. Each scheduler tick
+drains the dirty set and fans the checks out over a worker pool. Alerts
+(dicts with kind, key, message and ts) wait in a bounded mailbox per
+owner, the part of the key before ":", until `pop_alerts(owner)`; pass
+`alerts=queue.Queue()` to also receive every alert on one queue.
+
+The monitor keeps its own copies of what is upserted and never touches
+the caller's dicts, which belong to another thread (a Streamlit
+session). A check that changes state (an auto-upgraded order, a stock
+hold) puts the change on its alert as `update`, and the owner applies it
+with `apply_updates(alerts, cart, orders)` from its own thread:
+
+    alerts = monitor.pop_alerts("sess-1")
+    monitor.apply_updates(alerts, cart, orders)
+
+Entities not upserted for `idle_ttl` seconds (abandoned sessions) are
+dropped. The shared instance lives in resources.py; server.py starts
+and stops it with the app.
+"""
+import copy
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from services import SilentRecoveryService, MaterialAnalyzer
+from metrics import timed, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING_ALERTS = 50
+
+
+def owner_of(key):
+    return str(key).split(":", 1)[0]
+
+
+class RecoveryMonitor:
+    def __init__(self, interval=30.0, workers=4, full_scan_every=0, alerts=None, ledger=None, idle_ttl=6 * 3600):
+        """
+        interval: seconds between scheduler ticks (a change also wakes it early).
+        full_scan_every: re-check every active entity every N ticks (0 = never),
+        as a safety net for changes that bypassed the feed.
+        ledger: optional StockLedger; stock checks then make real reservations
+        owned by the cart key. Pass `publish_stock_event` as its on_change.
+        idle_ttl: seconds after its last upsert that an entity is dropped (None = never).
+        """
+        self.interval = interval
+        self.ledger = ledger
+        self.full_scan_every = full_scan_every
+        self.idle_ttl = idle_ttl
+        self.alerts = alerts
+        self._workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._ticks = 0
+
+        self._orders = {}
+        self._carts = {}
+        self._carts_by_product = {}
+        self._weather_sensitive = set()
+        self._dirty_orders = set()
+        self._dirty_carts = set()
+        self._weather = {"condition": "Sunny"}
+        self._emitted = {}  # key -> messages already sent for it
+        self._touched = {}  # key -> time of last upsert
+        self._keys_by_owner = {}
+        self._inbox = {}  # owner -> deque of pending alerts
+
+    # -------------------------------------------------
+    # Change feed
+    # -------------------------------------------------
+    def upsert_order(self, key, order):
+        order = copy.deepcopy(order)
+        with self._lock:
+            self._orders[key] = order
+            self._dirty_orders.add(key)
+            self._track(key)
+        self._wake.set()
+
+    def remove_order(self, key):
+        with self._lock:
+            self._orders.pop(key, None)
+            self._dirty_orders.discard(key)
+            dropped = self._forget(key)
+        self._release(dropped)
+
+    def upsert_cart(self, key, cart):
+        cart = copy.deepcopy(list(cart))
+        with self._lock:
+            self._track(key)
+            self._unindex_cart(key)
+            self._carts[key] = cart
+            for item in cart:
+                self._carts_by_product.setdefault(str(item.get("id")), set()).add(key)
+            if any(self._is_weather_sensitive(item) for item in cart):
+                self._weather_sensitive.add(key)
+            self._dirty_carts.add(key)
+        self._wake.set()
+
+    def remove_cart(self, key):
+        with self._lock:
+            self._unindex_cart(key)
+            self._carts.pop(key, None)
+            self._dirty_carts.discard(key)
+            dropped = self._forget(key)
+        self._release(dropped)
+
+    def publish_weather(self, weather_context):
+        """Re-evaluates only carts holding fabrics whose suitability depends on weather."""
+        with self._lock:
+            changed = weather_context.get("condition") != self._weather.get("condition")
+            self._weather = dict(weather_context)
+            if changed:
+                self._dirty_carts |= self._weather_sensitive
+        if changed:
+            self._wake.set()
+
+    def publish_stock_event(self, product_id):
+        with self._lock:
+            self._dirty_carts |= self._carts_by_product.get(str(product_id), set())
+        self._wake.set()
+
+    def publish_shipping_event(self, order_keys=None):
+        """Carrier/logistics update for the given orders (all active orders if None)."""
+        with self._lock:
+            self._dirty_orders |= set(self._orders if order_keys is None else order_keys) & set(self._orders)
+        self._wake.set()
+
+    def _unindex_cart(self, key):
+        for item in self._carts.get(key, []):
+            holders = self._carts_by_product.get(str(item.get("id")))
+            if holders:
+                holders.discard(key)
+                if not holders:
+                    del self._carts_by_product[str(item.get("id"))]
+        self._weather_sensitive.discard(key)
+
+    def _track(self, key):
+        # caller holds the lock
+        self._touched[key] = time.time()
+        self._keys_by_owner.setdefault(owner_of(key), set()).add(key)
+
+    def _forget(self, key):
+        # caller holds the lock; the owner's mailbox goes with its last entity
+        # (returned, so the caller can release holds no one will collect)
+        self._emitted.pop(key, None)
+        self._touched.pop(key, None)
+        owner = owner_of(key)
+        keys = self._keys_by_owner.get(owner)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_owner[owner]
+                return list(self._inbox.pop(owner, ()))
+        return []
+
+    def _release(self, alerts):
+        # Outside the lock: releasing notifies the ledger's on_change, i.e. publish_stock_event.
+        for alert in alerts:
+            reservation_id = (alert.get("update") or {}).get("fields", {}).get("reservation_id")
+            if reservation_id is not None and self.ledger is not None:
+                self.ledger.release(reservation_id)
+
+    def _expire_idle(self):
+        if not self.idle_ttl:
+            return
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            idle = [k for k, ts in self._touched.items() if ts < cutoff]
+        for key in idle:
+            self.remove_order(key)
+            self.remove_cart(key)
+
+    def pop_alerts(self, owner):
+        """Returns and clears the alerts waiting for `owner` (oldest first)."""
+        with self._lock:
+            inbox = self._inbox.get(owner)
+            if not inbox:
+                return []
+            alerts = list(inbox)
+            inbox.clear()
+        return alerts
+
+    def apply_updates(self, alerts, cart=(), orders=()):
+        """
+        Applies the state changes carried by `alerts` (from pop_alerts) to
+        the owner's live cart items and orders; call it from the thread
+        that owns them. A stock hold that no longer fits an item (removed,
+        already held, or checked out meanwhile) is released.
+        """
+        orders_by_id = {order.get("order_id"): order for order in orders}
+        unclaimed = []
+        for alert in alerts:
+            update = alert.get("update")
+            if not update:
+                continue
+            fields = update["fields"]
+            if "order_id" in update:
+                order = orders_by_id.get(update["order_id"])
+                if order is not None and "shipping_upgraded" not in order:
+                    order.update(fields)
+                continue
+            now = time.time()
+            item = next((i for i in cart if str(i.get("id")) == update["item_id"]
+                         and not (i.get("stock_reserved") and i.get("reserved_until", now + 1) > now)), None)
+            if item is not None:
+                item.update(fields)
+            else:
+                unclaimed.append(alert)
+        self._release(unclaimed)
+
+    @staticmethod
+    def _is_weather_sensitive(item):
+        desc = item.get("description", "").lower()
+        return any(fabric in desc for fabric in MaterialAnalyzer.FABRIC_RULES)
+
+    # -------------------------------------------------
+    # Evaluation
+    # -------------------------------------------------
+    def _emit(self, kind, key, messages, update=None):
+        """An alert carrying an `update` is always delivered; plain ones at most once per key."""
+        dropped = []
+        for message in messages:
+            alert = {"kind": kind, "key": key, "message": message, "ts": time.time()}
+            if update:
+                alert["update"] = update
+            with self._lock:
+                if key not in self._touched:  # removed while its check ran
+                    dropped.append(alert)
+                    break
+                sent = self._emitted.setdefault(key, set())
+                if message in sent and not update:
+                    continue
+                sent.add(message)
+                inbox = self._inbox.setdefault(owner_of(key), deque(maxlen=MAX_PENDING_ALERTS))
+                if len(inbox) == inbox.maxlen:
+                    dropped.append(inbox[0])
+                inbox.append(alert)
+            REGISTRY.inc("vestra_recovery_alerts_total", {"kind": kind})
+            if self.alerts is not None:
+                self.alerts.put(alert)
+        self._release(dropped)
+
+    @staticmethod
+    def _changes(before, after):
+        return {k: v for k, v in after.items() if before.get(k) != v}
+
+    def _check_order(self, key, order):
+        checked = dict(order)
+        messages = SilentRecoveryService.monitor_shipping_delays([checked])
+        fields = self._changes(order, checked)
+        if fields:
+            with self._lock:
+                if self._orders.get(key) is order:
+                    self._orders[key] = checked
+        self._emit("shipping", key, messages, {"order_id": order.get("order_id"), "fields": fields} if fields else None)
+
+    def _check_cart(self, key, cart, weather):
+        self._emit("weather", key, SilentRecoveryService.monitor_weather_conflicts(cart, weather))
+        # One item at a time, on copies, so each hold travels with its own alert.
+        for i, item in enumerate(cart):
+            checked = dict(item)
+            messages = SilentRecoveryService.monitor_stock_levels([checked], self.ledger, owner=key)
+            fields = self._changes(item, checked)
+            if checked != item:
+                with self._lock:
+                    if self._carts.get(key) is cart:
+                        cart[i] = checked
+            self._emit("stock", key, messages, {"item_id": str(item.get("id")), "fields": fields} if fields else None)
+
+    @timed("RecoveryMonitor.run_once")
+    def run_once(self):
+        """Evaluates everything currently dirty and waits for the checks to finish."""
+        self._expire_idle()
+        with self._lock:
+            self._ticks += 1
+            if self.full_scan_every and self._ticks % self.full_scan_every == 0:
+                self._dirty_orders |= set(self._orders)
+                self._dirty_carts |= set(self._carts)
+            orders = [(k, self._orders[k]) for k in self._dirty_orders if k in self._orders]
+            carts = [(k, self._carts[k]) for k in self._dirty_carts if k in self._carts]
+            self._dirty_orders.clear()
+            self._dirty_carts.clear()
+            weather = dict(self._weather)
+
+        pool = self._executor()
+        futures = [pool.submit(self._check_order, k, o) for k, o in orders]
+        futures += [pool.submit(self._check_cart, k, c, weather) for k, c in carts]
+        done, _ = wait(futures)
+        for f in done:
+            if f.exception():
+                logger.warning("Recovery check failed: %s", f.exception())
+        return len(orders), len(carts)
+
+    # -------------------------------------------------
+    # Scheduler
+    # -------------------------------------------------
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="recovery")
+            return self._pool
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning("Recovery monitor tick failed: %s", e)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Starts the scheduler thread; a no-op if it is already running. Can follow `stop()`."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="recovery-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """Stops the scheduler and worker pool; a no-op if already stopped. The registry is kept."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
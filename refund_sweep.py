@@ -0,0 +1,56 @@
+# refund_sweep.py
+"""
+Nightly Intent-Locked Pricing refund sweep.
+
+Reads order lines (columns: product_id, locked_price, date) and a
+current-price table (the latest prices in a PriceHistoryStore database,
+or a CSV with id and price columns; defaults to the catalog CSV),
+runs PriceLockService.bulk_protection_refunds over them and streams the
+eligible refunds to a CSV chunk by chunk.
+
+    python refund_sweep.py --orders order_lines.csv --out refunds.csv
+"""
+import time
+import argparse
+
+import pandas as pd
+
+from services import PriceLockService
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--orders", required=True, help="CSV or Parquet of order lines")
+parser.add_argument("--prices", default="sample_data/products.csv", help="CSV with id and price columns")
+parser.add_argument("--price-db", help="PriceHistoryStore database; overrides --prices")
+parser.add_argument("--out", default="refunds.csv")
+parser.add_argument("--window-days", type=int, default=30)
+parser.add_argument("--chunk-size", type=int, default=1_000_000)
+parser.add_argument("--as-of", default=None, help="Sweep date (YYYY-MM-DD), defaults to today")
+args = parser.parse_args()
+
+start = time.perf_counter()
+reader = pd.read_parquet if args.orders.endswith(".parquet") else pd.read_csv
+lines = reader(args.orders, dtype={"product_id": str})
+if args.price_db:
+    from price_history import PriceHistoryStore
+    table = PriceHistoryStore(args.price_db).current_prices()
+else:
+    prices = pd.read_csv(args.prices, usecols=["id", "price"], dtype={"id": str}).drop_duplicates("id", keep="last")
+    table = prices.set_index("id")["price"]
+
+total_lines, total_refund, eligible = len(lines), 0.0, 0
+chunks = PriceLockService.bulk_protection_refunds(
+    lines["product_id"].to_numpy(dtype=object),
+    lines["locked_price"].to_numpy(),
+    lines["date"].to_numpy(dtype="datetime64[D]"),
+    table,
+    as_of=args.as_of,
+    window_days=args.window_days,
+    chunk_size=args.chunk_size
+)
+for i, chunk in enumerate(chunks):
+    chunk.to_csv(args.out, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    eligible += len(chunk)
+    total_refund += float(chunk["refund"].sum())
+
+print(f"Scanned {total_lines} lines in {time.perf_counter() - start:.2f}s: "
+      f"{eligible} eligible, ${total_refund:,.2f} total refund -> {args.out}")
@@ -0,0 +1,243 @@
+# resilience.py
+"""
+Circuit breakers and per-request latency budgets for upstream calls.
+
+    breaker = get_breaker("google")
+    try:
+        with breaker.call(timeout=2) as call:
+            resp = requests.get(url, timeout=call.timeout)
+            if resp.status_code != 200:
+                call.fail()
+    except Unavailable as e:            # circuit open or budget spent
+        record_fallback(op, e.reason)
+
+Each dependency ("openai", "google", "weather") has one breaker that keeps
+a rolling window of recent outcomes. When enough calls in the window
+failed, or ran slower than the dependency's `slow_ms`, the circuit opens
+and callers go straight to their fallback instead of waiting out a
+timeout. After `cooldown_s` one probe call is let through (half-open); it
+closes the circuit on success and re-opens it on failure.
+
+`with deadline(seconds):` gives everything run in that context (including
+worker threads started with asyncio.to_thread, which copies the context)
+an end-to-end budget. `call.timeout` is the dependency's own timeout cut
+down to what is left of the budget; a call that times out because the
+budget was short is not held against the dependency and surfaces as
+BudgetExhausted rather than the client library's timeout error.
+
+Transitions are counted in vestra_circuit_transitions_total{dependency, state}.
+"""
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import REGISTRY
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Calls shorter than this are not worth starting on what is left of a budget.
+MIN_TIMEOUT_S = 0.05
+
+BREAKER_SETTINGS = {
+    "openai": {"slow_ms": 15000, "cooldown_s": 30.0},
+    "google": {"slow_ms": 1500},
+    "weather": {"slow_ms": 2000},
+}
+
+_deadline = contextvars.ContextVar("vestra_deadline", default=None)
+
+
+class Unavailable(Exception):
+    """Raised instead of making a call that could not succeed in time."""
+    reason = "unavailable"
+
+
+class CircuitOpen(Unavailable):
+    reason = "circuit_open"
+
+
+class BudgetExhausted(Unavailable):
+    reason = "budget_exhausted"
+
+
+# -------------------------------------------------
+# Latency budget
+# -------------------------------------------------
+@contextmanager
+def deadline(seconds):
+    """Limits this context to `seconds` from now (or less, if an outer deadline is sooner)."""
+    if seconds is None:
+        yield
+        return
+    end = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(end if outer is None else min(outer, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the current budget, or None without a deadline."""
+    end = _deadline.get()
+    return None if end is None else max(0.0, end - time.monotonic())
+
+
+def timeout_for(default):
+    """`default` cut down to the remaining budget (`default` may be None for no limit)."""
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
+
+
+# -------------------------------------------------
+# Circuit breaker
+# -------------------------------------------------
+class _Call:
+    __slots__ = ("timeout", "budget_limited", "ok")
+
+    def __init__(self, timeout, budget_limited):
+        self.timeout = timeout
+        self.budget_limited = budget_limited
+        self.ok = True
+
+    def fail(self):
+        """Marks a call that returned but did not succeed (e.g. an HTTP error status)."""
+        self.ok = False
+
+
+class CircuitBreaker:
+    def __init__(self, name, window_s=30.0, min_calls=10, error_rate=0.5, slow_ms=None, slow_rate=0.5,
+                 cooldown_s=15.0, registry=None):
+        self.name = name
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_ms = slow_ms
+        self.slow_rate = slow_rate
+        self.cooldown_s = cooldown_s
+        self.registry = registry or REGISTRY
+        self._lock = threading.Lock()
+        self._window = deque()  # (monotonic time, failed, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown_s:
+                return HALF_OPEN
+            return self._state
+
+    def _transition(self, state):
+        # caller holds the lock
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        else:
+            self._window.clear()
+        self._probing = False
+        self.registry.inc("vestra_circuit_transitions_total", {"dependency": self.name, "state": state})
+
+    def allow(self):
+        """True if a call may go upstream now. In half-open state only one probe is let through."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown_s:
+                    return False
+                self._transition(HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok, latency_ms):
+        now = time.monotonic()
+        slow = self.slow_ms is not None and latency_ms > self.slow_ms
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED if ok and not slow else OPEN)
+                return
+            if self._state == OPEN:
+                return
+            self._window.append((now, not ok, slow))
+            while self._window and now - self._window[0][0] > self.window_s:
+                self._window.popleft()
+            n = len(self._window)
+            if n < self.min_calls:
+                return
+            failures = sum(1 for _, failed, _ in self._window if failed)
+            slow_calls = sum(1 for _, _, s in self._window if s)
+            if failures / n >= self.error_rate or slow_calls / n >= self.slow_rate:
+                self._transition(OPEN)
+
+    def _release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def call(self, timeout=None):
+        """
+        Guards one upstream call. Raises CircuitOpen or BudgetExhausted
+        instead of running the block when the call should not be made;
+        otherwise yields a handle whose `timeout` is the one to pass on
+        and records the outcome (an exception counts as a failure, unless
+        it came from running out a budget-shortened timeout, which is
+        re-raised as BudgetExhausted).
+        """
+        cut = timeout_for(timeout)
+        if cut is not None and cut < MIN_TIMEOUT_S:
+            raise BudgetExhausted(f"{self.name}: latency budget spent")
+        if not self.allow():
+            raise CircuitOpen(f"{self.name}: circuit open")
+        handle = _Call(cut, budget_limited=cut is not None and (timeout is None or cut < timeout))
+        start = time.perf_counter()
+        recorded = False
+        try:
+            yield handle
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            # Running out a timeout we shortened ourselves says nothing about the dependency.
+            if handle.budget_limited and elapsed >= 0.9 * cut:
+                raise BudgetExhausted(f"{self.name}: latency budget spent after {elapsed:.2f}s") from e
+            self.record(False, elapsed * 1000)
+            recorded = True
+            raise
+        else:
+            self.record(handle.ok, (time.perf_counter() - start) * 1000)
+            recorded = True
+        finally:
+            if not recorded:
+                self._release_probe()
+
+    def snapshot(self):
+        with self._lock:
+            n = len(self._window)
+            failures = sum(1 for _, failed, _ in self._window if failed)
+        return {"state": self.state, "calls": n, "failures": failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """The process-wide breaker for dependency `name` (see BREAKER_SETTINGS)."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name, **BREAKER_SETTINGS.get(name, {}))
+    return breaker
+
+
+def breaker_states():
+    return {name: breaker.snapshot() for name, breaker in sorted(_breakers.items())}
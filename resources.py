@@ -0,0 +1,116 @@
+# resources.py
+"""
+Process-wide shared resources.
+
+The agent (and with it both FAISS indices), the product catalog and the
+local embedder are expensive to load and read-only once built, so they
+are created once per process and shared by every Streamlit session and
+API request. Per-user state (history, cart, orders) stays in the caller.
+When $VESTRA_MANIFEST names a build manifest (see build_index.py), the
+agent loads that build's artefact set instead of the loose files.
+"""
+import os
+import threading
+
+from agent import ShoppingAgent
+from inventory import StockLedger
+from price_history import PriceHistoryStore
+from recovery_monitor import RecoveryMonitor
+from thumbnails import ThumbnailCache
+from utils import get_catalog, get_local_embedder
+
+_agents = {}
+_agents_lock = threading.Lock()
+_price_store = None
+_price_store_lock = threading.Lock()
+_stock_ledger = None
+_stock_ledger_lock = threading.Lock()
+_thumbnails = None
+_thumbnails_lock = threading.Lock()
+_recovery_monitor = None
+_recovery_monitor_lock = threading.Lock()
+
+
+def default_emb_method():
+    return os.getenv("VESTRA_EMB_METHOD") or ("openai" if os.getenv("OPENAI_API_KEY") else "local")
+
+
+def get_agent(emb_method=None):
+    """Returns the shared ShoppingAgent for `emb_method`, building it on first use."""
+    emb_method = emb_method or default_emb_method()
+    agent = _agents.get(emb_method)
+    if agent is None:
+        with _agents_lock:
+            agent = _agents.get(emb_method)
+            if agent is None:
+                manifest = os.getenv("VESTRA_MANIFEST")
+                if manifest:
+                    agent = ShoppingAgent.from_manifest(manifest, emb_method=emb_method)
+                else:
+                    agent = ShoppingAgent(
+                        index_path_openai=os.getenv("VESTRA_INDEX_OPENAI", "product_index_openai.faiss"),
+                        index_path_local=os.getenv("VESTRA_INDEX_LOCAL", "product_index_local.faiss"),
+                        emb_method=emb_method
+                    )
+                _agents[emb_method] = agent
+    return agent
+
+
+def get_price_store():
+    """Shared price-history store; the SQLite connection is serialised by the store's own lock."""
+    global _price_store
+    if _price_store is None:
+        with _price_store_lock:
+            if _price_store is None:
+                _price_store = PriceHistoryStore(os.getenv("VESTRA_PRICE_DB", "price_history.db"))
+    return _price_store
+
+
+def get_stock_ledger():
+    """Shared stock ledger, seeded from the catalog, with reservation expiry running in the background."""
+    global _stock_ledger
+    if _stock_ledger is None:
+        with _stock_ledger_lock:
+            if _stock_ledger is None:
+                ledger = StockLedger(os.getenv("VESTRA_INVENTORY_DB", "inventory.db"))
+                ledger.seed(get_catalog().records.keys())
+                _stock_ledger = ledger.start_expiry()
+    return _stock_ledger
+
+
+def get_thumbnail_cache():
+    """Shared on-disk thumbnail cache for product images."""
+    global _thumbnails
+    if _thumbnails is None:
+        with _thumbnails_lock:
+            if _thumbnails is None:
+                _thumbnails = ThumbnailCache(os.getenv("VESTRA_THUMB_DIR", "thumb_cache"),
+                                             max_bytes=int(os.getenv("VESTRA_THUMB_MAX_MB", "512")) * 1024 * 1024)
+    return _thumbnails
+
+
+def get_recovery_monitor():
+    """
+    Shared Silent Recovery background monitor, started on first use. Its
+    stock checks reserve against the shared ledger, whose changes feed back
+    into it as stock events.
+    """
+    global _recovery_monitor
+    if _recovery_monitor is None:
+        with _recovery_monitor_lock:
+            if _recovery_monitor is None:
+                ledger = get_stock_ledger()
+                monitor = RecoveryMonitor(interval=float(os.getenv("VESTRA_RECOVERY_INTERVAL", "30")), ledger=ledger)
+                ledger.on_change = monitor.publish_stock_event
+                _recovery_monitor = monitor.start()
+    return _recovery_monitor
+
+
+def warm_up(emb_method=None):
+    """Eagerly loads everything a request touches so the first user doesn't pay for it."""
+    emb_method = emb_method or default_emb_method()
+    agent = get_agent(emb_method)
+    get_catalog()
+    if emb_method == "local":
+        get_local_embedder()
+    return agent
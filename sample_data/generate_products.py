@@ -1,17 +1,40 @@
 # sample_data/generate_products.py
+"""
+Catalog generator.
+
+Default mode builds the demo catalog with real product photos from the
+Pexels API (needs PEXELS_API_KEY):
+
+    python sample_data/generate_products.py
+
+--offline needs no network: it draws millions of products from the same
+category / color / material vocabulary, with per-category log-normal
+prices, occasion attributes and placeholder image URLs. Shards are
+generated in parallel processes and written as one CSV, or as a
+directory of Parquet parts (pandas + pyarrow), for the index and load
+benchmarks:
+
+    python sample_data/generate_products.py --offline --count 5000000 --workers 8 --out /data/products_5m.csv
+    python sample_data/generate_products.py --offline --count 5000000 --format parquet --out /data/products_5m
+"""
 import csv
 import os
+import sys
 import time
+import glob
+import shutil
+import argparse
+import logging
+import sqlite3
+import tempfile
+import threading
 import requests
 from random import choice, uniform
-import logging
-import sys
-
-logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+from urllib.parse import quote_plus
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-OUT = "sample_data"
-os.makedirs(OUT, exist_ok=True)
-F = os.path.join(OUT, "products.csv")
+FIELDNAMES = ["id", "title", "category", "description", "price", "image_url", "attributes"]
 
 # --------------------------
 # Categories and templates
@@ -61,19 +84,142 @@ def normalize_category(query):
 colors = ["navy", "black", "ivory", "emerald", "burgundy", "charcoal", "tan", "blush", "pink","blue"]
 materials = ["wool", "silk", "cotton", "linen", "polyester blend", "suede", "leather"]
 
+# --------------------------
+# Offline catalog model
+# --------------------------
+# Median price and log-normal spread per category, scaled by material.
+CATEGORY_PRICING = {
+    "Women's Dresses": (140.0, 0.55),
+    "Men": (160.0, 0.60),
+    "Outerwear": (210.0, 0.50),
+    "Accessories": (45.0, 0.70),
+    "Shoes": (120.0, 0.50)
+}
+MATERIAL_PRICE_FACTOR = {
+    "wool": 1.2, "silk": 1.45, "cotton": 0.85, "linen": 1.0, "polyester blend": 0.7, "suede": 1.3, "leather": 1.5
+}
+PRICE_RANGE = (9.99, 1999.99)
+
+FORMAL_TEMPLATES = {"cocktail dress", "tuxedo", "morning coat", "heels", "clutch", "statement necklace"}
+BUSINESS_TEMPLATES = {"two-piece suit", "blazer", "oxfords", "loafers", "trench coat", "midi dress"}
+
+DESCRIPTIONS = [
+    "A {color} {item} made from {material}. Versatile, elegant, and suitable for {occasion} events. "
+    "Lightweight, breathable, and tailored fit.",
+    "Crafted in {material}, this {color} {item} is made for {occasion} wear. Clean lines and a comfortable cut.",
+    "Our {color} {item} in soft {material}: an easy {occasion} staple that layers well through the seasons.",
+    "{color_title} {item} in {material} with refined finishing. Pairs well with neutrals for {occasion} looks."
+]
+
+PLACEHOLDER_IMAGE_URL = "https://placehold.co/800x800?text={}"
+
+
+def occasions_for(template):
+    if template in FORMAL_TEMPLATES:
+        return ["formal", "semi-formal"]
+    if template in BUSINESS_TEMPLATES:
+        return ["business", "semi-formal"]
+    return ["casual", "semi-formal"] if "dress" in template else ["casual"]
+
+
+def generate_offline_rows(start_id, count, seed):
+    """`count` products with ids start_id.. drawn with a per-shard seed (same seed -> same rows)."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    cats = list(categories)
+    cat_idx = rng.integers(len(cats), size=count)
+    color_idx = rng.integers(len(colors), size=count)
+    mat_idx = rng.integers(len(materials), size=count)
+    desc_idx = rng.integers(len(DESCRIPTIONS), size=count)
+    template_u = rng.random(count)
+    occasion_u = rng.random(count)
+
+    medians = np.array([CATEGORY_PRICING[c][0] for c in cats])[cat_idx]
+    sigmas = np.array([CATEGORY_PRICING[c][1] for c in cats])[cat_idx]
+    factors = np.array([MATERIAL_PRICE_FACTOR[m] for m in materials])[mat_idx]
+    prices = np.clip(medians * factors * np.exp(rng.normal(0.0, sigmas)), *PRICE_RANGE)
+    # Most prices end in .99, the rest keep their cents
+    prices = np.where(rng.random(count) < 0.7, np.ceil(prices) - 0.01, np.round(prices, 2))
+
+    rows = []
+    for i in range(count):
+        cat = cats[cat_idx[i]]
+        templates = categories[cat]
+        template = templates[int(template_u[i] * len(templates))]
+        occasions = occasions_for(template)
+        occasion = occasions[int(occasion_u[i] * len(occasions))]
+        color, mat = colors[color_idx[i]], materials[mat_idx[i]]
+        title = f"{color.title()} {template.title()} ({mat})"
+        rows.append({
+            "id": str(start_id + i),
+            "title": title,
+            "category": cat,
+            "description": DESCRIPTIONS[desc_idx[i]].format(color=color, color_title=color.title(), item=template,
+                                                             material=mat, occasion=occasion),
+            "price": float(prices[i]),
+            "image_url": PLACEHOLDER_IMAGE_URL.format(quote_plus(title)),
+            "attributes": str({"color": color, "material": mat, "occasion": occasion})
+        })
+    return rows
+
+
+def _write_shard(task):
+    """Worker: generates one shard and writes it as a headerless CSV or a Parquet part."""
+    start_id, count, seed, path, fmt = task
+    rows = generate_offline_rows(start_id, count, seed)
+    if fmt == "parquet":
+        import pandas as pd
+        pd.DataFrame(rows, columns=FIELDNAMES).to_parquet(path, index=False)
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as fh:
+            csv.DictWriter(fh, fieldnames=FIELDNAMES).writerows(rows)
+    return count
+
+
+def generate_offline(out, count, workers=None, shard_size=100_000, fmt="csv", seed=0):
+    """
+    Writes `count` offline products to `out`: one CSV file, or for Parquet
+    a directory of part-NNNNN.parquet files (one per shard, in id order).
+    Output is deterministic for a given count, shard size and seed.
+    """
+    shards = [(start + 1, min(shard_size, count - start), seed + n)
+              for n, start in enumerate(range(0, count, shard_size))]
+    if fmt == "parquet":
+        os.makedirs(out, exist_ok=True)
+        # Parts left by an earlier, larger run would otherwise be read as part of this catalog
+        for stale in glob.glob(os.path.join(out, "part-*.parquet")):
+            os.remove(stale)
+        tasks = [(s, c, sd, os.path.join(out, f"part-{n:05d}.parquet"), fmt) for n, (s, c, sd) in enumerate(shards)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            written = sum(pool.map(_write_shard, tasks))
+        return written
+
+    out_dir = os.path.dirname(os.path.abspath(out))
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix="products_", dir=out_dir)
+    try:
+        tasks = [(s, c, sd, os.path.join(tmp, f"part-{n:05d}.csv"), fmt) for n, (s, c, sd) in enumerate(shards)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            written = sum(pool.map(_write_shard, tasks))
+        with open(out, "w", newline="", encoding="utf-8") as fh:
+            csv.DictWriter(fh, fieldnames=FIELDNAMES).writeheader()
+            for task in tasks:
+                with open(task[3], encoding="utf-8") as part:
+                    shutil.copyfileobj(part, fh)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return written
+
 # --------------------------
 # Pexels API setup
 # --------------------------
 PEXELS_API_KEY = os.environ.get("PEXELS_API_KEY")
-if not PEXELS_API_KEY:
-    logging.error("Environment variable PEXELS_API_KEY not set. Please export your Pexels API key and rerun.")
-    logging.error("Example (Linux/macOS): export PEXELS_API_KEY='your_key_here'")
-    sys.exit(1)
-
 PEXELS_API_BASE = "https://api.pexels.com/v1"
 SEARCH_ENDPOINT = f"{PEXELS_API_BASE}/search"
 CURATED_ENDPOINT = f"{PEXELS_API_BASE}/curated"
-HEADERS = {"Authorization": PEXELS_API_KEY}
+# Pexels' default quota is 200 requests per hour (20,000 per month)
+PEXELS_REQUESTS_PER_HOUR = 200
+PEXELS_CACHE = os.path.join("sample_data", "pexels_cache.db")
 
 # --------------------------
 # Helper functions
@@ -85,104 +231,278 @@ def choose_best_src(photo):
             return src[key]
     return src.get("original") or photo.get("url") or None
 
-def pexels_search_image_url(query, per_page=3, sleep_between=0.2):
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Empties the bucket for `seconds`, e.g. when the API reports the quota is spent."""
+        with self.lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+            self.updated = time.monotonic()
+
+
+class ImageUrlCache:
+    """Persistent query -> image URL cache (SQLite), so repeated and resumed runs skip resolved queries."""
+
+    def __init__(self, path=PEXELS_CACHE):
+        self.conn = sqlite3.connect(path)
+        # WAL + NORMAL sync keeps the per-result commit cheap
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS image_urls (query TEXT PRIMARY KEY, url TEXT NOT NULL, "
+                          "fetched_at REAL NOT NULL)")
+
+    def get_many(self, queries):
+        found = {}
+        queries = list(queries)
+        for i in range(0, len(queries), 500):
+            batch = queries[i:i + 500]
+            found.update(self.conn.execute(
+                f"SELECT query, url FROM image_urls WHERE query IN ({','.join('?' * len(batch))})", batch).fetchall())
+        return found
+
+    def put(self, query, url):
+        self.conn.execute("INSERT OR REPLACE INTO image_urls VALUES (?, ?, ?)", (query, url, time.time()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def retry_after_seconds(value, default):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date); `default` if absent or unparsable."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class PexelsResolver:
     """
-    Search Pexels for 'query' and return the best image URL.
-    If no results, falls back to curated photos endpoint.
+    Resolves image search queries to Pexels photo URLs: distinct queries
+    only, cached ones skipped, the rest fetched concurrently over a pooled
+    session while a shared token bucket keeps the request rate within the
+    Pexels quota. Results are written to the cache as they arrive, so an
+    interrupted run resumes where it stopped.
     """
-    q = str(query).strip()
-    params = {"query": q, "per_page": per_page, "page": 1}
-    try:
-        resp = requests.get(SEARCH_ENDPOINT, headers=HEADERS, params=params, timeout=10)
-    except requests.RequestException as e:
-        logging.warning("Request error for query '%s': %s", q, e)
-        return None
 
-    if resp.status_code == 200:
-        data = resp.json()
-        photos = data.get("photos", [])
-        if photos:
-            photo = choice(photos)
-            url = choose_best_src(photo)
-            if url:
-                time.sleep(sleep_between)
-                return url
-            else:
+    def __init__(self, api_key=PEXELS_API_KEY, cache=None, max_workers=8,
+                 requests_per_hour=PEXELS_REQUESTS_PER_HOUR, burst=10):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.limiter = TokenBucket(requests_per_hour / 3600.0, burst)
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": api_key})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+
+    def _get(self, url, params, retries=3):
+        for attempt in range(retries + 1):
+            self.limiter.acquire()
+            resp = self.session.get(url, params=params, timeout=10)
+            reset = resp.headers.get("X-Ratelimit-Reset")
+            if resp.headers.get("X-Ratelimit-Remaining") == "0" and reset and reset.isdigit():
+                self.limiter.pause(max(0.0, int(reset) - time.time()))
+            if resp.status_code != 429 or attempt == retries:
+                return resp
+            delay = retry_after_seconds(resp.headers.get("Retry-After"), 2 ** attempt)
+            logging.warning("Pexels rate limit hit, backing off %.0fs", delay)
+            self.limiter.pause(delay)
+        return resp
+
+    def search(self, query, per_page=3):
+        """
+        Search Pexels for 'query' and return the best image URL.
+        If no results, falls back to curated photos endpoint.
+        """
+        q = str(query).strip()
+        try:
+            resp = self._get(SEARCH_ENDPOINT, {"query": q, "per_page": per_page, "page": 1})
+        except requests.RequestException as e:
+            logging.warning("Request error for query '%s': %s", q, e)
+            return None
+
+        if resp.status_code == 200:
+            photos = resp.json().get("photos", [])
+            if photos:
+                url = choose_best_src(choice(photos))
+                if url:
+                    return url
                 logging.debug("No src found in selected photo for query '%s'", q)
-    else:
-        logging.warning("Pexels API returned %s for query '%s': %s", resp.status_code, q, resp.text)
-        if resp.status_code == 401:
-            logging.error("Unauthorized: check your PEXELS_API_KEY.")
-        return None
+        else:
+            logging.warning("Pexels API returned %s for query '%s': %s", resp.status_code, q, resp.text)
+            if resp.status_code == 401:
+                logging.error("Unauthorized: check your PEXELS_API_KEY.")
+            return None
 
-    # fallback: curated endpoint
-    try:
-        resp2 = requests.get(CURATED_ENDPOINT, headers=HEADERS, params={"per_page": 1, "page": 1}, timeout=10)
-    except requests.RequestException as e:
-        logging.warning("Curated request error: %s", e)
+        # fallback: curated endpoint
+        try:
+            resp2 = self._get(CURATED_ENDPOINT, {"per_page": 1, "page": 1})
+        except requests.RequestException as e:
+            logging.warning("Curated request error: %s", e)
+            return None
+
+        if resp2.status_code == 200:
+            photos2 = resp2.json().get("photos", [])
+            if photos2:
+                return choose_best_src(photos2[0])
+        else:
+            logging.warning("Pexels curated endpoint returned %s: %s", resp2.status_code, resp2.text)
         return None
 
-    if resp2.status_code == 200:
-        data2 = resp2.json()
-        photos2 = data2.get("photos", [])
-        if photos2:
-            photo = photos2[0]
-            url = choose_best_src(photo)
-            time.sleep(sleep_between)
-            return url
-    else:
-        logging.warning("Pexels curated endpoint returned %s: %s", resp2.status_code, resp2.text)
+    def resolve_many(self, queries):
+        """{query: url or None} for the distinct `queries`."""
+        unique = list(dict.fromkeys(str(q).strip() for q in queries))
+        urls = self.cache.get_many(unique) if self.cache else {}
+        missing = [q for q in unique if q not in urls]
+        logging.info("%d distinct image queries: %d cached, %d to fetch", len(unique), len(urls), len(missing))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.search, q): q for q in missing}
+            for n, future in enumerate(as_completed(futures), 1):
+                query, url = futures[future], future.result()
+                urls[query] = url
+                if url and self.cache:
+                    self.cache.put(query, url)  # failures are retried on the next run
+                if n % 50 == 0:
+                    logging.info("Resolved %d/%d image queries", n, len(missing))
+        return urls
+
 
-    return None
+def pexels_search_image_url(query, per_page=3):
+    """Single uncached lookup, kept for ad-hoc use; catalog generation goes through PexelsResolver."""
+    return PexelsResolver(max_workers=1).search(query, per_page=per_page)
 
 # --------------------------
 # Generate product rows
 # --------------------------
-rows = []
-id_counter = 1
-total_per_category = 50  # configurable
+def generate_pexels_rows(total_per_category=50, resolver=None):
+    rows = []
+    image_queries = []
+    id_counter = 1
 
-for cat, templates in categories.items():
-    for i in range(total_per_category):
-        template = choice(templates)
-        color = choice(colors)
-        mat = choice(materials)
-        title = f"{color.title()} {template.title()} ({mat})"
-        desc = (f"A {color} {template} made from {mat}. Versatile, elegant, "
-                "and suitable for semi-formal events. Lightweight, breathable, and tailored fit.")
-        price = round(uniform(39.99, 499.99), 2)
-
-        # normalize category using aliases for search
-        cat_normalized = normalize_category(cat)
-        img_q = f"{cat_normalized} {template} {color}"
-        img_url = pexels_search_image_url(img_q)
-        if not img_url:
-            logging.warning("Could not fetch Pexels image for '%s' — leaving image_url blank for id %d.", img_q, id_counter)
-            img_url = ""
-
-        attrs = {
-            "color": color,
-            "material": mat,
-            "occasion": "semi-formal" if "dress" in template or "suit" in template else "casual"
-        }
-        rows.append({
-            "id": str(id_counter),
-            "title": title,
-            "category": cat,
-            "description": desc,
-            "price": price,
-            "image_url": img_url,
-            "attributes": str(attrs)
-        })
-        id_counter += 1
+    for cat, templates in categories.items():
+        for i in range(total_per_category):
+            template = choice(templates)
+            color = choice(colors)
+            mat = choice(materials)
+            title = f"{color.title()} {template.title()} ({mat})"
+            desc = (f"A {color} {template} made from {mat}. Versatile, elegant, "
+                    "and suitable for semi-formal events. Lightweight, breathable, and tailored fit.")
+            price = round(uniform(39.99, 499.99), 2)
+
+            # normalize category using aliases for search
+            cat_normalized = normalize_category(cat)
+            image_queries.append(f"{cat_normalized} {template} {color}")
+
+            attrs = {
+                "color": color,
+                "material": mat,
+                "occasion": "semi-formal" if "dress" in template or "suit" in template else "casual"
+            }
+            rows.append({
+                "id": str(id_counter),
+                "title": title,
+                "category": cat,
+                "description": desc,
+                "price": price,
+                "image_url": "",
+                "attributes": str(attrs)
+            })
+            id_counter += 1
+
+    # Identical queries (same category/item/color) share one lookup
+    urls = (resolver or PexelsResolver()).resolve_many(image_queries)
+    for row, img_q in zip(rows, image_queries):
+        row["image_url"] = urls.get(img_q) or ""
+        if not row["image_url"]:
+            logging.warning("Could not fetch Pexels image for '%s' — leaving image_url blank for id %s.", img_q, row["id"])
+    return rows
 
 # --------------------------
 # Write CSV
 # --------------------------
-with open(F, "w", newline="", encoding="utf-8") as fh:
-    writer = csv.DictWriter(fh, fieldnames=["id","title","category","description","price","image_url","attributes"])
-    writer.writeheader()
-    for r in rows:
-        writer.writerow(r)
+def write_csv(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for r in rows:
+            writer.writerow(r)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Generate the product catalog.")
+    parser.add_argument("--offline", action="store_true", help="Synthetic catalog without any network calls")
+    parser.add_argument("--out", default=os.path.join("sample_data", "products.csv"))
+    parser.add_argument("--per-category", type=int, default=50, help="Pexels mode: products per category")
+    parser.add_argument("--cache", default=PEXELS_CACHE, help="Pexels mode: persistent query -> image URL cache")
+    parser.add_argument("--pexels-workers", type=int, default=8, help="Pexels mode: concurrent requests")
+    parser.add_argument("--requests-per-hour", type=float, default=PEXELS_REQUESTS_PER_HOUR,
+                        help="Pexels mode: request budget (your plan's hourly limit)")
+    parser.add_argument("--count", type=int, default=1_000_000, help="Offline mode: number of products")
+    parser.add_argument("--workers", type=int, default=None, help="Offline mode: processes (default: CPU count)")
+    parser.add_argument("--shard-size", type=int, default=100_000, help="Offline mode: products per worker task")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="Offline mode: one CSV file, or a directory of Parquet parts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.offline:
+        if args.format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                parser.error("--format parquet needs pyarrow (pip install -r requirements.txt)")
+        start = time.perf_counter()
+        written = generate_offline(args.out, args.count, workers=args.workers, shard_size=args.shard_size,
+                                   fmt=args.format, seed=args.seed)
+        print(f"Wrote {written} products to {args.out} in {time.perf_counter() - start:.1f}s")
+        return
+
+    if not PEXELS_API_KEY:
+        logging.error("Environment variable PEXELS_API_KEY not set. Please export your Pexels API key and rerun.")
+        logging.error("Example (Linux/macOS): export PEXELS_API_KEY='your_key_here'")
+        logging.error("Or generate a synthetic catalog without images: --offline")
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    cache = ImageUrlCache(args.cache)
+    try:
+        resolver = PexelsResolver(cache=cache, max_workers=args.pexels_workers,
+                                  requests_per_hour=args.requests_per_hour)
+        rows = generate_pexels_rows(args.per_category, resolver)
+    finally:
+        cache.close()
+    write_csv(rows, args.out)
+    print(f"Wrote {len(rows)} products to {args.out}")
+
 
-print(f"Wrote {len(rows)} products to {F}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+# server.py
+"""
+Headless JSON API for the Vestra shopping agent.
+
+A dependency-free ASGI application: any ASGI server can host it, e.g.
+
+    uvicorn server:app --workers 4
+    python server.py --port 8000
+
+GET /metrics serves latency histograms, call/error counters and fallback
+counts in Prometheus text format (or JSON with ?format=json); POST /chat
+with "trace": true also returns the per-request span list. GET /thumb
+serves resized product images from the local thumbnail cache. GET /health
+reports the state of each upstream circuit breaker (see resilience.py).
+The /recovery/* endpoints accept an optional "session_id": the session's
+cart and orders are then watched by the background RecoveryMonitor
+(started and stopped with the app), and the alerts it raised since the
+previous call come back as "background_alerts".
+
+One ShoppingAgent (and with it the FAISS indices), the catalog and the
+local embedder are loaded per process (see resources.py) and shared by
+every request. Blocking agent and service calls run in the
+default thread pool so the event loop keeps accepting connections.
+"""
+import json
+import math
+import asyncio
+import logging
+import argparse
+from urllib.parse import parse_qs
+
+import metrics
+from resilience import breaker_states
+from resources import get_agent, get_price_store, get_thumbnail_cache, get_recovery_monitor, warm_up
+from utils import get_catalog
+from price_history import to_ts
+from services import PriceLockService, SilentRecoveryService, WeatherService
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _jsonable(obj):
+    if isinstance(obj, dict):
+        return {str(k): _jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(v) for v in obj]
+    if hasattr(obj, "item") and callable(obj.item):  # numpy scalars
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    return str(obj)
+
+
+def _require(payload, key):
+    if key not in payload:
+        raise HTTPError(400, f"Missing field '{key}'")
+    return payload[key]
+
+
+def _number(payload, key, default, cast=int, minimum=None):
+    """payload[key] (or `default`) as `cast`; bad client input is a 400, not a 500."""
+    value = payload.get(key, default)
+    if value is None:
+        return None
+    try:
+        value = cast(value)
+    except (TypeError, ValueError, OverflowError):
+        raise HTTPError(400, f"Field '{key}' must be {'an integer' if cast is int else 'a number'}")
+    if not math.isfinite(value):
+        raise HTTPError(400, f"Field '{key}' must be finite")
+    if minimum is not None and value < minimum:
+        raise HTTPError(400, f"Field '{key}' must be at least {minimum}")
+    return value
+
+
+def _mapping(payload, key):
+    """payload[key] as a dict, or None when absent."""
+    value = payload.get(key)
+    if value is not None and not isinstance(value, dict):
+        raise HTTPError(400, f"Field '{key}' must be an object")
+    return value
+
+
+def _product_ids(payload, key):
+    """payload[key] as a list of product ids, each coerced to str."""
+    value = _require(payload, key)
+    if not isinstance(value, list) or not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in value):
+        raise HTTPError(400, f"Field '{key}' must be a list of product ids")
+    return [str(v) for v in value]
+
+
+def _products(payload, key, required=True):
+    """payload[key] as a list of product dicts, each with an 'id' (None if optional and absent)."""
+    value = _require(payload, key) if required else payload.get(key)
+    if value is None and not required:
+        return None
+    if not isinstance(value, list) or not all(isinstance(p, dict) and "id" in p for p in value):
+        raise HTTPError(400, f"Field '{key}' must be a list of objects with an 'id'")
+    return value
+
+
+def _timestamp(obs, key):
+    value = obs.get(key)
+    try:
+        to_ts(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Field '{key}' must be an ISO date/time")
+    return value
+
+
+# -------------------------------------------------
+# Handlers
+# -------------------------------------------------
+async def health(payload):
+    agent = get_agent()
+    return {"status": "ok", "emb_method": agent.emb_method, "index_loaded": agent.index is not None,
+            "circuits": breaker_states()}
+
+
+async def retrieve(payload):
+    query = _require(payload, "query")
+    k = _number(payload, "k", 8, minimum=1)
+    products, sims = await get_agent().aretrieve(query, k=k, context=_mapping(payload, "context"))
+    return {"products": products, "scores": sims}
+
+
+async def similar(payload):
+    product_ids = _product_ids(payload, "product_ids")
+    k = _number(payload, "k", 6, minimum=1)
+    if payload.get("per_item"):
+        return {"neighbours": await asyncio.to_thread(get_agent().similar_items_batch, product_ids, k)}
+    products, sims = await asyncio.to_thread(get_agent().similar_items, product_ids, k)
+    return {"products": products, "scores": sims}
+
+
+async def lookbook(payload):
+    agent = get_agent()
+    query = _require(payload, "query")
+    products = _products(payload, "products", required=False)
+    if products is None:
+        products, _ = await agent.aretrieve(query, k=_number(payload, "k", 8, minimum=1))
+    return await agent.agenerate_lookbook(
+        query,
+        products,
+        payload.get("history", []),
+        raw_input=payload.get("raw_input", query),
+        skin_analysis_result=payload.get("skin_profile")
+    )
+
+
+async def chat(payload):
+    with metrics.trace() as spans:
+        result = await get_agent().arun_chat(
+            _require(payload, "context_query"),
+            payload.get("message", payload["context_query"]),
+            payload.get("history", []),
+            image_base64=payload.get("image_base64"),
+            skin_profile=payload.get("skin_profile"),
+            k=_number(payload, "k", 15, minimum=1),
+            weather_condition=payload.get("weather_condition", "Sunny"),
+            context=_mapping(payload, "context"),
+            budget_s=_number(payload, "budget_s", None, cast=float, minimum=0)
+        )
+    if payload.get("trace"):
+        result["trace"] = spans
+    return result
+
+
+async def recommendations(payload):
+    items = _products(payload, "purchased_items")
+    top_n = _number(payload, "top_n", 3, minimum=1)
+    recs = await asyncio.to_thread(get_agent().post_purchase_recommendations, items, top_n)
+    return {"recommendations": recs}
+
+
+async def price_refund(payload):
+    orders = _require(payload, "orders")
+    price_store = get_price_store() if payload.get("use_history", True) else None
+    refund, details = await asyncio.to_thread(PriceLockService.calculate_protection_refund, orders, price_store)
+    return {"refund": refund, "details": details, "orders": orders}
+
+
+async def price_record(payload):
+    observations = [(_require(o, "product_id"), _number(o, "price", _require(o, "price"), cast=float, minimum=0),
+                     _timestamp(o, "ts"))
+                    for o in _require(payload, "observations")]
+    await asyncio.to_thread(get_price_store().append_many, observations)
+    return {"recorded": len(observations)}
+
+
+def _watch(payload, cart=None, orders=None, weather_context=None):
+    """
+    With a "session_id", hands the session's cart/orders (and weather) to
+    the background recovery monitor and returns the alerts it has raised
+    for that session since the last call; None without one. The monitor
+    works on copies: an alert's "update" (a stock hold, a shipping
+    upgrade) is for the client to apply to its own cart or order.
+    """
+    session_id = payload.get("session_id")
+    if session_id is None:
+        return None
+    session_id = str(session_id)
+    if not session_id or ":" in session_id:
+        raise HTTPError(400, "session_id must be a non-empty string without ':'")
+    monitor = get_recovery_monitor()
+    if weather_context:
+        monitor.publish_weather(weather_context)
+    if cart is not None:
+        monitor.upsert_cart(session_id, cart)
+    for i, order in enumerate(orders or []):
+        monitor.upsert_order(f"{session_id}:{order.get('order_id', i)}", order)
+    return monitor.pop_alerts(session_id)
+
+
+def _with_background(result, background):
+    if background is not None:
+        result["background_alerts"] = background
+    return result
+
+
+async def recovery_shipping(payload):
+    orders = _require(payload, "orders")
+    alerts = await asyncio.to_thread(SilentRecoveryService.monitor_shipping_delays, orders)
+    background = await asyncio.to_thread(_watch, payload, orders=orders)
+    return _with_background({"alerts": alerts, "orders": orders}, background)
+
+
+async def recovery_weather(payload):
+    cart = _require(payload, "cart")
+    weather_context = payload.get("weather_context") or await asyncio.to_thread(WeatherService.get_context)
+    alerts = await asyncio.to_thread(SilentRecoveryService.monitor_weather_conflicts, cart, weather_context)
+    background = await asyncio.to_thread(_watch, payload, cart=cart, weather_context=weather_context)
+    return _with_background({"alerts": alerts}, background)
+
+
+async def recovery_stock(payload):
+    cart = _require(payload, "cart")
+    alerts = await asyncio.to_thread(SilentRecoveryService.monitor_stock_levels, cart)
+    background = await asyncio.to_thread(_watch, payload, cart=cart)
+    return _with_background({"alerts": alerts, "cart": cart}, background)
+
+
+ROUTES = {
+    ("GET", "/health"): health,
+    ("POST", "/retrieve"): retrieve,
+    ("POST", "/similar"): similar,
+    ("POST", "/lookbook"): lookbook,
+    ("POST", "/chat"): chat,
+    ("POST", "/recommendations"): recommendations,
+    ("POST", "/price/refund"): price_refund,
+    ("POST", "/price/record"): price_record,
+    ("POST", "/recovery/shipping"): recovery_shipping,
+    ("POST", "/recovery/weather"): recovery_weather,
+    ("POST", "/recovery/stock"): recovery_stock,
+}
+
+
+# -------------------------------------------------
+# ASGI plumbing
+# -------------------------------------------------
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(_jsonable(payload)).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_text(send, status, text, content_type=b"text/plain; version=0.0.4"):
+    body = text.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_bytes(send, status, body, content_type, cache_control=b"public, max-age=31536000, immutable"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode()),
+                    (b"cache-control", cache_control)]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+_image_urls = (None, frozenset())
+
+
+def _catalog_image_urls():
+    global _image_urls
+    catalog = get_catalog()
+    if _image_urls[0] is not catalog:
+        _image_urls = (catalog, frozenset(p["image_url"] for p in catalog.records.values() if p["image_url"]))
+    return _image_urls[1]
+
+
+async def thumbnail(send, query):
+    """GET /thumb?url=<catalog image url>&w=<width>: cached, resized JPEG. Only catalog images are proxied."""
+    url = query.get("url", [""])[0]
+    if url not in _catalog_image_urls():
+        return await _send_json(send, 404, {"error": "Unknown image"})
+    try:
+        width = int(query.get("w", ["640"])[0])
+    except ValueError:
+        return await _send_json(send, 400, {"error": "w must be an integer"})
+    body = await asyncio.to_thread(get_thumbnail_cache().read, url, width)
+    if body is None:
+        return await _send_json(send, 502, {"error": "Image unavailable"})
+    await _send_bytes(send, 200, body, b"image/jpeg")
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await asyncio.to_thread(warm_up)
+                await asyncio.to_thread(get_recovery_monitor().start)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(get_recovery_monitor().stop)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "GET" and scope["path"] == "/metrics":
+        query = parse_qs(scope.get("query_string", b"").decode())
+        if query.get("format", [""])[0] == "json":
+            return await _send_json(send, 200, metrics.REGISTRY.snapshot())
+        return await _send_text(send, 200, metrics.REGISTRY.to_prometheus())
+    if scope["method"] == "GET" and scope["path"] == "/thumb":
+        return await thumbnail(send, parse_qs(scope.get("query_string", b"").decode()))
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        known_path = any(path == scope["path"] for _, path in ROUTES)
+        return await _send_json(send, 405 if known_path else 404, {"error": "Not found"})
+
+    try:
+        raw = await _read_body(receive)
+        payload = json.loads(raw) if raw else {}
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        result = await handler(payload)
+    except HTTPError as e:
+        return await _send_json(send, e.status, {"error": e.message})
+    except json.JSONDecodeError as e:
+        return await _send_json(send, 400, {"error": f"Invalid JSON: {e}"})
+    except Exception:
+        logger.exception("Server error on %s", scope["path"])
+        return await _send_json(send, 500, {"error": "Internal server error"})
+
+    await _send_json(send, 200, result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,100 @@
+# singleflight.py
+"""
+Request coalescing for external calls.
+
+When several sessions ask for the same thing at the same moment (the
+rating of a product on screen, the embedding of a popular query, the
+weather), only the first caller goes upstream. Identical callers that
+arrive while that call is in flight wait for it and share its result or
+exception. Nothing is cached after the call completes; this only
+collapses concurrent duplicates.
+
+Coalesce the raw upstream call, not a wrapper that substitutes a
+fallback: waiters should compute their own fallback from a shared
+exception. Exceptions listed in `retry_on` are the leader's own problem
+(e.g. resilience.BudgetExhausted: its request ran out of time); waiters
+that see one make the call themselves instead.
+
+Every call is counted in vestra_singleflight_calls_total{op, role}, where
+role is "leader" (made the call) or "shared" (deduplicated).
+"""
+import functools
+import threading
+
+from metrics import REGISTRY
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, op, registry=None):
+        self.op = op
+        self.registry = registry or REGISTRY
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, clone=None, retry_on=None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) unless a call for `key` is already in
+        flight, in which case waits for and returns that call's result.
+        `clone` copies the result for waiters that must not share a
+        mutable object with the leader; a waiter whose leader raised one
+        of `retry_on` tries again rather than sharing that exception.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            self.registry.inc("vestra_singleflight_calls_total",
+                              {"op": self.op, "role": "leader" if leader else "shared"})
+            if leader:
+                break
+
+            call.done.wait()
+            if call.error is None:
+                return clone(call.result) if clone else call.result
+            if not (retry_on and isinstance(call.error, retry_on)):
+                raise call.error
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+def single_flight(op, key=None, clone=None, retry_on=None):
+    """
+    Decorator form: coalesces concurrent calls whose `key(*args, **kwargs)`
+    matches (default: the positional and keyword arguments themselves).
+    """
+    def decorator(fn):
+        group = SingleFlight(op)
+        make_key = key or (lambda *args, **kwargs: (args, tuple(sorted(kwargs.items()))))
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return group.do(make_key(*args, **kwargs), fn, *args, clone=clone, retry_on=retry_on, **kwargs)
+
+        wrapper.single_flight = group
+        return wrapper
+
+    return decorator
@@ -0,0 +1,95 @@
+# startup_bench.py
+"""
+Cold-start import benchmark and regression guard.
+
+Imports each module in a fresh interpreter under `python -X importtime`,
+reports the median cumulative import time over --repeat runs plus the
+slowest transitive imports, and fails (exit 1) when a module exceeds its
+budget or drags in a heavy backend (faiss, torch, openai, ...) that must
+only be loaded on first use.
+
+    python startup_bench.py
+    python startup_bench.py --modules utils agent --repeat 5 --top 10
+"""
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY_MODULES = ("faiss", "openai", "torch", "sentence_transformers", "transformers", "pandas", "requests")
+
+# Module -> cumulative import budget in ms. Generous enough for a cold
+# disk cache; a heavy backend sneaking back in costs seconds, not tens of ms.
+BUDGETS_MS = {
+    "services": 150,
+    "utils": 300,
+    "agent": 400,
+    "resources": 400,
+    "server": 400,
+}
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+PROBE = (
+    "import sys, json, {module}; "
+    "print(json.dumps([m for m in {heavy!r} if m in sys.modules]))"
+)
+
+
+def measure(module):
+    """One cold import: (cumulative_ms, heavy modules loaded, [(cumulative_ms, name), ...])."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    total_ms, imports = None, []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        cumulative_ms, name = int(match.group(2)) / 1000, match.group(4)
+        imports.append((cumulative_ms, name))
+        if name == module and match.group(3) == " ":  # top level, not nested
+            total_ms = cumulative_ms
+    return total_ms, json.loads(proc.stdout.strip().splitlines()[-1]), imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", nargs="+", default=list(BUDGETS_MS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="Show the N slowest transitive imports per module")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every budget (e.g. slow CI boxes)")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        median_ms = statistics.median(r[0] for r in runs)
+        heavy = sorted(set().union(*(r[1] for r in runs)))
+        budget = BUDGETS_MS.get(module)
+        budget = budget * args.budget_scale if budget else None
+
+        status = "ok"
+        if heavy:
+            status = "HEAVY"
+            failures.append(f"{module} imports {', '.join(heavy)} at module load")
+        if budget and median_ms > budget:
+            status = "SLOW"
+            failures.append(f"{module} took {median_ms:.0f} ms (budget {budget:.0f} ms)")
+
+        print(f"{module:<12}{median_ms:>9.1f} ms  budget {budget or '-':>6}  {status}")
+        slowest = sorted((i for i in runs[0][2] if i[1] != module), reverse=True)[:args.top]
+        for cumulative_ms, name in slowest:
+            print(f"    {cumulative_ms:>9.1f} ms  {name}")
+
+    if failures:
+        print("\nStartup regression:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+import pytest
+
+from context_vectors import FacetVectorCache, compose_query_vector, facet_texts
+
+
+class Embedder:
+    """Deterministic fake embedder; `fallback` makes it report placeholder vectors."""
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        vectors = np.array([[len(t), sum(map(ord, t)) % 97, 1.0] for t in texts], dtype=np.float32)
+        return vectors, self.fallback
+
+
+def test_misses_are_embedded_once_in_one_batch():
+    embed = Embedder()
+    cache = FacetVectorCache(embed)
+
+    first = cache.get_many(["a", "bb"], transient=["query"])
+    second = cache.get_many(["bb", "a"])
+
+    assert embed.calls == [["query", "a", "bb"]]
+    np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-6)
+    np.testing.assert_array_equal(second[0], first[2])
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_transient_text_is_not_cached():
+    cache = FacetVectorCache(Embedder())
+    cache.get_many(["a"], transient=["free-form user text"])
+
+    assert list(cache._vectors) == ["a"]
+
+
+def test_fallback_vectors_are_used_but_not_cached():
+    embed = Embedder(fallback="circuit_open")
+    cache = FacetVectorCache(embed)
+
+    assert len(cache.get_many(["a", "b"])) == 2
+    assert not cache._vectors
+    embed.fallback = None
+    cache.get_many(["a", "b"])
+    assert len(embed.calls) == 2 and len(cache._vectors) == 2
+
+
+def test_lru_stays_bounded_and_concurrent_eviction_is_safe():
+    cache = FacetVectorCache(Embedder(), max_size=8)
+    errors = []
+
+    def worker(seed):
+        rng = np.random.default_rng(seed)
+        try:
+            for _ in range(200):
+                texts = [f"facet {i}" for i in rng.integers(0, 32, size=3)]
+                assert len(cache.get_many(texts)) == 3
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert len(cache._vectors) <= 8
+
+
+def test_facet_texts_are_canonical():
+    a = facet_texts({"trends": ["denim", "boho"], "region": "EU", "season": "Spring", "occasion": "wedding"})
+    b = facet_texts({"trends": ["boho", "denim"], "region": "EU", "season": "Spring", "occasion": "wedding"})
+
+    assert a == b and set(a) == {"trends", "occasion"}
+
+
+def test_compose_query_vector_weights_and_normalises():
+    x, y = np.array([1.0, 0.0]), np.array([0.0, 1.0])
+
+    v = compose_query_vector({"query": x, "skin": y, "unweighted": x}, {"query": 3.0, "skin": 4.0})
+
+    np.testing.assert_allclose(v, [0.6, 0.8], rtol=1e-6)
+    with pytest.raises(ValueError):
+        compose_query_vector({"other": x}, {"query": 1.0})
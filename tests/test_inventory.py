@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from inventory import StockLedger
+from services import SilentRecoveryService
+
+
+def make_ledger(stock, **kwargs):
+    ledger = StockLedger(":memory:", **kwargs)
+    for product_id, on_hand in stock.items():
+        ledger.set_stock(product_id, on_hand)
+    return ledger
+
+
+def test_monitor_stock_levels_holds_low_stock_items():
+    ledger = make_ledger({"1": 2})
+    cart = [{"id": "1", "title": "Tee"}]
+
+    alerts = SilentRecoveryService.monitor_stock_levels(cart, ledger, owner="s")
+
+    assert len(alerts) == 1
+    assert cart[0]["stock_reserved"] and cart[0]["reservation_id"]
+    assert ledger.available("1") == 1
+
+
+def test_monitor_stock_levels_leaves_well_stocked_items_alone():
+    ledger = make_ledger({"1": 100})
+    cart = [{"id": "1", "title": "Tee"}]
+
+    assert SilentRecoveryService.monitor_stock_levels(cart, ledger, owner="s") == []
+    assert "reservation_id" not in cart[0]
+    assert ledger.available("1") == 100
+
+
+def test_reserve_never_oversells_under_concurrency():
+    ledger = make_ledger({"1": 5})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        held = list(pool.map(lambda i: ledger.reserve("1", f"s{i}"), range(20)))
+
+    assert sum(h is not None for h in held) == 5
+    assert ledger.available("1") == 0
+
+
+def test_release_returns_stock_and_commit_consumes_it():
+    ledger = make_ledger({"1": 3})
+    kept, _ = ledger.reserve("1", "s")
+    dropped, _ = ledger.reserve("1", "s")
+
+    assert ledger.release(dropped)
+    assert ledger.commit(kept)
+    assert ledger.available("1") == 2
+    assert not ledger.release(kept)  # already sold
+
+
+def test_expire_releases_only_due_reservations():
+    ledger = make_ledger({"1": 3})
+    short, expires_at = ledger.reserve("1", "s", ttl=10)
+    long, _ = ledger.reserve("1", "s", ttl=1000)
+
+    assert ledger.expire(now=expires_at - 1) == 0
+    assert ledger.expire(now=expires_at + 1) == 1
+    assert ledger.available("1") == 2
+    assert not ledger.commit(short)
+    assert ledger.commit(long)
+
+
+def test_commit_many_is_all_or_nothing():
+    ledger = make_ledger({"1": 2, "2": 2})
+    first, _ = ledger.reserve("1", "s")
+    second, _ = ledger.reserve("2", "s")
+    ledger.release(second)
+
+    assert ledger.commit_many([first, second]) == [second]
+    assert ledger.available("1") == 1  # first is still only held, not sold
+
+    second, _ = ledger.reserve("2", "s")
+    assert ledger.commit_many([first, second]) == []
+    assert ledger.available("1") == 1 and ledger.available("2") == 1
+    assert not ledger.release(first)
+
+
+def test_on_change_reports_affected_products():
+    changed = []
+    ledger = make_ledger({"1": 2}, on_change=changed.append)
+    changed.clear()
+
+    reservation_id, _ = ledger.reserve("1", "s")
+    ledger.commit(reservation_id)
+
+    assert changed == ["1", "1"]
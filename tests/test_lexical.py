@@ -0,0 +1,72 @@
+import math
+
+import pytest
+
+from lexical import BM25Builder, BM25Index, KeywordIndex, reciprocal_rank_fusion, tokenize
+
+DOCS = [
+    "Red linen summer dress",
+    "Black leather boots for winter",
+    "Linen shirt, relaxed summer fit",
+    "Wool winter coat with leather buttons",
+    "Running shoes",
+]
+
+
+def brute_force_bm25(docs, query, k1=1.2, b=0.75):
+    tokenized = [tokenize(d) for d in docs]
+    avg_len = sum(map(len, tokenized)) / len(tokenized)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(term in doc for doc in tokenized)
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for row, doc in enumerate(tokenized):
+            tf = doc.count(term)
+            if tf:
+                norm = k1 * (1 - b + b * len(doc) / avg_len)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def test_tokenize_folds_plurals():
+    assert tokenize("Dresses, SHOES & accessories") == ["dress", "shoe", "accessory"]
+
+
+@pytest.mark.parametrize("query", ["linen summer", "leather winter boots", "shoes", "silk"])
+def test_search_matches_brute_force_bm25(query):
+    rows, scores = BM25Index.build(DOCS).search(query, k=len(DOCS))
+
+    expected = brute_force_bm25(DOCS, query)
+    assert sorted(rows) == sorted(expected)
+    for row, score in zip(rows, scores):
+        assert score == pytest.approx(expected[row], rel=1e-5)
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_chunked_build_and_save_load_match_a_one_shot_build(tmp_path):
+    builder = BM25Builder().add(DOCS[:2]).add(DOCS[2:])
+    path = str(tmp_path / "bm25.npz")
+    builder.build().save(path)
+
+    assert BM25Index.load(path).search("summer linen") == BM25Index.build(DOCS).search("summer linen")
+
+
+def test_keyword_index_matches_whole_tokens_and_phrases():
+    keywords = KeywordIndex(["gala", "black tie", "shoe"])
+
+    assert keywords.found("A black tie gala needs new shoes") == {"gala", "black tie", "shoe"}
+    assert not keywords.matches("galaxy print tie")
+
+
+def test_rrf_ranks_items_found_by_both_retrievers_first():
+    rows, scores = reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], limit=3)
+
+    assert set(rows[:2]) == {1, 3}
+    assert rows[2] in (2, 4)
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_rrf_applies_weights_and_skips_missing_rows():
+    rows, _ = reciprocal_rank_fusion([[1, -1], [2]], weights=[1.0, 3.0])
+
+    assert rows == [2, 1]
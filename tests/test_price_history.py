@@ -0,0 +1,47 @@
+import random
+from datetime import datetime, timedelta
+
+from price_history import PriceHistoryStore
+
+T0 = datetime(2026, 1, 1)
+
+
+def at(hours):
+    return T0 + timedelta(hours=hours)
+
+
+def test_min_price_since_matches_a_full_scan():
+    rng = random.Random(7)
+    store = PriceHistoryStore(":memory:")
+    prices = [round(rng.uniform(10, 100), 2) for _ in range(200)]
+    store.append_many([("1", p, at(h)) for h, p in enumerate(prices)])
+
+    for since in range(0, 200, 13):
+        assert store.min_price_since("1", at(since)) == min(prices[since:])
+    assert store.min_price_since("1", at(500)) is None
+
+
+def test_frontier_prices_increase_with_time():
+    store = PriceHistoryStore(":memory:")
+    store.append_many([("1", p, at(h)) for h, p in enumerate([50, 40, 45, 30, 35, 60])])
+
+    frontier = store._conn.execute("SELECT price FROM price_frontier WHERE product_id = '1' ORDER BY ts").fetchall()
+    assert [p for p, in frontier] == [30, 35, 60]
+
+
+def test_late_observations_are_appended_after_the_latest():
+    store = PriceHistoryStore(":memory:")
+    store.append("1", 20, at(5))
+    store.append("1", 10, at(1))  # arrives late: recorded just after the latest point
+
+    assert store.current_price("1") == 10
+    assert store.min_price_since("1", at(3)) == 10
+    assert [p for _, p in store.history("1")] == [20, 10]
+
+
+def test_products_are_independent():
+    store = PriceHistoryStore(":memory:")
+    store.append_many([("1", 5, at(0)), ("2", 50, at(1))])
+
+    assert store.min_price_since("2", at(0)) == 50
+    assert store.min_price_since("3", at(0)) is None
@@ -0,0 +1,67 @@
+from inventory import StockLedger
+from recovery_monitor import RecoveryMonitor
+
+
+def make_monitor(stock):
+    ledger = StockLedger(":memory:")
+    for product_id, on_hand in stock.items():
+        ledger.set_stock(product_id, on_hand)
+    monitor = RecoveryMonitor(ledger=ledger, idle_ttl=None)
+    ledger.on_change = monitor.publish_stock_event
+    return monitor, ledger
+
+
+def test_checks_never_touch_the_callers_cart():
+    monitor, ledger = make_monitor({"1": 2})
+    cart = [{"id": "1", "title": "Tee"}]
+
+    monitor.upsert_cart("s", cart)
+    monitor.run_once()
+
+    assert cart == [{"id": "1", "title": "Tee"}]
+    assert ledger.available("1") == 1
+
+
+def test_owner_applies_the_hold_carried_by_the_alert():
+    monitor, ledger = make_monitor({"1": 2})
+    cart = [{"id": "1", "title": "Tee"}]
+    monitor.upsert_cart("s", cart)
+    monitor.run_once()
+
+    alerts = monitor.pop_alerts("s")
+    monitor.apply_updates(alerts, cart)
+
+    assert [a["kind"] for a in alerts] == ["stock"]
+    assert cart[0]["stock_reserved"] and ledger.commit(cart[0]["reservation_id"])
+
+
+def test_holds_nobody_claims_are_released():
+    monitor, ledger = make_monitor({"1": 2})
+    monitor.upsert_cart("s", [{"id": "1", "title": "Tee"}])
+    monitor.run_once()
+
+    monitor.apply_updates(monitor.pop_alerts("s"), cart=[])  # checked out meanwhile
+
+    assert ledger.available("1") == 2
+
+
+def test_removing_a_cart_releases_its_undelivered_holds():
+    monitor, ledger = make_monitor({"1": 2})
+    monitor.upsert_cart("s", [{"id": "1", "title": "Tee"}])
+    monitor.run_once()
+
+    monitor.remove_cart("s")
+
+    assert ledger.available("1") == 2
+    assert monitor.pop_alerts("s") == []
+
+
+def test_a_held_item_is_not_held_again():
+    monitor, ledger = make_monitor({"1": 3})
+    monitor.upsert_cart("s", [{"id": "1", "title": "Tee"}])
+    monitor.run_once()
+    monitor.publish_stock_event("1")
+    monitor.run_once()
+
+    assert ledger.available("1") == 2
+    assert len(monitor.pop_alerts("s")) == 1
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from metrics import MetricsRegistry
+from resilience import CircuitBreaker, CircuitOpen, BudgetExhausted, deadline, remaining, timeout_for, \
+    CLOSED, OPEN, HALF_OPEN
+
+
+def breaker(**kwargs):
+    settings = dict(min_calls=4, error_rate=0.5, cooldown_s=60.0, registry=MetricsRegistry())
+    settings.update(kwargs)
+    return CircuitBreaker("test", **settings)
+
+
+def fail_once(b):
+    with pytest.raises(RuntimeError):
+        with b.call():
+            raise RuntimeError("upstream error")
+
+
+def test_circuit_opens_once_the_error_rate_is_reached():
+    b = breaker()
+    for _ in range(2):
+        with b.call():
+            pass
+    fail_once(b)
+    assert b.state == CLOSED  # 1 of 3 calls, below min_calls
+    fail_once(b)
+
+    assert b.state == OPEN
+    with pytest.raises(CircuitOpen):
+        with b.call():
+            pytest.fail("an open circuit must not run the call")
+
+
+def test_failed_status_counts_as_a_failure():
+    b = breaker()
+    for _ in range(4):
+        with b.call() as call:
+            call.fail()
+    assert b.state == OPEN
+
+
+def test_slow_calls_open_the_circuit():
+    b = breaker(slow_ms=1, slow_rate=0.5, error_rate=1.0)
+    for _ in range(2):
+        with b.call():
+            pass
+    for _ in range(2):
+        with b.call():
+            time.sleep(0.005)
+    assert b.state == OPEN
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    b = breaker(cooldown_s=0.05)
+    for _ in range(4):
+        fail_once(b)
+    assert b.state == OPEN
+    time.sleep(0.06)
+
+    assert b.state == HALF_OPEN
+    with b.call():
+        assert not b.allow()  # only the probe is let through
+    assert b.state == CLOSED
+
+
+def test_failed_probe_reopens_the_circuit():
+    b = breaker(cooldown_s=0.05)
+    for _ in range(4):
+        fail_once(b)
+    time.sleep(0.06)
+
+    fail_once(b)
+    assert b.state == OPEN
+
+
+def test_deadline_nests_to_the_sooner_end():
+    assert remaining() is None and timeout_for(5) == 5
+    with deadline(10):
+        with deadline(60):
+            assert remaining() <= 10
+        with deadline(0.5):
+            assert timeout_for(5) <= 0.5
+            assert timeout_for(None) <= 0.5
+    assert remaining() is None
+
+
+def test_spent_budget_skips_the_call_without_counting_a_failure():
+    b = breaker(min_calls=1)
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(BudgetExhausted):
+            with b.call(timeout=5):
+                pytest.fail("no call should be made on a spent budget")
+    assert b.snapshot() == {"state": CLOSED, "calls": 0, "failures": 0}
+
+
+def test_running_out_a_budget_cut_timeout_is_budget_exhausted():
+    b = breaker(min_calls=1)
+    with deadline(0.1):
+        with pytest.raises(BudgetExhausted):
+            with b.call(timeout=5) as call:
+                assert call.timeout <= 0.1
+                time.sleep(call.timeout)
+                raise TimeoutError("client timeout")
+    assert b.state == CLOSED and b.snapshot()["failures"] == 0
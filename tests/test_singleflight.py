@@ -0,0 +1,102 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from metrics import MetricsRegistry
+from singleflight import SingleFlight
+
+
+def calls(registry, role):
+    return sum(c["value"] for c in registry.snapshot()["counters"]
+               if c["name"] == "vestra_singleflight_calls_total" and c["labels"] == {"op": "test", "role": role})
+
+
+def wait_until(predicate, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.001)
+
+
+def run_coalesced(group, registry, fn, waiters=4, **kwargs):
+    """Starts a leader blocked on `release`, then `waiters` identical calls; returns their futures."""
+    release = threading.Event()
+
+    def blocked():
+        release.wait(5)
+        return fn()
+
+    pool = ThreadPoolExecutor(max_workers=waiters + 1)
+    futures = [pool.submit(group.do, "k", blocked, **kwargs)]
+    wait_until(lambda: group.in_flight() == 1)
+    futures += [pool.submit(group.do, "k", blocked, **kwargs) for _ in range(waiters)]
+    wait_until(lambda: calls(registry, "shared") == waiters)
+    release.set()
+    pool.shutdown(wait=True)
+    return futures
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    registry = MetricsRegistry()
+    group = SingleFlight("test", registry=registry)
+    upstream = []
+
+    futures = run_coalesced(group, registry, lambda: upstream.append(1) or "result")
+
+    assert [f.result() for f in futures] == ["result"] * 5
+    assert len(upstream) == 1
+    assert calls(registry, "leader") == 1
+    assert group.in_flight() == 0
+
+
+def test_waiters_share_the_leaders_exception():
+    registry = MetricsRegistry()
+    group = SingleFlight("test", registry=registry)
+
+    def fail():
+        raise ValueError("upstream down")
+
+    for future in run_coalesced(group, registry, fail):
+        with pytest.raises(ValueError):
+            future.result()
+
+
+def test_waiters_retry_exceptions_listed_in_retry_on():
+    registry = MetricsRegistry()
+    group = SingleFlight("test", registry=registry)
+    attempts = []
+
+    def leader_times_out():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise TimeoutError("leader's budget ran out")
+        return "fresh"
+
+    futures = run_coalesced(group, registry, leader_times_out, retry_on=TimeoutError)
+
+    with pytest.raises(TimeoutError):
+        futures[0].result()
+    assert [f.result() for f in futures[1:]] == ["fresh"] * 4
+
+
+def test_clone_gives_waiters_their_own_copy():
+    registry = MetricsRegistry()
+    group = SingleFlight("test", registry=registry)
+
+    futures = run_coalesced(group, registry, lambda: [1, 2], clone=list)
+
+    results = [f.result() for f in futures]
+    assert all(r == [1, 2] for r in results)
+    assert len({id(r) for r in results}) == len(results)
+
+
+def test_calls_complete_before_the_next_are_not_coalesced():
+    group = SingleFlight("test", registry=MetricsRegistry())
+    upstream = []
+
+    group.do("k", upstream.append, 1)
+    group.do("k", upstream.append, 2)
+
+    assert upstream == [1, 2]
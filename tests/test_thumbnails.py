@@ -0,0 +1,95 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from thumbnails import ThumbnailCache
+
+pytest.importorskip("PIL")
+
+
+def jpeg(seed, size=(900, 600)):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.effect_noise(size, 40 + seed).convert("RGB").save(buf, "JPEG")
+    return buf.getvalue()
+
+
+class OfflineCache(ThumbnailCache):
+    """Serves 'downloads' from a dict of url -> image bytes and counts them."""
+
+    def __init__(self, root, images, **kwargs):
+        super().__init__(root=str(root), **kwargs)
+        self.images = images
+        self.downloads = []
+
+    def _download(self, url):
+        self.downloads.append(url)
+        return self.images[url]
+
+
+def bytes_on_disk(cache):
+    rows = cache._conn.execute("SELECT name, bytes FROM thumbs").fetchall()
+    for name, size in rows:
+        assert os.path.getsize(cache._path(name)) == size
+    return sum(size for _, size in rows)
+
+
+def test_each_source_is_downloaded_once(tmp_path):
+    cache = OfflineCache(tmp_path, {"https://img/1": jpeg(1)})
+
+    first = cache.get("https://img/1", 320)
+    assert cache.get("https://img/1", 320) == first
+    assert cache.get("https://img/1", 640) is not None
+    assert cache.downloads == ["https://img/1"]
+    assert cache.stats()["bytes"] == bytes_on_disk(cache)
+
+
+def test_identical_images_share_thumbnails(tmp_path):
+    data = jpeg(2)
+    cache = OfflineCache(tmp_path, {"https://a/x": data, "https://b/y": data})
+
+    assert cache.get("https://a/x") == cache.get("https://b/y")
+    assert cache.stats()["thumbnails"] == len(cache.widths)
+
+
+def test_concurrent_stores_of_one_image_count_its_bytes_once(tmp_path):
+    data = jpeg(3)
+    urls = [f"https://mirror{i}/3.jpg" for i in range(8)]
+    cache = OfflineCache(tmp_path, dict.fromkeys(urls, data))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paths = set(pool.map(cache.get, urls))
+
+    assert len(paths) == 1
+    assert cache.stats()["bytes"] == bytes_on_disk(cache)
+
+
+def test_eviction_keeps_the_cache_within_max_bytes(tmp_path):
+    images = {f"https://img/{i}": jpeg(i) for i in range(6)}
+    probe = OfflineCache(tmp_path / "probe", images)
+    probe.get("https://img/0")
+    per_source = probe.stats()["bytes"]
+
+    cache = OfflineCache(tmp_path / "cache", images, max_bytes=int(per_source * 2.5))
+    for url in images:
+        assert cache.get(url) is not None
+
+    stats = cache.stats()
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["bytes"] == bytes_on_disk(cache)
+    assert len(os.listdir(cache.root)) > 1
+
+    # The least recently used source was evicted and is fetched again on demand.
+    cache.downloads.clear()
+    assert cache.read("https://img/0")
+    assert cache.downloads == ["https://img/0"]
+
+
+def test_read_refetches_a_file_removed_behind_its_back(tmp_path):
+    cache = OfflineCache(tmp_path, {"https://img/7": jpeg(7)})
+    os.remove(cache.get("https://img/7"))
+
+    assert cache.read("https://img/7").startswith(b"\xff\xd8")
+    assert cache.stats()["bytes"] == bytes_on_disk(cache)
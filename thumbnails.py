@@ -0,0 +1,238 @@
+# thumbnails.py
+"""
+Local thumbnail cache for product images.
+
+Each source image is downloaded once, decoded with Pillow and written as
+one JPEG per configured width. Files are content-addressed: they are
+named by the SHA-256 of the source bytes, so identical photos behind
+different URLs share their thumbnails. A small SQLite index maps
+url -> content hash and tracks each file's size and last access. When
+the cache grows past `max_bytes`, the least recently used thumbnails are
+evicted.
+
+The product grid shows the local file instead of the full-resolution
+original, so repeat views cost no network at all. server.py exposes the
+same files at GET /thumb.
+
+    python thumbnails.py --prefetch          # warm the cache for the whole catalog
+"""
+import io
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Grid cards are ~1/3 of the page; 2x covers high-DPI screens
+THUMB_WIDTHS = (320, 640)
+DEFAULT_WIDTH = 640
+MAX_SOURCE_BYTES = 25 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    url TEXT PRIMARY KEY,
+    sha TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS thumbs (
+    name TEXT PRIMARY KEY,
+    sha TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_thumbs_access ON thumbs (last_access);
+"""
+
+
+def thumb_name(sha, width):
+    return f"{sha}_{width}.jpg"
+
+
+def make_thumbnails(data, widths=THUMB_WIDTHS, quality=82):
+    """{width: JPEG bytes}, aspect ratio kept, never upscaled."""
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        out = {}
+        for width in sorted(widths, reverse=True):
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+            out[width] = buf.getvalue()
+        return out
+
+
+class ThumbnailCache:
+    def __init__(self, root="thumb_cache", max_bytes=512 * 1024 * 1024, widths=THUMB_WIDTHS, timeout=10):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.widths = tuple(widths)
+        self.timeout = timeout
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM thumbs").fetchone()[0]
+        self._session = None
+
+    def _path(self, name):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.root, name[:2], name)
+
+    def _lookup(self, url, width):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT t.name FROM sources s JOIN thumbs t ON t.sha = s.sha AND t.name = s.sha || ? "
+                "WHERE s.url = ?", (f"_{width}.jpg", url)).fetchone()
+            if row is None:
+                return None
+            path = self._path(row[0])
+            if not os.path.exists(path):
+                self._forget(row[0])
+                return None
+            self._conn.execute("UPDATE thumbs SET last_access = ? WHERE name = ?", (time.time(), row[0]))
+            self._conn.commit()
+            return path
+
+    def get(self, url, width=DEFAULT_WIDTH):
+        """Local path of `url`'s thumbnail at `width`, fetching and resizing on first use; None if unavailable."""
+        if not url or not url.startswith(("http://", "https://")):
+            return None
+        width = min(self.widths, key=lambda w: abs(w - width))
+        path = self._lookup(url, width)
+        if path:
+            metrics.REGISTRY.inc("vestra_thumbnail_requests_total", {"result": "hit"})
+            return path
+        metrics.REGISTRY.inc("vestra_thumbnail_requests_total", {"result": "miss"})
+
+        # One download per URL even when many sessions ask at once
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        try:
+            with url_lock:
+                path = self._lookup(url, width)
+                if path is None:
+                    with metrics.timed("thumbnails.fetch"):
+                        self._store(url, self._download(url))
+                    path = self._lookup(url, width)
+            return path
+        except Exception as e:
+            logger.warning("Thumbnail for %s unavailable: %s", url, e)
+            metrics.record_fallback("thumbnails.get", type(e).__name__)
+            return None
+        finally:
+            with self._lock:
+                self._url_locks.pop(url, None)
+
+    def read(self, url, width=DEFAULT_WIDTH):
+        for _ in range(2):
+            path = self.get(url, width)
+            if path is None:
+                return None
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                # Evicted by another thread between get() and open(); get() again re-fetches it
+                continue
+        return None
+
+    def _download(self, url):
+        import requests
+        if self._session is None:
+            self._session = requests.Session()
+        resp = self._session.get(url, timeout=self.timeout, stream=True)
+        resp.raise_for_status()
+        data = resp.raw.read(MAX_SOURCE_BYTES + 1, decode_content=True)
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ValueError(f"source image larger than {MAX_SOURCE_BYTES} bytes")
+        return data
+
+    def _store(self, url, data):
+        sha = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            have = {name for (name,) in self._conn.execute("SELECT name FROM thumbs WHERE sha = ?", (sha,))}
+        missing = [w for w in self.widths if thumb_name(sha, w) not in have]
+        thumbs = make_thumbnails(data, missing) if missing else {}
+
+        now = time.time()
+        with self._lock:
+            for width, jpeg in thumbs.items():
+                name = thumb_name(sha, width)
+                path = self._path(name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(jpeg)
+                os.replace(tmp, path)
+                self._forget(name)  # a replaced row's bytes must not be counted twice
+                self._conn.execute("INSERT OR REPLACE INTO thumbs VALUES (?, ?, ?, ?)", (name, sha, len(jpeg), now))
+                self._total += len(jpeg)
+            self._conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (url, sha))
+            self._conn.commit()
+            self._evict()
+
+    def _forget(self, name):
+        row = self._conn.execute("SELECT bytes FROM thumbs WHERE name = ?", (name,)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM thumbs WHERE name = ?", (name,))
+            self._total -= row[0]
+
+    def _evict(self):
+        """Drops least recently used thumbnails until the cache fits max_bytes (caller holds the lock)."""
+        if self._total <= self.max_bytes:
+            return
+        evicted = 0
+        for name, size in self._conn.execute("SELECT name, bytes FROM thumbs ORDER BY last_access").fetchall():
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM thumbs WHERE name = ?", (name,))
+            self._total -= size
+            evicted += 1
+        # Sources whose thumbnails are all gone are re-fetched on next use
+        self._conn.execute("DELETE FROM sources WHERE sha NOT IN (SELECT sha FROM thumbs)")
+        self._conn.commit()
+        metrics.REGISTRY.inc("vestra_thumbnail_evictions_total", amount=evicted)
+
+    def prefetch(self, urls, width=DEFAULT_WIDTH, max_workers=8):
+        """Warms the cache for many URLs concurrently; returns how many are now cached."""
+        urls = [u for u in dict.fromkeys(urls) if u]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return sum(1 for path in pool.map(lambda u: self.get(u, width), urls) if path)
+
+    def stats(self):
+        with self._lock:
+            files = self._conn.execute("SELECT COUNT(*) FROM thumbs").fetchone()[0]
+            sources = self._conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+        return {"sources": sources, "thumbnails": files, "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+if __name__ == "__main__":
+    from utils import get_catalog
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=os.getenv("VESTRA_THUMB_DIR", "thumb_cache"))
+    parser.add_argument("--prefetch", action="store_true", help="Fetch thumbnails for every catalog image")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    cache = ThumbnailCache(args.root)
+    if args.prefetch:
+        urls = [p["image_url"] for p in get_catalog().records.values()]
+        start = time.perf_counter()
+        cached = cache.prefetch(urls, max_workers=args.workers)
+        print(f"{cached}/{len(set(filter(None, urls)))} images cached in {time.perf_counter() - start:.1f}s")
+    print(cache.stats())
@@ -1,539 +1,571 @@
 import os
 import json
-import re
-import random
-import base64
+import hashlib
+import logging
+import sqlite3
+import time
+import threading
 import numpy as np
-import pandas as pd
-import faiss
-import openai
-import requests
-from datetime import datetime, timedelta
-from sentence_transformers import SentenceTransformer
+from metrics import timed, record_fallback
+from singleflight import single_flight
+from resilience import get_breaker, Unavailable, BudgetExhausted
+# Light services live in services.py; re-exported so `from utils import ...` keeps working.
+from services import (SilentRecoveryService, PriceLockService, TrendService, MaterialAnalyzer,  # noqa: F401
+                      CartOptimizer, ReplenishmentService, encode_image, GoogleReviewService, WeatherService,
+                      PolicyManager, SizeConverter, RewardSystem)
+
+# faiss, openai, pandas and sentence_transformers (torch) are imported on
+# first use inside the functions below, so importing utils stays cheap.
+
+logger = logging.getLogger(__name__)
 
 
 # -------------------------------------------------
-# Module 16: Silent Recovery Commerce™ (New)
+# Load products from CSV
 # -------------------------------------------------
-class SilentRecoveryService:
-    """
-    Implements Silent Recovery Commerce™.
-    USP: "Problems are fixed before you notice them."
-    Monitors: Delivery delays, Weather shifts, Stock issues.
-    """
-
-    @staticmethod
-    def monitor_shipping_delays(orders):
-        """
-        Scans active orders. If a delay is simulated/detected on Standard shipping,
-        automatically upgrade to Express/Hyper-Drone to meet the promise.
-        """
-        alerts = []
-        for order in orders:
-            # Only check active orders not already upgraded
-            if "shipping_upgraded" not in order and order.get("shipping_method") == "Standard":
-                # Simulate a logistics delay (e.g., 20% chance)
-                if random.random() > 0.8:
-                    order["shipping_method"] = "Hyper-Drone (Auto-Upgraded)"
-                    order["shipping_upgraded"] = True
-                    alerts.append(
-                        f"🛡️ Recovery: Order #{order['order_id']} faced a delay. We auto-upgraded shipping to Hyper-Drone (Free) to ensure on-time arrival.")
-        return alerts
+def load_products(csv_path="sample_data/products.csv", dtype=None):
+    import pandas as pd
+    if not os.path.exists(csv_path):
+        data = {
+            "id": [1, 2, 3, 4, 5, 6, 7, 8],
+            "title": ["Eco-Hemp Jacket", "Urban Glide Sneakers", "Midnight Gala Dress", "Smart Wool Blazer",
+                      "Boho Summer Tunic", "Basic Cotton Tee", "Silk Scarf", "Running Socks"],
+            "category": ["Men's Fashion", "Footwear", "Women's Fashion", "Men's Fashion", "Women's Fashion", "Unisex",
+                         "Accessories", "Accessories"],
+            "description": ["Sustainable hemp fiber jacket.", "High-tech running shoes.", "Elegant evening wear.",
+                            "Professional office attire (Wool).", "Lightweight summer vibe (Linen).",
+                            "100% Organic Cotton.", "Pure Silk.", "Moisture wicking synthetic."],
+            "price": [120.00, 85.00, 250.00, 180.00, 45.00, 25.00, 40.00, 12.00],
+            "image_url": ["", "", "", "", "", "", "", ""],
+            "attributes": ["Sustainable", "Sporty", "Formal", "Business", "Casual", "Basic", "Luxury", "Sport"]
+        }
+        return pd.DataFrame(data)
+    return pd.read_csv(csv_path, dtype=dtype)
 
-    @staticmethod
-    def monitor_weather_conflicts(cart, weather_context):
-        """
-        Checks if cart items are suitable for the current/forecasted weather.
-        """
-        alerts = []
-        condition = weather_context.get("condition", "Sunny")
-
-        for item in cart:
-            # Reuse MaterialAnalyzer to check suitability
-            analysis = MaterialAnalyzer.analyze(item.get("description", ""), condition)
-            # If there are warnings, trigger a silent recovery suggestion
-            if analysis["warnings"]:
-                alerts.append(
-                    f"🛡️ Adaptation: Weather shifted to {condition}. {item['title']} might be unsuitable. {analysis['warnings'][0]}")
-
-        return alerts
 
-    @staticmethod
-    def monitor_stock_levels(cart):
-        """
-        Simulates low stock for items in cart and auto-reserves them.
-        """
-        alerts = []
-        for item in cart:
-            # Simulate low stock event (10% chance)
-            if random.random() > 0.9 and not item.get("stock_reserved", False):
-                item["stock_reserved"] = True
-                alerts.append(
-                    f"🛡️ Stock Watch: High demand detected for {item['title']}. We have silently reserved it for you for 15 mins.")
-        return alerts
+PRODUCT_COLUMNS = ("id", "title", "category", "description", "price", "image_url", "attributes")
+REQUIRED_COLUMNS = ("id", "title", "category", "price")
 
 
-# -------------------------------------------------
-# Module 15: Intent-Locked Pricing Service
-# -------------------------------------------------
-class PriceLockService:
+def normalize_products(df, rejected=None):
     """
-    Manages Intent-Locked Pricing™.
-    1. Locks price on intent (Cart Add).
-    2. Simulates market fluctuations.
-    3. Calculates refunds if current price < locked price.
+    Validates and normalises one catalog chunk: ids as stripped strings,
+    text fields stripped with "" for missing values, prices as floats.
+    Rows without an id or title, or with a missing/negative price, are
+    dropped and counted by reason in `rejected` (a dict, if given).
     """
+    import pandas as pd
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Catalog is missing required columns: {', '.join(missing)}")
+
+    out = pd.DataFrame(index=df.index)
+    for col in PRODUCT_COLUMNS:
+        if col == "price":
+            out[col] = pd.to_numeric(df[col], errors="coerce")
+        elif col in df.columns:
+            out[col] = df[col].fillna("").astype(str).str.strip()
+        else:
+            out[col] = ""
 
-    @staticmethod
-    def get_market_price(original_price):
-        """
-        Simulates a live market price check.
-        """
-        # 30% chance that the market price has dropped significantly
-        if random.random() > 0.7:
-            # Drop price by 5% to 20%
-            discount_factor = random.uniform(0.80, 0.95)
-            return round(original_price * discount_factor, 2)
-
-        return original_price
+    checks = {
+        "missing_id": out["id"] == "",
+        "missing_title": out["title"] == "",
+        "bad_price": out["price"].isna() | (out["price"] < 0)
+    }
+    bad = pd.Series(False, index=df.index)
+    for reason, mask in checks.items():
+        mask = mask & ~bad  # count each rejected row once, under its first failing check
+        if rejected is not None and mask.any():
+            rejected[reason] = rejected.get(reason, 0) + int(mask.sum())
+        bad |= mask
+    return out[~bad].reset_index(drop=True)
 
-    @staticmethod
-    def calculate_protection_refund(orders):
-        """
-        Scans past orders to see if price dropped within X days.
-        Returns total refund amount.
-        """
-        total_refund = 0.0
-        refund_details = []
-
-        for order in orders:
-            # Check if order is within 30 days
-            if isinstance(order['date'], str):
-                order_date = datetime.strptime(order['date'], "%Y-%m-%d").date()
-            else:
-                order_date = order['date']
-
-            if (datetime.now().date() - order_date).days <= 30:
-                for item in order['items']:
-                    locked_price = item.get('locked_price', item['price'])
-                    current_market = PriceLockService.get_market_price(locked_price)
-
-                    if current_market < locked_price:
-                        diff = locked_price - current_market
-                        total_refund += diff
-                        refund_details.append(f"{item['title']}: Dropped to ${current_market}")
-
-        return round(total_refund, 2), refund_details
 
+def iter_products(csv_path="sample_data/products.csv", chunk_size=50_000, rejected=None):
+    """
+    Streams the catalog as validated DataFrame chunks of up to `chunk_size`
+    rows (see normalize_products), so memory stays bounded by the chunk
+    size rather than the catalog size. `csv_path` may also be a .parquet
+    file or a directory of Parquet parts (needs pyarrow).
+    """
+    import pandas as pd
+    if not os.path.exists(csv_path):
+        yield normalize_products(load_products(csv_path), rejected)
+        return
+    if os.path.isdir(csv_path) or csv_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parts = sorted(os.path.join(csv_path, f) for f in os.listdir(csv_path) if f.endswith(".parquet")) \
+            if os.path.isdir(csv_path) else [csv_path]
+        for part in parts:
+            for batch in pq.ParquetFile(part).iter_batches(batch_size=chunk_size):
+                yield normalize_products(batch.to_pandas(), rejected)
+        return
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        yield normalize_products(chunk, rejected)
+
+
+def _product_record(row):
+    return {
+        "id": str(row["id"]),
+        "title": row["title"],
+        "category": row["category"],
+        "description": row["description"],
+        "price": float(row["price"]),
+        "image_url": row.get("image_url", ""),
+        "attributes": row.get("attributes", "")
+    }
 
-# -------------------------------------------------
-# Module 12: Trend Forecasting Service
-# -------------------------------------------------
-class TrendService:
-    @staticmethod
-    def get_trends(location, season):
-        trends_db = {
-            "Summer": ["Linen", "Pastel", "Floral", "Oversized Tees", "Bucket Hats"],
-            "Winter": ["Puffer Jackets", "Cashmere", "Turtlenecks", "Layering", "Boots"],
-            "Spring": ["Denim", "Light Layers", "Trench Coats", "Sneakers"],
-            "Fall": ["Leather", "Earth Tones", "Knits", "Scarves"]
-        }
 
-        loc_trends = []
-        if location == "JP": loc_trends = ["Harajuku", "Minimalist"]
-        if location == "US": loc_trends = ["Streetwear", "Athleisure"]
-        if location == "EU": loc_trends = ["Chic", "Tailored"]
+class Catalog:
+    """
+    Read-only, in-memory view of the product CSV: the DataFrame plus an
+    id -> record map, so lookups are dict hits instead of CSV scans.
+    """
 
-        base_trends = trends_db.get(season, ["Casual"])
-        combined = list(set(base_trends + loc_trends))
-        return combined
+    def __init__(self, df):
+        self.df = df
+        self.records = {}
+        if "id" in df.columns:
+            for row in df.to_dict("records"):
+                self.records[str(row["id"])] = _product_record(row)
 
+    def get(self, product_id):
+        record = self.records.get(str(product_id))
+        # Callers annotate products (ratings, locked prices), so hand out copies.
+        return dict(record) if record else None
 
-# -------------------------------------------------
-# Module 13: Material & Fabric Analysis
-# -------------------------------------------------
-class MaterialAnalyzer:
-    FABRIC_RULES = {
-        "polyester": {"breathable": False, "warm": True, "weather": ["Cold", "Rainy", "Winter"]},
-        "cotton": {"breathable": True, "warm": False, "weather": ["Sunny", "Summer", "Spring"]},
-        "linen": {"breathable": True, "warm": False, "weather": ["Sunny", "Summer"]},
-        "wool": {"breathable": True, "warm": True, "weather": ["Winter", "Cold", "Fall"]},
-        "hemp": {"breathable": True, "warm": False, "weather": ["Sunny", "Summer"]}
-    }
 
-    @staticmethod
-    def analyze(description, current_weather_condition):
-        desc_lower = description.lower()
-        warnings = []
-        endorsements = []
+_catalog_cache = {}
+_catalog_lock = threading.Lock()
 
-        for fabric, props in MaterialAnalyzer.FABRIC_RULES.items():
-            if fabric in desc_lower:
-                if current_weather_condition in props["weather"]:
-                    endorsements.append(f"✅ {fabric.capitalize()} is great for {current_weather_condition} weather.")
-                else:
-                    if current_weather_condition in ["Sunny", "Summer"] and props["warm"]:
-                        warnings.append(f"⚠️ {fabric.capitalize()} might be too warm for current weather.")
-                    elif current_weather_condition in ["Winter", "Cold"] and not props["warm"]:
-                        warnings.append(f"⚠️ {fabric.capitalize()} might not be warm enough.")
 
-        return {"warnings": warnings, "endorsements": endorsements}
+def get_catalog(csv_path="sample_data/products.csv"):
+    """
+    Process-wide catalog shared by every session and request. Reloaded
+    only when the CSV's modification time changes.
+    """
+    version = os.path.getmtime(csv_path) if os.path.exists(csv_path) else None
+    cached = _catalog_cache.get(csv_path)
+    if cached and cached[0] == version:
+        return cached[1]
+    with _catalog_lock:
+        cached = _catalog_cache.get(csv_path)
+        if not cached or cached[0] != version:
+            cached = (version, Catalog(load_products(csv_path)))
+            _catalog_cache[csv_path] = cached
+    return cached[1]
+
+
+@timed("fetch_product_by_id")
+def fetch_product_by_id(product_id, csv_path="sample_data/products.csv"):
+    return get_catalog(csv_path).get(product_id)
 
 
-# -------------------------------------------------
-# Module 14: Cart Optimizer & Replenishment
-# -------------------------------------------------
-class CartOptimizer:
-    @staticmethod
-    def check_shipping_threshold(cart_total, threshold=50.0):
-        if cart_total < threshold:
-            return threshold - cart_total
-        return 0
+def create_metadata_db(products, db_path="products_meta.db", append=False):
+    """
+    Writes the catalog as products(id, json) rows, one product record per
+    id. With `append`, adds to an existing DB (for chunked builds).
+    """
+    if not append and os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS products (id TEXT PRIMARY KEY, json TEXT)")
+        conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?)",
+                         ((str(row["id"]), json.dumps(_product_record(row))) for row in products.to_dict("records")))
+        conn.commit()
+    finally:
+        conn.close()
 
 
-class ReplenishmentService:
-    @staticmethod
-    def predict_next_buy(purchase_history):
-        suggestions = []
-        today = datetime.now().date()
+def save_id_map(product_ids, path):
+    """Row -> product id map for an index built in catalog order."""
+    np.save(path, np.asarray([str(pid) for pid in product_ids]))
 
-        for order in purchase_history:
-            order_date = order.get("date")
-            if not order_date: continue
 
-            if isinstance(order_date, str):
-                try:
-                    order_date = datetime.strptime(order_date, "%Y-%m-%d").date()
-                except:
-                    continue
+def load_id_map(path):
+    return np.load(path).astype(str).tolist() if path and os.path.exists(path) else None
 
-            days_diff = (today - order_date).days
 
-            for item in order.get("items", []):
-                if any(x in item['title'].lower() for x in ['cream', 'lotion', 'shampoo', 'serum']):
-                    if 25 <= days_diff <= 35:
-                        suggestions.append(item)
-        return suggestions
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 # -------------------------------------------------
-# Module 11: Image Processing Utils
+# Embeddings & FAISS
 # -------------------------------------------------
-def encode_image(file_obj):
-    if file_obj is None:
-        return None
-    try:
-        file_obj.seek(0)
-        return base64.b64encode(file_obj.read()).decode('utf-8')
-    except Exception as e:
-        print(f"Image Encoding Error: {e}")
-        return None
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Seconds per embeddings request (further limited by a request's latency budget)
+OPENAI_EMBEDDING_TIMEOUT = 30
 
+_embedders = {}
+_embedder_lock = threading.Lock()
 
-# -------------------------------------------------
-# Module 10: External Review Aggregator (Google API)
-# -------------------------------------------------
-class GoogleReviewService:
-    API_KEY = os.getenv("GOOGLE_API_KEY")
-    CSE_ID = os.getenv("GOOGLE_CSE_ID")
+# CPU inference backends for the local model:
+#   torch    - stock fp32 PyTorch (reference)
+#   int8     - dynamically int8-quantized Linear layers
+#   onnx     - exported ONNX graph via ONNX Runtime (needs optimum + onnxruntime)
+#   openvino - exported OpenVINO graph (needs optimum-intel + openvino)
+LOCAL_BACKENDS = ("torch", "int8", "onnx", "openvino")
 
-    @staticmethod
-    def fetch_rating(product_title):
-        if not GoogleReviewService.API_KEY or not GoogleReviewService.CSE_ID:
-            return GoogleReviewService._simulate_rating(product_title)
 
-        try:
-            query = f"{product_title} product reviews rating"
-            url = "https://www.googleapis.com/customsearch/v1"
-            params = {
-                'q': query,
-                'key': GoogleReviewService.API_KEY,
-                'cx': GoogleReviewService.CSE_ID,
-                'num': 3
-            }
-
-            resp = requests.get(url, params=params, timeout=2)
-            if resp.status_code != 200:
-                return GoogleReviewService._simulate_rating(product_title)
-
-            data = resp.json()
-            total_score = 0
-            count = 0
-
-            for item in data.get("items", []):
-                snippet = item.get("snippet", "") + item.get("title", "")
-                match = re.search(r"(\d(\.\d)?)\s*(?:/|out of)\s*5", snippet)
-                if match:
-                    score = float(match.group(1))
-                    total_score += score
-                    count += 1
-
-            if count > 0:
-                avg_rating = round(total_score / count, 1)
-                return {"rating": avg_rating, "source": "Google Verified", "count": count}
-            else:
-                return GoogleReviewService._simulate_rating(product_title)
+def _load_local_embedder(model_name, backend):
+    if backend not in LOCAL_BACKENDS:
+        raise ValueError(f"Unknown local backend '{backend}', expected one of {LOCAL_BACKENDS}")
+    threads = os.getenv("VESTRA_LOCAL_THREADS")
+    if threads:
+        import torch
+        torch.set_num_threads(int(threads))
 
+    from sentence_transformers import SentenceTransformer
+
+    if backend in ("onnx", "openvino"):
+        try:
+            return SentenceTransformer(model_name, device="cpu", backend=backend)
         except Exception as e:
-            return GoogleReviewService._simulate_rating(product_title)
+            logger.warning("Local backend '%s' unavailable (%s), using torch.", backend, e)
+            record_fallback("get_local_embedder", f"{backend}_unavailable")
+            backend = "torch"
 
-    @staticmethod
-    def _simulate_rating(product_title):
-        seed = sum(ord(c) for c in product_title)
-        random.seed(seed)
-        rating = round(random.uniform(3.8, 5.0), 1)
-        count = random.randint(10, 500)
-        return {"rating": rating, "source": "Reviews", "count": count}
+    embedder = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        import torch
+        embedder = torch.quantization.quantize_dynamic(embedder, {torch.nn.Linear}, dtype=torch.qint8)
+    return embedder.eval()
 
 
-# -------------------------------------------------
-# Module 9: Weather & Location Service
-# -------------------------------------------------
-class WeatherService:
-    @staticmethod
-    def get_context():
-        try:
-            location_response = requests.get("https://ipinfo.io/json", timeout=3)
-            if location_response.status_code == 200:
-                location_data = location_response.json()
-                loc_str = location_data.get("loc", "0,0")
-                if "," in loc_str:
-                    lat, lon = loc_str.split(",")
-                else:
-                    lat, lon = "0", "0"
-
-                city = location_data.get("city", "Unknown City")
-                country = location_data.get("country", "US")
-            else:
-                raise Exception("Location API unavailable")
-
-            weather_response = requests.get(
-                f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&timezone=auto",
-                timeout=3
-            )
-
-            if weather_response.status_code == 200:
-                weather_data = weather_response.json()
-                current = weather_data.get("current_weather", {})
-                temp = current.get("temperature", 20)
-                weathercode = current.get("weathercode", 0)
-
-                season = WeatherService._infer_season(temp)
-                condition = WeatherService._infer_condition_text(weathercode)
-
-                return {
-                    "city": city,
-                    "country": country,
-                    "temp": temp,
-                    "season": season,
-                    "condition": condition,
-                    "success": True
-                }
-            else:
-                raise Exception("Weather API unavailable")
+def get_local_embedder(model_name=LOCAL_EMBEDDING_MODEL, backend=None):
+    """
+    Loads the SentenceTransformer once per (model, backend) per process;
+    encode() is safe to share across threads. `backend` defaults to
+    $VESTRA_LOCAL_BACKEND (else torch); $VESTRA_LOCAL_THREADS sets the
+    intra-op thread count.
+    """
+    backend = backend or os.getenv("VESTRA_LOCAL_BACKEND", "torch")
+    key = (model_name, backend)
+    embedder = _embedders.get(key)
+    if embedder is None:
+        with _embedder_lock:
+            embedder = _embedders.get(key)
+            if embedder is None:
+                embedder = _embedders[key] = _load_local_embedder(model_name, backend)
+    return embedder
 
-        except Exception as e:
-            return WeatherService._get_fallback_context()
 
-    @staticmethod
-    def _infer_season(temp):
-        if temp > 25:
-            return "Summer"
-        elif temp > 18:
-            return "Spring"
-        elif temp > 10:
-            return "Fall"
-        else:
-            return "Winter"
+@single_flight("get_embeddings.openai", key=lambda texts, dimensions=None: (tuple(texts), dimensions),
+               clone=np.copy, retry_on=BudgetExhausted)
+def _openai_embeddings(texts, dimensions=None):
+    """One embeddings request through the "openai" breaker; raises instead of falling back."""
+    with get_breaker("openai").call(timeout=OPENAI_EMBEDDING_TIMEOUT) as call:
+        return _request_openai_embeddings(texts, dimensions, call.timeout)
 
-    @staticmethod
-    def _infer_condition_text(code):
-        if code > 60:
-            return "Rainy"
-        elif code > 40:
-            return "Cloudy"
-        return "Sunny"
 
-    @staticmethod
-    def _get_fallback_context():
-        return {
-            "city": "Local Area",
-            "country": "US",
-            "temp": 20,
-            "season": "Spring",
-            "condition": "Sunny",
-            "success": False
-        }
+def _request_openai_embeddings(texts, dimensions, timeout):
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    params = {"dimensions": dimensions} if dimensions else {}
+    resp = openai.Embedding.create(model=OPENAI_EMBEDDING_MODEL, input=texts, request_timeout=timeout, **params)
+    return np.array([r["embedding"] for r in resp["data"]], dtype=np.float32)
 
 
-# -------------------------------------------------
-# Module 8: Shipping & Return Policy Logic
-# -------------------------------------------------
-class PolicyManager:
-    SHIPPING_OPTIONS = {
-        "Standard": {"cost": 0, "days": "5-7 Business Days", "threshold": 50},
-        "Express": {"cost": 15.00, "days": "2-3 Business Days", "threshold": 100},
-        "Hyper-Drone": {"cost": 25.00, "days": "1 Business Day", "threshold": 200}
-    }
+@single_flight("get_embeddings.local", key=lambda texts: tuple(texts), clone=np.copy)
+def _local_embeddings(texts):
+    return get_local_embedder(LOCAL_EMBEDDING_MODEL).encode(texts, show_progress_bar=False, convert_to_numpy=True)
 
-    @staticmethod
-    def get_shipping_cost(method):
-        return PolicyManager.SHIPPING_OPTIONS.get(method, {}).get("cost", 0)
 
-    @staticmethod
-    def get_free_shipping_threshold(method):
-        return PolicyManager.SHIPPING_OPTIONS.get(method, {}).get("threshold", 999)
+@timed("get_embeddings")
+def get_embeddings(texts, model="openai", dimensions=None, strict=False, with_fallback=False):
+    """
+    `dimensions` asks text-embedding-3-small for shortened vectors (the
+    API truncates and renormalises); it must match what the index was
+    built with. Ignored by the local model.
+
+    Concurrent identical requests share one upstream call; fallbacks
+    (random vectors) are decided per caller, so one request running out
+    of budget never hands its fallback to another. With `strict` (index
+    builds) there is no fallback: the OpenAI call bypasses the circuit
+    breaker and any failure raises, so a build never indexes random vectors.
+    With `with_fallback` the result is `(embeddings, reason)`, `reason`
+    being the fallback used or None, so callers that keep vectors (the
+    facet cache) can skip storing random ones.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if strict:
+        if model == "local":
+            return np.ascontiguousarray(_local_embeddings(texts), dtype=np.float32)
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY must be set to build OpenAI embeddings")
+        return np.ascontiguousarray(_request_openai_embeddings(texts, dimensions, OPENAI_EMBEDDING_TIMEOUT))
+
+    reason = None
+    if model == "openai" and api_key:
+        try:
+            embs = _openai_embeddings(texts, dimensions)
+        except Unavailable as e:
+            reason = e.reason
+            embs = [np.random.rand(dimensions or 1536) for _ in texts]
+        except Exception as e:
+            logger.warning("OpenAI Error: %s, falling back.", e)
+            reason = "openai_error"
+            embs = [np.random.rand(dimensions or 1536) for _ in texts]
+    elif model == "local":
+        try:
+            embs = _local_embeddings(texts)
+        except ImportError:
+            reason = "local_unavailable"
+            embs = [np.random.rand(384) for _ in texts]
+    else:
+        reason = "no_api_key"
+        embs = [np.random.rand(dimensions or 1536) for _ in texts]
+    if reason is not None:
+        record_fallback("get_embeddings", reason)
 
-    @staticmethod
-    def check_return_eligibility(purchase_date):
-        if not purchase_date:
-            return False, "Date not found."
+    embs = np.ascontiguousarray(np.array(embs, dtype=np.float32))
+    return (embs, reason) if with_fallback else embs
 
-        if isinstance(purchase_date, str):
-            try:
-                purchase_date = datetime.strptime(purchase_date, "%Y-%m-%d").date()
-            except:
-                pass
 
-        today = datetime.now().date()
-        if isinstance(purchase_date, datetime):
-            purchase_date = purchase_date.date()
+def get_index_vectors(index):
+    """
+    Reads the stored product vectors back out of a FAISS index, row i
+    being the i-th product the index was built from. Exact for flat
+    indices; approximate (decoded) for compressed ones.
+    """
+    return np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
 
-        delta = today - purchase_date
 
-        if delta.days <= 15:
-            return True, f"Eligible ({delta.days} days since purchase)"
-        else:
-            return False, f"Ineligible ({delta.days} days since purchase. Policy: 15 days)"
+def load_faiss_index(index_path):
+    if not index_path or not os.path.exists(index_path):
+        return None
+    import faiss
+    try:
+        return faiss.read_index(index_path)
+    except:
+        return None
 
 
-# -------------------------------------------------
-# Module 6: Sizes as per Location Enabled
-# -------------------------------------------------
-class SizeConverter:
-    SIZE_MAP = {
-        "US": {"XS": "0-2", "S": "4-6", "M": "8-10", "L": "12-14", "XL": "16+"},
-        "EU": {"XS": "32-34", "S": "36-38", "M": "40-42", "L": "44-46", "XL": "48+"},
-        "UK": {"XS": "4-6", "S": "8-10", "M": "12-14", "L": "16-18", "XL": "20+"},
-        "JP": {"XS": "5-7", "S": "9", "M": "11", "L": "13", "XL": "15"},
-    }
+# Vector storage layouts for build_faiss_index:
+#   flat   - float32, exact (4 bytes/dim)
+#   fp16   - half-precision scalar quantizer (2 bytes/dim)
+#   sq8    - 8-bit scalar quantizer (1 byte/dim)
+#   opq_pq - OPQ rotation + product quantizer (pq_m bytes/vector)
+INDEX_STORAGE_OPTIONS = ("flat", "fp16", "sq8", "opq_pq")
 
-    @staticmethod
-    def convert(size_key, region="US"):
-        region_map = SizeConverter.SIZE_MAP.get(region, SizeConverter.SIZE_MAP["US"])
-        local_size = region_map.get(size_key, size_key)
-        return f"{region} {local_size} ({size_key})"
 
+def full_precision_path(index_path):
+    """Sidecar .npy of exact float32 vectors, memory-mapped at query time for re-ranking."""
+    return f"{index_path}.vectors.npy"
 
-# -------------------------------------------------
-# Module 7: Customer Rewards Logic
-# -------------------------------------------------
-class RewardSystem:
-    @staticmethod
-    def calculate_points(action_type, amount=0):
-        if action_type == "purchase":
-            return int(amount)
-        rewards = {
-            "review": 50,
-            "share": 25,
-            "ar_try_on": 10,
-            "eco_choice": 15
-        }
-        return rewards.get(action_type, 0)
 
+def make_faiss_index(embs, storage="flat", pq_m=None, pca_dim=None):
+    """Builds (and trains, if needed) an inner-product index over normalised `embs`."""
+    index = train_faiss_index(embs, storage=storage, pq_m=pq_m, pca_dim=pca_dim)
+    index.add(embs)
+    return index
 
-# -------------------------------------------------
-# Load products from CSV
-# -------------------------------------------------
-def load_products(csv_path="sample_data/products.csv"):
-    if not os.path.exists(csv_path):
-        data = {
-            "id": [1, 2, 3, 4, 5, 6, 7, 8],
-            "title": ["Eco-Hemp Jacket", "Urban Glide Sneakers", "Midnight Gala Dress", "Smart Wool Blazer",
-                      "Boho Summer Tunic", "Basic Cotton Tee", "Silk Scarf", "Running Socks"],
-            "category": ["Men's Fashion", "Footwear", "Women's Fashion", "Men's Fashion", "Women's Fashion", "Unisex",
-                         "Accessories", "Accessories"],
-            "description": ["Sustainable hemp fiber jacket.", "High-tech running shoes.", "Elegant evening wear.",
-                            "Professional office attire (Wool).", "Lightweight summer vibe (Linen).",
-                            "100% Organic Cotton.", "Pure Silk.", "Moisture wicking synthetic."],
-            "price": [120.00, 85.00, 250.00, 180.00, 45.00, 25.00, 40.00, 12.00],
-            "image_url": ["", "", "", "", "", "", "", ""],
-            "attributes": ["Sustainable", "Sporty", "Formal", "Business", "Casual", "Basic", "Luxury", "Sport"]
-        }
-        return pd.DataFrame(data)
-    return pd.read_csv(csv_path)
 
+def train_faiss_index(embs, storage="flat", pq_m=None, pca_dim=None):
+    """
+    Empty inner-product index, trained on the normalised sample `embs`
+    where the storage needs it. With `pca_dim`, a PCA projection (+
+    re-normalisation) trained on `embs` is stored inside the index as a
+    pre-transform, so added vectors and queries are projected identically.
+    """
+    import faiss
+    if pca_dim:
+        if pca_dim > min(embs.shape):
+            raise ValueError(f"pca_dim={pca_dim} needs at least that many vectors and input dimensions, "
+                             f"got {embs.shape[0]} x {embs.shape[1]}")
+        pca = faiss.PCAMatrix(embs.shape[1], pca_dim)
+        pca.train(embs)
+        reduced = pca.apply(embs)
+        faiss.normalize_L2(reduced)
+        index = faiss.IndexPreTransform(faiss.NormalizationTransform(pca_dim, 2.0),
+                                        train_faiss_index(reduced, storage=storage, pq_m=pq_m))
+        index.prepend_transform(pca)
+        return index
+
+    n, d = embs.shape
+    metric = faiss.METRIC_INNER_PRODUCT
+    if storage == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif storage == "fp16":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, metric)
+    elif storage == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, metric)
+    elif storage == "opq_pq":
+        pq_m = pq_m or next(m for m in (d // 16, d // 8, d // 4, d) if m and d % m == 0)
+        if n >= max(256, 2 * d):
+            index = faiss.index_factory(d, f"OPQ{pq_m},PQ{pq_m}", metric)
+        else:
+            # 8-bit codebooks need >= 256 training points and the OPQ rotation
+            # fails natively on fewer points than dimensions; small samples
+            # get plain PQ with smaller codebooks instead.
+            nbits = int(max(1, np.floor(np.log2(max(n, 2)))))
+            logger.warning("Only %d vectors: using PQ%dx%d without OPQ.", n, pq_m, nbits)
+            index = faiss.index_factory(d, f"PQ{pq_m}x{nbits}", metric)
+    else:
+        raise ValueError(f"Unknown storage '{storage}', expected one of {INDEX_STORAGE_OPTIONS}")
 
-def fetch_product_by_id(product_id, csv_path="sample_data/products.csv"):
-    df = load_products(csv_path)
-    try:
-        row = df[df["id"].astype(str) == str(product_id)]
-    except KeyError:
-        return None
+    if not index.is_trained:
+        index.train(embs)
+    return index
 
-    if row.empty: return None
 
-    row = row.iloc[0]
+def evaluate_index(index, embs, k=10, n_queries=200, seed=0):
+    """
+    Compression ratio vs. float32 and recall@k vs. exact search, using a
+    sample of the stored (normalised) vectors as queries.
+    """
+    import faiss
+    n, d = embs.shape
+    rng = np.random.default_rng(seed)
+    queries = embs[rng.choice(n, size=min(n_queries, n), replace=False)]
+    k = min(k, n)
+
+    exact = faiss.IndexFlatIP(d)
+    exact.add(embs)
+    _, truth = exact.search(queries, k)
+    start = time.perf_counter()
+    for q in queries:
+        index.search(q[np.newaxis, :], k)
+    ms_per_query = (time.perf_counter() - start) * 1000 / len(queries)
+    _, approx = index.search(queries, k)
+    recall = np.mean([len(set(t) & set(a)) / k for t, a in zip(truth.tolist(), approx.tolist())])
+
+    index_bytes = faiss.serialize_index(index).nbytes
     return {
-        "id": str(row["id"]),
-        "title": row["title"],
-        "category": row["category"],
-        "description": row["description"],
-        "price": float(row["price"]),
-        "image_url": row.get("image_url", ""),
-        "attributes": row.get("attributes", "")
+        "search_dim": index.index.d if isinstance(index, faiss.IndexPreTransform) else index.d,
+        "ms_per_query": round(ms_per_query, 4),
+        "storage_bytes": int(index_bytes),
+        "float32_bytes": int(embs.nbytes),
+        "compression_ratio": round(embs.nbytes / index_bytes, 2),
+        f"recall@{k}": round(float(recall), 4),
+        "recall_loss": round(1.0 - float(recall), 4)
     }
 
 
-# -------------------------------------------------
-# Embeddings & FAISS
-# -------------------------------------------------
-def get_embeddings(texts, model="openai"):
-    api_key = os.getenv("OPENAI_API_KEY")
-    if model == "openai" and api_key:
-        openai.api_key = api_key
-        try:
-            resp = openai.Embedding.create(model="text-embedding-3-small", input=texts)
-            embs = [r["embedding"] for r in resp["data"]]
-        except Exception as e:
-            print(f"OpenAI Error: {e}, falling back.")
-            embs = [np.random.rand(1536) for _ in texts]
-    elif model == "local":
-        try:
-            embedder = SentenceTransformer(
-                "all-MiniLM-L6-v2",
-                device="cpu"
-            )
-            embs = embedder.encode(texts, show_progress_bar=False, convert_to_numpy=True)
-        except ImportError:
-            embs = [np.random.rand(384) for _ in texts]
-    else:
-        embs = [np.random.rand(1536) for _ in texts]
+class FaissIndexBuilder:
+    """
+    Incremental build_faiss_index: add() embeds a batch of texts and
+    appends it to the index, so a catalog can be indexed chunk by chunk in
+    bounded memory. Indices that need training (quantizers, PCA) are
+    trained on the texts of the first add() call, and the compression /
+    recall report is taken on that first chunk. Exact vectors for re-ranking are streamed to
+    a raw sidecar and wrapped as .npy in finish().
+    """
 
-    embs = np.array(embs, dtype=np.float32)
-    return np.ascontiguousarray(embs)
+    def __init__(self, model="openai", save_path="product_index.faiss", storage="flat",
+                 keep_full_precision=False, pq_m=None, dimensions=None, pca_dim=None, embed_batch_size=2048):
+        self.model = model
+        self.save_path = save_path
+        self.storage = storage
+        self.pq_m = pq_m
+        self.dimensions = dimensions
+        self.pca_dim = pca_dim
+        self.embed_batch_size = embed_batch_size
+        self.index = None
+        self.report = None
+        self._raw_path = f"{full_precision_path(save_path)}.part" if keep_full_precision else None
+        self._raw = open(self._raw_path, "wb") if self._raw_path else None
+
+    def add(self, texts):
+        import faiss
+        if not len(texts):
+            return self
+        embs = np.concatenate([
+            get_embeddings(texts[start:start + self.embed_batch_size], model=self.model, dimensions=self.dimensions,
+                           strict=True)
+            for start in range(0, len(texts), self.embed_batch_size)
+        ])
+        faiss.normalize_L2(embs)
+        if self.index is None:
+            self.index = train_faiss_index(embs, storage=self.storage, pq_m=self.pq_m, pca_dim=self.pca_dim)
+            self.index.add(embs)
+            if self.storage != "flat" or self.pca_dim:
+                self.report = evaluate_index(self.index, embs)
+        else:
+            self.index.add(embs)
+        if self._raw:
+            self._raw.write(embs.tobytes())
+        return self
+
+    def finish(self):
+        import faiss
+        if self.index is None:
+            raise ValueError(f"No vectors were added to {self.save_path}")
+        faiss.write_index(self.index, self.save_path)
+        if self._raw:
+            self._raw.close()
+            self._write_npy(self._raw_path, full_precision_path(self.save_path),
+                            (self.index.ntotal, self.index.d))
+            os.remove(self._raw_path)
+        if self.report:
+            logger.info("Index %s (%s): %s", self.save_path, self.storage, self.report)
+        return self.index
 
+    @staticmethod
+    def _write_npy(raw_path, path, shape, block_size=1 << 24):
+        with open(path, "wb") as out, open(raw_path, "rb") as raw:
+            np.lib.format.write_array_header_1_0(
+                out, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)), "fortran_order": False,
+                      "shape": shape})
+            for block in iter(lambda: raw.read(block_size), b""):
+                out.write(block)
 
-def load_faiss_index(index_path):
-    try:
-        return faiss.read_index(index_path)
-    except:
+
+def build_faiss_index(texts, model="openai", save_path="product_index.faiss", storage="flat",
+                      keep_full_precision=False, pq_m=None, dimensions=None, pca_dim=None):
+    """
+    Two ways to search fewer dimensions: `dimensions` requests shortened
+    OpenAI embeddings (the index's d then tells the agent what to request
+    at query time), `pca_dim` learns a local PCA stored in the index.
+    """
+    return FaissIndexBuilder(model=model, save_path=save_path, storage=storage,
+                             keep_full_precision=keep_full_precision, pq_m=pq_m, dimensions=dimensions,
+                             pca_dim=pca_dim).add(texts).finish()
+
+
+def load_full_precision_vectors(index_path):
+    """Memory-mapped exact vectors saved by build_faiss_index(keep_full_precision=True), or None."""
+    path = full_precision_path(index_path)
+    if not os.path.exists(path):
         return None
+    return np.load(path, mmap_mode="r")
 
 
-def build_faiss_index(texts, model="openai", save_path="product_index.faiss"):
-    embs = get_embeddings(texts, model=model)
-    faiss.normalize_L2(embs)
-    d = embs.shape[1]
-    index = faiss.IndexFlatIP(d)
-    index.add(embs)
-    faiss.write_index(index, save_path)
-    return index
+@timed("topk_products_from_index")
+def topk_products_from_index(index, query_emb, k=6, rerank_vectors=None, shortlist=4):
+    """
+    Top-k by inner product. With `rerank_vectors` (exact float32 rows, e.g.
+    a memory map), a k * shortlist candidate list from the compressed index
+    is re-scored against the exact vectors.
+    """
+    ids, sims = topk_batch_from_index(index, query_emb, k=k, rerank_vectors=rerank_vectors, shortlist=shortlist)
+    return ids[0], sims[0]
 
 
-def topk_products_from_index(index, query_emb, k=6):
-    q = np.array(query_emb, dtype=np.float32)
+def topk_batch_from_index(index, query_embs, k=6, rerank_vectors=None, shortlist=4):
+    """topk_products_from_index for many queries in one index search: per-query lists of rows and scores."""
+    import faiss
+    q = np.array(query_embs, dtype=np.float32)
     if q.ndim == 1: q = q[np.newaxis, :]
     faiss.normalize_L2(q)
-    D, I = index.search(q, k)
-    return I[0].tolist(), D[0].tolist()
\ No newline at end of file
+    if rerank_vectors is None:
+        D, I = index.search(q, k)
+        return I.tolist(), D.tolist()
+
+    _, I = index.search(q, k * shortlist)
+    ids, sims = [], []
+    for qi, row in zip(q, I):
+        candidates = np.sort(row[row >= 0])  # ascending rows read the memory map sequentially
+        exact = np.asarray(rerank_vectors[candidates]) @ qi
+        order = np.argsort(-exact)[:k]
+        ids.append(candidates[order].tolist())
+        sims.append(exact[order].tolist())
+    return ids, sims